@@ -1,6 +1,35 @@
 from panda3d.core import Vec3
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # Utility functions that are useful to both AI and client CartesianGrid code
 
+
+# radius -> list of the (colOffset, rowOffset) of the cells exactly radius
+# cells away from a cell, in the order getConcentricZones() returns them
+_ringOffsets = {}
+
+
+def _getRingOffsets(radius):
+    offsets = _ringOffsets.get(radius)
+    if offsets is None:
+        offsets = []
+        for colOffset in range(-radius, radius + 1):
+            if abs(colOffset) == radius:
+                # at either left or right edge of the ring, all rows
+                rowOffsets = range(-radius, radius + 1)
+            else:
+                # in a middle column, only the top and bottom rows
+                rowOffsets = (-radius, radius)
+            for rowOffset in rowOffsets:
+                offsets.append((colOffset, rowOffset))
+        _ringOffsets[radius] = offsets
+    return offsets
+
+
 class CartesianGridBase:
     def isValidZone(self, zoneId):
         def checkBounds(self=self, zoneId=zoneId):
@@ -34,6 +63,33 @@ class CartesianGridBase:
         else:
             return zoneId
 
+    def getZonesFromXYZ(self, positions, wantRowAndCol=False):
+        # Batch version of getZoneFromXYZ, which needs numpy.  positions
+        # is an array of N positions relative to our own grid origin, of
+        # which only x and y are used; returns an array of N zoneIds.
+        positions = numpy.asarray(positions, dtype=numpy.float64)
+        dx = self.cellWidth * self.gridSize * .5
+        cols = (positions[:, 0] + dx) // self.cellWidth
+        rows = (positions[:, 1] + dx) // self.cellWidth
+        zoneIds = (self.startingZone + ((rows * self.gridSize) + cols)).astype(numpy.int64)
+
+        if wantRowAndCol:
+            return (zoneIds, cols, rows)
+        else:
+            return zoneIds
+
+    def getValidZoneMask(self, zoneIds):
+        # Batch version of isValidZone: returns an array of bools
+        zoneIds = numpy.asarray(zoneIds)
+        inBounds = ((zoneIds >= self.startingZone) &
+                    (zoneIds <= self.startingZone + self.gridSize * self.gridSize - 1))
+        if self.style == "Cartesian":
+            return inBounds
+        elif self.style == "CartesianStated":
+            return inBounds | ((zoneIds >= 0) & (zoneIds < self.startingZone))
+        else:
+            return numpy.zeros(zoneIds.shape, dtype=bool)
+
     def getGridSizeFromSphereRadius(self, sphereRadius, cellWidth, gridRadius):
         # NOTE: This ensures that the grid is at least a "gridRadius" number
         # of cells larger than the trigger sphere that loads the grid.  This
@@ -90,36 +146,12 @@ class CartesianGridBase:
     # Returns:
     #--------------------------------------------------------------------------
     def getConcentricZones(self, zoneId, radius):
-        zones = []
-        #currZone = zoneId + radius
-        #numZones = (2 * radius * 8) + 2
-        # start at upper left
+        # The offsets of the cells in each ring are computed once per
+        # radius; here we only keep those that fall within the grid.
         zone = zoneId - self.startingZone
         row = zone // self.gridSize
         col = zone % self.gridSize
-
-        leftOffset = min(col, radius)
-        rightOffset = min(self.gridSize - (col + 1), radius)
-        topOffset = min(row, radius)
-        bottomOffset = min(self.gridSize - (row + 1), radius)
-
-        #print "starting examination of grid circle of radius %s"%radius
-        ulZone = zoneId - leftOffset - topOffset * self.gridSize
-        #print "left offset is %s and radius is %s"%(leftOffset,radius)
-        for currCol in range(int(rightOffset + leftOffset + 1)):
-            if ((currCol == 0 and leftOffset == radius) or (currCol == rightOffset + leftOffset and rightOffset == radius)):
-                # at either left or right edge of area, look at all rows
-                possibleRows = range(int(bottomOffset + topOffset + 1))
-            else:
-                # in a middle column, only look at top and bottom rows
-                possibleRows = []
-                if topOffset == radius:
-                    possibleRows.append(0)
-                if bottomOffset == radius:
-                    possibleRows.append(bottomOffset + topOffset)
-            #print "on column %s and looking at rows %s"%(currCol,possibleRows)
-            for currRow in possibleRows:
-                newZone = ulZone + (currRow * self.gridSize) + currCol
-                zones.append(int(newZone))
-                #print "   examining zone %s"%newZone
-        return zones
+        gridSize = self.gridSize
+        return [int(zoneId + rowOffset * gridSize + colOffset)
+                for colOffset, rowOffset in _getRingOffsets(int(radius))
+                if 0 <= col + colOffset < gridSize and 0 <= row + rowOffset < gridSize]
@@ -15,9 +15,11 @@ from .MsgTypesCMU import (
     OBJECT_UPDATE_FIELD_CMU,
     REQUEST_GENERATES_CMU,
     SET_DOID_RANGE_CMU,
+    SMOOTH_NODE_BATCH_ACK_CMU,
 )
 from .PyDatagram import PyDatagram
 from .PyDatagramIterator import PyDatagramIterator
+from .SmoothNodeBroadcaster import SmoothNodeBatch
 from panda3d.core import UniqueIdAllocator, Notify, ClockObject
 
 
@@ -58,6 +60,10 @@ class ClientRepository(ClientRepositoryBase):
         # Explicitly-requested interest zones.
         self.interestZones = []
 
+        # The batch the smooth nodes with the QUANTIZED broadcast type
+        # send their positions in; see getSmoothNodeBatch().
+        self.smoothNodeBatch = None
+
     def handleSetDoIdrange(self, di):
         self.doIdBase = di.getUint32()
         self.doIdLast = self.doIdBase + di.getUint32()
@@ -339,6 +345,8 @@ class ClientRepository(ClientRepositoryBase):
             self.handleDelete(di)
         elif msgType == REQUEST_GENERATES_CMU:
             self.handleRequestGenerates(di)
+        elif msgType == SMOOTH_NODE_BATCH_ACK_CMU:
+            self.handleSmoothNodeBatchAck(di)
         else:
             self.handleMessageType(msgType, di)
 
@@ -356,6 +364,17 @@ class ClientRepository(ClientRepositoryBase):
         self.currentSenderId = di.getUint32()
         ClientRepositoryBase.handleUpdateField(self, di)
 
+    def getSmoothNodeBatch(self):
+        """ Returns the SmoothNodeBatch in which the smooth nodes with
+        the QUANTIZED broadcast type send their positions. """
+        if self.smoothNodeBatch is None:
+            self.smoothNodeBatch = SmoothNodeBatch(self)
+        return self.smoothNodeBatch
+
+    def handleSmoothNodeBatchAck(self, di):
+        if self.smoothNodeBatch is not None:
+            self.smoothNodeBatch.handleAck(di.getUint16())
+
     def handleDisable(self, di):
         # Receives a list of doIds.
         while di.getRemainingSize() > 0:
@@ -2,7 +2,7 @@ from direct.directnotify.DirectNotifyGlobal import directNotify
 from direct.task import Task
 from direct.task.TaskManagerGlobal import taskMgr
 from .DistributedNodeAI import DistributedNodeAI
-from .CartesianGridBase import CartesianGridBase
+from .CartesianGridBase import CartesianGridBase, numpy
 
 class DistributedCartesianGridAI(DistributedNodeAI, CartesianGridBase):
     notify = directNotify.newCategory("DistributedCartesianGridAI")
@@ -94,7 +94,8 @@ class DistributedCartesianGridAI(DistributedNodeAI, CartesianGridBase):
 
     def updateGridTask(self, task=None):
         # Run through all grid objects and update their parents if needed
-        missingObjs = []
+        avs = []
+        localPositions = []
         for avId in list(self.gridObjects.keys()):
             av = self.gridObjects[avId]
             # handle a missing object after it is already gone?
@@ -102,16 +103,73 @@ class DistributedCartesianGridAI(DistributedNodeAI, CartesianGridBase):
                 task.setDelay(1.0)
                 del self.gridObjects[avId]
                 continue
-            pos = av.getPos()
-            if (pos[0] < 0 or pos[1] < 0) or \
-               (pos[0] > self.cellWidth or pos[1] > self.cellWidth):
-                # we are out of the bounds of this current cell
-                self.handleAvatarZoneChange(av)
+            avs.append(av)
+            localPositions.append(tuple(av.getPos()))
+
+        if numpy is None:
+            for av, pos in zip(avs, localPositions):
+                if (pos[0] < 0 or pos[1] < 0) or \
+                   (pos[0] > self.cellWidth or pos[1] > self.cellWidth):
+                    # we are out of the bounds of this current cell
+                    self.handleAvatarZoneChange(av)
+        elif avs:
+            # Find the objects that are out of the bounds of their
+            # current cell all at once, and only work out the new zones
+            # of those.
+            localPositions = numpy.array(localPositions)
+            x = localPositions[:, 0]
+            y = localPositions[:, 1]
+            outOfCell = numpy.flatnonzero((x < 0) | (y < 0) |
+                                          (x > self.cellWidth) | (y > self.cellWidth))
+            if len(outOfCell):
+                movedAvs = [avs[i] for i in outOfCell]
+                # A subclass that overrides handleAvatarZoneChange gets it
+                # called for every object out of its cell, as it always has.
+                if type(self).handleAvatarZoneChange is not \
+                   DistributedCartesianGridAI.handleAvatarZoneChange:
+                    for av in movedAvs:
+                        self.handleAvatarZoneChange(av)
+                else:
+                    self.updateObjectZones(
+                        movedAvs, [tuple(av.getPos(self)) for av in movedAvs])
+
         # Do this every second, not every frame
         if task:
             task.setDelay(1.0)
         return Task.again
 
+    def updateObjectZones(self, avs, positions):
+        # Batch version of handleAvatarZoneChange, which needs numpy,
+        # and is not used by updateGridTask if that is overridden.
+        # positions is an array of the positions of avs relative to
+        # this grid.  The zones of all of them are computed at once, and
+        # the objects with a valid zone are passed on to
+        # handleAvatarZoneChanges.  Returns the number of those.
+        zoneIds = self.getZonesFromXYZ(positions)
+        valid = self.getValidZoneMask(zoneIds)
+        if valid.all():
+            return self.handleAvatarZoneChanges(avs, zoneIds.tolist())
+
+        for i in numpy.flatnonzero(~valid):
+            self.notify.warning(
+                "%s updateObjectZones %s: not a valid zone (%s) for pos %s" % (
+                self.doId, avs[i].doId, zoneIds[i], tuple(positions[i])))
+        valid = numpy.flatnonzero(valid)
+        return self.handleAvatarZoneChanges(
+            [avs[i] for i in valid], zoneIds[valid].tolist())
+
+    def handleAvatarZoneChanges(self, avs, zoneIds):
+        # Sets the location of each of the avs to the matching zoneId,
+        # which has already been validated, and returns how many there
+        # were.  The location is set even if the zone did not change,
+        # since an object out of its cell may have a stale cell parent,
+        # which setLocation repairs.  Override this to send the updates
+        # in some other way.
+        doId = self.doId
+        for av, zoneId in zip(avs, zoneIds):
+            av.b_setLocation(doId, zoneId)
+        return len(avs)
+
     def handleAvatarZoneChange(self, av, useZoneId=-1):
         # Calculate zone id
         # Get position of av relative to this grid
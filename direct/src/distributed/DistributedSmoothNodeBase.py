@@ -1,9 +1,11 @@
 """DistributedSmoothNodeBase module: contains the DistributedSmoothNodeBase class"""
 
 from .ClockDelta import globalClockDelta
+from .SmoothNodeBroadcaster import globalSmoothNodeBroadcaster, QuantizedPosHprEncoder
 from direct.task import Task
 from direct.task.TaskManagerGlobal import taskMgr
 from direct.showbase.PythonUtil import randFloat
+from panda3d.core import ConfigVariableBool
 from panda3d.direct import CDistributedSmoothNodeBase
 
 from enum import IntEnum
@@ -16,6 +18,11 @@ class DummyTaskClass:
 
 DummyTask = DummyTaskClass()
 
+# If this is true, all smooth nodes broadcast from the one task of the
+# globalSmoothNodeBroadcaster, instead of from a task of their own.  Nodes
+# with the QUANTIZED broadcast type always do.
+_smooth_node_shared_broadcast = ConfigVariableBool('smooth-node-shared-broadcast', False)
+
 
 class DistributedSmoothNodeBase:
     """common base class for DistributedSmoothNode and DistributedSmoothNodeAI
@@ -25,6 +32,10 @@ class DistributedSmoothNodeBase:
         FULL = 0
         XYH = 1
         XY = 2
+        # Like FULL, but compares positions as the DC file quantizes them,
+        # and sends them in one SmoothNodeBatch per frame, as deltas.  Only
+        # for a repository with getSmoothNodeBatch(); elsewhere it is FULL.
+        QUANTIZED = 3
 
     def __init__(self):
         self.__broadcastPeriod = None
@@ -32,6 +43,7 @@ class DistributedSmoothNodeBase:
     def generate(self):
         self.cnode = CDistributedSmoothNodeBase()
         self.cnode.setClockDelta(globalClockDelta)
+        self.qnode = None
         self.d_broadcastPosHpr = None
 
     def disable(self):
@@ -65,8 +77,10 @@ class DistributedSmoothNodeBase:
 
     def stopPosHprBroadcast(self):
         taskMgr.remove(self.getPosHprBroadcastTaskName())
+        globalSmoothNodeBroadcaster.remove(self)
         # Delete this callback because it maintains a reference to self
         self.d_broadcastPosHpr = None
+        self.qnode = None
 
     def posHprBroadcastStarted(self):
         return self.d_broadcastPosHpr is not None
@@ -84,13 +98,21 @@ class DistributedSmoothNodeBase:
         # set the broadcast type
         self.broadcastType = type
 
-        broadcastFuncs = {
-            BT.FULL: self.cnode.broadcastPosHprFull,
-            BT.XYH:  self.cnode.broadcastPosHprXyh,
-            BT.XY:  self.cnode.broadcastPosHprXy,
-        }
-        # this comment is here so it will show up in a grep for 'def d_broadcastPosHpr'
-        self.d_broadcastPosHpr = broadcastFuncs[self.broadcastType]
+        if self.broadcastType == BT.QUANTIZED and \
+           hasattr(self.cr, 'getSmoothNodeBatch'):
+            self.qnode = QuantizedPosHprEncoder(
+                self, self.doId, self.cnode.getCurrL, self.cr.getSmoothNodeBatch())
+            self.d_broadcastPosHpr = self.qnode.broadcastPosHpr
+        else:
+            self.qnode = None
+            broadcastFuncs = {
+                BT.FULL: self.cnode.broadcastPosHprFull,
+                BT.XYH:  self.cnode.broadcastPosHprXyh,
+                BT.XY:  self.cnode.broadcastPosHprXy,
+                BT.QUANTIZED: self.cnode.broadcastPosHprFull,
+            }
+            # this comment is here so it will show up in a grep for 'def d_broadcastPosHpr'
+            self.d_broadcastPosHpr = broadcastFuncs[self.broadcastType]
 
         # Set stagger to non-zero to randomly delay the initial task execution
         # over 'period' seconds, to spread out task processing over time
@@ -99,6 +121,8 @@ class DistributedSmoothNodeBase:
 
         # Set up telemetry optimization variables
         self.cnode.initialize(self, self.dclass, self.doId)
+        if self.qnode is not None:
+            self.qnode.initialize()
 
         self.setPosHprBroadcastPeriod(period)
         # Broadcast our initial position
@@ -107,13 +131,17 @@ class DistributedSmoothNodeBase:
 
         # remove any old tasks
         taskMgr.remove(taskName)
+        globalSmoothNodeBroadcaster.remove(self)
         # spawn the new task
         delay = 0.
         if stagger:
             delay = randFloat(period)
         if self.wantSmoothPosBroadcastTask():
-            taskMgr.doMethodLater(self.__broadcastPeriod + delay,
-                                  self._posHprBroadcast, taskName)
+            if self.qnode is not None or _smooth_node_shared_broadcast.value:
+                globalSmoothNodeBroadcaster.add(self, delay)
+            else:
+                taskMgr.doMethodLater(self.__broadcastPeriod + delay,
+                                      self._posHprBroadcast, taskName)
 
     def _posHprBroadcast(self, task=DummyTask):
         # TODO: we explicitly stagger the initial task timing in
@@ -125,6 +153,10 @@ class DistributedSmoothNodeBase:
 
     def sendCurrentPosition(self):
         # if we're not currently broadcasting, make sure things are set up
-        if self.d_broadcastPosHpr is None:
+        if self.d_broadcastPosHpr is None or self.qnode is not None:
+            # With the QUANTIZED type, the cnode doesn't know where we
+            # have been since the broadcast started.
             self.cnode.initialize(self, self.dclass, self.doId)
+            if self.qnode is not None:
+                self.qnode.initialize()
         self.cnode.sendEverything()
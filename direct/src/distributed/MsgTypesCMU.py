@@ -17,6 +17,8 @@ CLIENT_SET_INTEREST_CMU                 = 9009
 OBJECT_SET_ZONE_CMU                     = 9010
 CLIENT_HEARTBEAT_CMU                    = 9011
 CLIENT_OBJECT_UPDATE_FIELD_TARGETED_CMU  = 9011
+CLIENT_SMOOTH_NODE_BATCH_CMU            = 9012
+SMOOTH_NODE_BATCH_ACK_CMU               = 9013
 
 CLIENT_OBJECT_UPDATE_FIELD = 120  # Matches MsgTypes.CLIENT_OBJECT_SET_FIELD
 
@@ -5,6 +5,7 @@ from panda3d.core import (
     ConfigVariableDouble,
     ConfigVariableInt,
     ConnectionWriter,
+    Datagram,
     DatagramIterator,
     Filename,
     NetAddress,
@@ -25,6 +26,7 @@ from direct.distributed.MsgTypesCMU import (
     CLIENT_OBJECT_UPDATE_FIELD,
     CLIENT_OBJECT_UPDATE_FIELD_TARGETED_CMU,
     CLIENT_SET_INTEREST_CMU,
+    CLIENT_SMOOTH_NODE_BATCH_CMU,
     OBJECT_DELETE_CMU,
     OBJECT_DISABLE_CMU,
     OBJECT_GENERATE_CMU,
@@ -32,16 +34,33 @@ from direct.distributed.MsgTypesCMU import (
     OBJECT_UPDATE_FIELD_CMU,
     REQUEST_GENERATES_CMU,
     SET_DOID_RANGE_CMU,
+    SMOOTH_NODE_BATCH_ACK_CMU,
 )
+from direct.distributed.SmoothNodeBroadcaster import SmoothNodeBatchDecoder
 from direct.task import Task
 from direct.task.TaskManagerGlobal import taskMgr
 from direct.directnotify import DirectNotifyGlobal
 from direct.distributed.PyDatagram import PyDatagram
 
 import inspect
+import struct
 
 
 _server_doid_range = ConfigVariableInt('server-doid-range', 1000000)
+_server_batch_sends = ConfigVariableBool('server-batch-sends', True)
+_server_generate_requests_per_frame = ConfigVariableInt('server-generate-requests-per-frame', 500)
+
+# The TCP headers of each header size; see frameData().
+_tcpHeaderPackers = {
+    2: struct.Struct('<H').pack,
+    4: struct.Struct('<I').pack,
+}
+
+_packGenerateHeader = struct.Struct('<HIIHI').pack
+_packUpdateHeader = struct.Struct('<HIIH').pack
+_packZoneMessage = struct.Struct('<HI').pack
+_packUint16 = struct.Struct('<H').pack
+_packSmoothNodeBatchAck = struct.Struct('<HH').pack
 
 
 class ServerRepository:
@@ -94,6 +113,14 @@ class ServerRepository:
             # objects created by this client.
             self.objectsByZoneId = {}
 
+            # The framed messages queued for the client this frame,
+            # which are written to it together by sendQueuedTask().
+            self.pendingSends = []
+
+            # The SmoothNodeBatchDecoder of the smooth node positions
+            # the client sends, once it has sent any.
+            self.smoothNodeDecoder = None
+
     class Object:
         """ This internal class keeps track of the data associated
         with each extent distributed object. """
@@ -129,6 +156,11 @@ class ServerRepository:
         self.qcr = QueuedConnectionReader(self.qcm, numThreads)
         self.cw = ConnectionWriter(self.qcm, numThreads)
 
+        # Messages queued for a client are framed here, so they go
+        # through a writer that adds no header of its own.
+        self.rawCw = ConnectionWriter(self.qcm, numThreads)
+        self.rawCw.setRawMode(True)
+
         taskMgr.setupTaskChain('flushTask')
         if threadedNet:
             taskMgr.setupTaskChain('flushTask', numThreads = 1,
@@ -145,6 +177,23 @@ class ServerRepository:
         # need to be flushed.
         self.needsFlush = set()
 
+        # If this is true, the messages sent to a client in a frame are
+        # written to it at once, at the end of the frame, instead of
+        # one by one as they are sent.
+        self.batchSends = _server_batch_sends.value
+
+        # A set of clients that have messages in pendingSends.
+        self.needsSend = set()
+        taskMgr.add(self.sendQueuedTask, "serverSendQueuedTask", sort = 20)
+
+        # (classId, fieldId) -> the keywords of the field that decide
+        # where updates to it go; see getFieldMode().
+        self.fieldModes = {}
+
+        # (classId, fieldName) -> fieldId, of the fields sent for
+        # smooth node batches; see handleClientSmoothNodeBatch().
+        self.fieldIdsByName = {}
+
         collectTcpInterval = ConfigVariableDouble('collect-tcp-interval').getValue()
         taskMgr.doMethodLater(collectTcpInterval, self.flushTask, 'flushTask',
                               taskChain = 'flushTask')
@@ -165,6 +214,20 @@ class ServerRepository:
         # distributed objects assigned to each zone, globally.
         self.objectsByZoneId = {}
 
+        # A dictionary of zoneId -> set([Client]), listing the clients
+        # that own at least one object in each zone.
+        self.ownersByZoneId = {}
+
+        # A dictionary of zoneId -> set([Client]), listing the clients
+        # that have opened interest in each zone and are waiting for
+        # its objects to be generated again; see requestGenerates().
+        self.pendingGenerateRequests = {}
+
+        # The most REQUEST_GENERATES messages to send out in one
+        # frame, or 0 for no limit.
+        self.maxGenerateRequests = _server_generate_requests_per_frame.value
+        taskMgr.add(self.generateRequestTask, "serverGenerateRequestTask", sort = 15)
+
         # The number of doId's to assign to each client.  Must remain
         # constant during server lifetime.
         self.doIdRange = _server_doid_range.value
@@ -204,6 +267,65 @@ class ServerRepository:
         setTcpHeaderSize(). """
         return self.qcr.getTcpHeaderSize()
 
+    def frameData(self, data):
+        """ Returns the bytes of a message with the TCP header that
+        the ConnectionWriter would put in front of it, ready to be
+        queued for any number of clients with queueFramed().  Returns
+        None if the message is too long for the header size. """
+        headerSize = self.getTcpHeaderSize()
+        if headerSize == 0:
+            return bytes(data)
+        if len(data) >= 1 << (headerSize * 8):
+            self.notify.warning(
+                "Dropping message of %s bytes; too long for a TCP header of %s bytes" % (
+                len(data), headerSize))
+            return None
+        return _tcpHeaderPackers[headerSize](len(data)) + data
+
+    def queueFramed(self, clients, framed):
+        """ Queues a message returned by frameData() for each of the
+        indicated clients.  Unless batchSends is false, it is written
+        with the rest of the frame's messages to the same client by
+        sendQueuedTask(). """
+        if framed is None:
+            return
+        if not self.batchSends:
+            datagram = Datagram(framed)
+            for client in clients:
+                self.rawCw.send(datagram, client.connection)
+                self.needsFlush.add(client)
+            return
+
+        for client in clients:
+            client.pendingSends.append(framed)
+        self.needsSend.update(clients)
+
+    def sendToClient(self, client, datagram):
+        """ Sends a message to one client.  Messages to a client
+        should all go through here or queueFramed(), so that they stay
+        in order. """
+        self.queueFramed((client, ), self.frameData(datagram.getMessage()))
+
+    def sendQueuedTask(self, task):
+        """ Writes out the messages queued for each client this
+        frame, one write per client. """
+        needsSend = self.needsSend
+        if not needsSend:
+            return Task.cont
+        self.needsSend = set()
+
+        for client in needsSend:
+            pendingSends = client.pendingSends
+            client.pendingSends = []
+            if len(pendingSends) == 1:
+                data = pendingSends[0]
+            else:
+                data = b''.join(pendingSends)
+            self.rawCw.send(Datagram(data), client.connection)
+        self.needsFlush |= needsSend
+
+        return Task.cont
+
 
     def importModule(self, dcImports, moduleName, importSymbols):
         """ Imports the indicated moduleName and all of its symbols
@@ -412,6 +534,8 @@ class ServerRepository:
             self.handleClientDeleteObject(datagram, dgi.getUint32())
         elif type == OBJECT_SET_ZONE_CMU:
             self.handleClientObjectSetZone(datagram, dgi)
+        elif type == CLIENT_SMOOTH_NODE_BATCH_CMU:
+            self.handleClientSmoothNodeBatch(client, dgi)
         else:
             self.handleMessageType(type, dgi)
 
@@ -454,23 +578,14 @@ class ServerRepository:
 
             object = self.Object(doId, zoneId, dclass)
             client.objectsByDoId[doId] = object
-            client.objectsByZoneId.setdefault(zoneId, set()).add(object)
-            self.objectsByZoneId.setdefault(zoneId, set()).add(object)
+            self.addObjectToZone(client, object, zoneId)
 
-            self.updateClientInterestZones(client)
-
-
-        # Rebuild the new datagram that we'll send on.  We shim in the
+        # Rebuild the new message that we'll send on.  We shim in the
         # doIdBase of the owner.
-        dg = PyDatagram()
-        dg.addUint16(OBJECT_GENERATE_CMU)
-        dg.addUint32(client.doIdBase)
-        dg.addUint32(zoneId)
-        dg.addUint16(classId)
-        dg.addUint32(doId)
-        dg.appendData(dgi.getRemainingBytes())
+        data = _packGenerateHeader(OBJECT_GENERATE_CMU, client.doIdBase,
+                                   zoneId, classId, doId) + dgi.getRemainingBytes()
 
-        self.sendToZoneExcept(zoneId, dg, [client])
+        self.sendDataToZoneExcept(zoneId, data, [client])
 
     def handleClientObjectUpdateField(self, datagram, dgi, targeted = False):
         """ Received an update request from a client. """
@@ -491,15 +606,17 @@ class ServerRepository:
                 doId, client.doIdBase))
             return
 
-        dcfield = object.dclass.getFieldByIndex(fieldId)
-        if dcfield is None:
+        mode = self.getFieldMode(object.dclass.getNumber(), fieldId)
+        if mode is None:
             self.notify.warning(
                 "Ignoring update for field %s on object %s from client %s; no such field for class %s." % (
                 fieldId, doId, client.doIdBase, object.dclass.getName()))
+            return
 
         if client != owner:
             # This message was not sent by the object's owner.
-            if not dcfield.hasKeyword('clsend') and not dcfield.hasKeyword('p2p'):
+            if not mode.startswith('p2p') and not mode.endswith('+clsend'):
+                dcfield = object.dclass.getFieldByIndex(fieldId)
                 self.notify.warning(
                     "Ignoring update for %s.%s on object %s from client %s: not owner" % (
                     object.dclass.getName(), dcfield.getName(), doId, client.doIdBase))
@@ -507,42 +624,109 @@ class ServerRepository:
 
         # We reformat the message slightly to insert the sender's
         # doIdBase.
-        dg = PyDatagram()
-        dg.addUint16(OBJECT_UPDATE_FIELD_CMU)
-        dg.addUint32(client.doIdBase)
-        dg.addUint32(doId)
-        dg.addUint16(fieldId)
-        dg.appendData(dgi.getRemainingBytes())
+        data = _packUpdateHeader(OBJECT_UPDATE_FIELD_CMU, client.doIdBase,
+                                 doId, fieldId) + dgi.getRemainingBytes()
 
         if targeted:
             # A targeted update: only to the indicated client.
             target = self.clientsByDoIdBase.get(targetId)
             if not target:
+                dcfield = object.dclass.getFieldByIndex(fieldId)
                 self.notify.warning(
                     "Ignoring targeted update to %s for %s.%s on object %s from client %s: target not known" % (
                     targetId,
-                    dclass.getName(), dcfield.getName(), doId, client.doIdBase))
+                    object.dclass.getName(), dcfield.getName(), doId, client.doIdBase))
                 return
-            self.cw.send(dg, target.connection)
-            self.needsFlush.add(target)
+            self.queueFramed((target, ), self.frameData(data))
 
-        elif dcfield.hasKeyword('p2p'):
+        elif mode.startswith('p2p'):
             # p2p: to object owner only
-            self.cw.send(dg, owner.connection)
-            self.needsFlush.add(owner)
+            self.queueFramed((owner, ), self.frameData(data))
 
-        elif dcfield.hasKeyword('broadcast'):
+        elif mode.startswith('broadcast'):
             # Broadcast: to everyone except orig sender
-            self.sendToZoneExcept(object.zoneId, dg, [client])
+            self.sendDataToZoneExcept(object.zoneId, data, [client])
 
-        elif dcfield.hasKeyword('reflect'):
+        elif mode.startswith('reflect'):
             # Reflect: broadcast to everyone including orig sender
-            self.sendToZoneExcept(object.zoneId, dg, [])
+            self.sendDataToZoneExcept(object.zoneId, data, [])
 
         else:
             self.notify.warning(
                 "Message is not broadcast or p2p")
 
+    def handleClientSmoothNodeBatch(self, client, dgi):
+        """ The client has sent the positions of its smooth nodes in a
+        SmoothNodeBatch.  Each of them is sent on as the setSm* update
+        it stands for, and the batch is acknowledged, so that the client
+        can take its next deltas against it. """
+        decoder = client.smoothNodeDecoder
+        if decoder is None:
+            decoder = client.smoothNodeDecoder = SmoothNodeBatchDecoder()
+        sequence, updates = decoder.decode(dgi.getRemainingBytes())
+
+        for doId, fieldName, args in updates:
+            self.sendSmoothNodeUpdate(client, doId, fieldName, args)
+
+        self.queueFramed((client, ), self.frameData(
+            _packSmoothNodeBatchAck(SMOOTH_NODE_BATCH_ACK_CMU, sequence)))
+
+    def sendSmoothNodeUpdate(self, client, doId, fieldName, args):
+        """ Sends an update of one of the client's smooth nodes, from a
+        SmoothNodeBatch, to the other clients interested in its zone. """
+        object = client.objectsByDoId.get(doId)
+        if not object:
+            self.notify.warning(
+                "Ignoring smooth node update for unknown object %s from client %s" % (
+                doId, client.doIdBase))
+            return
+        fieldId = self.getFieldIdByName(object.dclass.getNumber(), fieldName)
+        if fieldId is None:
+            self.notify.warning(
+                "Ignoring smooth node update for object %s from client %s; no field %s for class %s." % (
+                doId, client.doIdBase, fieldName, object.dclass.getName()))
+            return
+        data = _packUpdateHeader(OBJECT_UPDATE_FIELD_CMU, client.doIdBase,
+                                 doId, fieldId) + args
+        self.sendDataToZoneExcept(object.zoneId, data, [client])
+
+    def getFieldIdByName(self, classId, fieldName):
+        """ Returns the number of the indicated field of the class, or
+        None if it has no such field.  The result is cached. """
+        key = (classId, fieldName)
+        if key in self.fieldIdsByName:
+            return self.fieldIdsByName[key]
+
+        fieldId = None
+        dcfield = self.dclassesByNumber[classId].getFieldByName(fieldName)
+        if dcfield is not None:
+            fieldId = dcfield.getNumber()
+        self.fieldIdsByName[key] = fieldId
+        return fieldId
+
+    def getFieldMode(self, classId, fieldId):
+        """ Returns the keyword that decides where updates to the
+        field go: 'p2p', 'broadcast', 'reflect' or '', followed by
+        '+clsend' if the field has that keyword too.  Returns None if
+        the class has no such field.  The result is cached, since the
+        field's keywords cannot change. """
+        key = (classId, fieldId)
+        if key in self.fieldModes:
+            return self.fieldModes[key]
+
+        mode = None
+        dcfield = self.dclassesByNumber[classId].getFieldByIndex(fieldId)
+        if dcfield is not None:
+            mode = ''
+            for keyword in ('p2p', 'broadcast', 'reflect'):
+                if dcfield.hasKeyword(keyword):
+                    mode = keyword
+                    break
+            if dcfield.hasKeyword('clsend'):
+                mode += '+clsend'
+        self.fieldModes[key] = mode
+        return mode
+
     def getDoIdBase(self, doId):
         """ Given a doId, return the corresponding doIdBase.  This
         will be the owner of the object (clients may only create
@@ -565,15 +749,10 @@ class ServerRepository:
 
         self.sendToZoneExcept(object.zoneId, datagram, [])
 
-        self.objectsByZoneId[object.zoneId].remove(object)
-        if not self.objectsByZoneId[object.zoneId]:
-            del self.objectsByZoneId[object.zoneId]
-        client.objectsByZoneId[object.zoneId].remove(object)
-        if not client.objectsByZoneId[object.zoneId]:
-            del client.objectsByZoneId[object.zoneId]
+        self.removeObjectFromZone(client, object)
         del client.objectsByDoId[doId]
-
-        self.updateClientInterestZones(client)
+        if client.smoothNodeDecoder is not None:
+            client.smoothNodeDecoder.removeNode(doId)
 
     def handleClientObjectSetZone(self, datagram, dgi):
         """ The client is telling us the object is changing to a new
@@ -597,18 +776,13 @@ class ServerRepository:
             return
 
         oldZoneId = object.zoneId
-        self.objectsByZoneId[object.zoneId].remove(object)
-        if not self.objectsByZoneId[object.zoneId]:
-            del self.objectsByZoneId[object.zoneId]
-        owner.objectsByZoneId[object.zoneId].remove(object)
-        if not owner.objectsByZoneId[object.zoneId]:
-            del owner.objectsByZoneId[object.zoneId]
-
-        object.zoneId = zoneId
-        self.objectsByZoneId.setdefault(zoneId, set()).add(object)
-        owner.objectsByZoneId.setdefault(zoneId, set()).add(object)
-
-        self.updateClientInterestZones(owner)
+        # The new zone is added first, so that the owner does not lose
+        # and regain interest in the same zone.
+        self.removeObjectFromZone(owner, object, updateInterest = False)
+        self.addObjectToZone(owner, object, zoneId)
+        if oldZoneId not in owner.objectsByZoneId and \
+           oldZoneId not in owner.explicitInterestZoneIds:
+            self.changeClientInterestZones(owner, (), (oldZoneId, ))
 
         # Any clients that are listening to oldZoneId but not zoneId
         # should receive a disable message: this object has just gone
@@ -616,11 +790,9 @@ class ServerRepository:
         datagram = PyDatagram()
         datagram.addUint16(OBJECT_DISABLE_CMU)
         datagram.addUint32(object.doId)
-        for client in self.zonesToClients[oldZoneId]:
-            if client != owner:
-                if zoneId not in client.currentInterestZoneIds:
-                    self.cw.send(datagram, client.connection)
-                    self.needsFlush.add(client)
+        self.queueFramed([client for client in self.zonesToClients.get(oldZoneId, ())
+                          if client != owner and zoneId not in client.currentInterestZoneIds],
+                         self.frameData(datagram.getMessage()))
 
         # The client is now responsible for sending a generate for the
         # object that just switched zones, to inform the clients that
@@ -635,8 +807,7 @@ class ServerRepository:
         datagram.addUint32(client.doIdBase)
         datagram.addUint32(self.doIdRange)
 
-        self.cw.send(datagram, client.connection)
-        self.needsFlush.add(client)
+        self.sendToClient(client, datagram)
 
     # a client disconnected from us, we need to update our data, also
     # tell other clients to remove the disconnected clients objects
@@ -647,19 +818,25 @@ class ServerRepository:
             else:
                 self.zonesToClients[zoneId].remove(client)
 
-        for object in client.objectsByDoId.values():
+        client.currentInterestZoneIds = set()
+        client.explicitInterestZoneIds = set()
+
+        for object in list(client.objectsByDoId.values()):
             #create and send delete message
             datagram = NetDatagram()
             datagram.addUint16(OBJECT_DELETE_CMU)
             datagram.addUint32(object.doId)
             self.sendToZoneExcept(object.zoneId, datagram, [])
-            self.objectsByZoneId[object.zoneId].remove(object)
-            if not self.objectsByZoneId[object.zoneId]:
-                del self.objectsByZoneId[object.zoneId]
+            self.removeObjectFromZone(client, object, updateInterest = False)
 
         client.objectsByDoId = {}
         client.objectsByZoneId = {}
 
+        # Whatever is still queued for the client can't be sent now.
+        client.pendingSends = []
+        self.needsSend.discard(client)
+        self.needsFlush.discard(client)
+
         del self.clientsByConnection[client.connection]
         del self.clientsByDoIdBase[client.doIdBase]
 
@@ -679,47 +856,163 @@ class ServerRepository:
             zoneId = dgi.getUint32()
             zoneIds.add(zoneId)
 
+        origZoneIds = client.explicitInterestZoneIds
         client.explicitInterestZoneIds = zoneIds
-        self.updateClientInterestZones(client)
+
+        # Only the zones that are new to the client or that it no
+        # longer has any reason to see need any work.
+        addedZoneIds = [zoneId for zoneId in zoneIds - origZoneIds
+                        if zoneId not in client.currentInterestZoneIds]
+        removedZoneIds = [zoneId for zoneId in origZoneIds - zoneIds
+                          if zoneId not in client.objectsByZoneId]
+        if addedZoneIds or removedZoneIds:
+            self.changeClientInterestZones(client, addedZoneIds, removedZoneIds)
 
     def updateClientInterestZones(self, client):
         """ Something about the client has caused its set of interest
-        zones to potentially change.  Recompute them. """
+        zones to potentially change.  Recompute them.  The handlers in
+        this class keep the interest zones up to date as they go, so
+        this is only needed after changing a client's
+        explicitInterestZoneIds or objectsByZoneId by other means. """
 
         origZoneIds = client.currentInterestZoneIds
-        newZoneIds = client.explicitInterestZoneIds | set(client.objectsByZoneId.keys())
+        newZoneIds = client.explicitInterestZoneIds.union(client.objectsByZoneId)
         if origZoneIds == newZoneIds:
             # No change.
             return
 
-        client.currentInterestZoneIds = newZoneIds
-        addedZoneIds = newZoneIds - origZoneIds
-        removedZoneIds = origZoneIds - newZoneIds
+        self.changeClientInterestZones(client, newZoneIds - origZoneIds,
+                                       origZoneIds - newZoneIds)
+
+    def changeClientInterestZones(self, client, addedZoneIds, removedZoneIds):
+        """ Opens the client's interest in addedZoneIds, and closes it
+        in removedZoneIds.  The work done is proportional to the
+        number of zones changed, and to the number of objects in the
+        removed zones. """
 
+        currentInterestZoneIds = client.currentInterestZoneIds
         for zoneId in addedZoneIds:
+            currentInterestZoneIds.add(zoneId)
             self.zonesToClients.setdefault(zoneId, set()).add(client)
 
             # The client is opening interest in this zone. Need to get
             # all of the data from clients who may have objects in
             # this zone
-            datagram = NetDatagram()
-            datagram.addUint16(REQUEST_GENERATES_CMU)
-            datagram.addUint32(zoneId)
-            self.sendToZoneExcept(zoneId, datagram, [client])
+            self.requestGenerates(zoneId, client)
 
-        datagram = PyDatagram()
-        datagram.addUint16(OBJECT_DISABLE_CMU)
+        doIds = []
         for zoneId in removedZoneIds:
-            self.zonesToClients[zoneId].remove(client)
+            currentInterestZoneIds.discard(zoneId)
+            clients = self.zonesToClients.get(zoneId)
+            if clients is not None:
+                clients.discard(client)
+                if not clients:
+                    del self.zonesToClients[zoneId]
 
             # The client is abandoning interest in this zone.  Any
             # objects in this zone should be disabled for the client.
-            for object in self.objectsByZoneId.get(zoneId, []):
-                datagram.addUint32(object.doId)
-        self.cw.send(datagram, client.connection)
+            objects = self.objectsByZoneId.get(zoneId)
+            if objects:
+                doIds.extend([object.doId for object in objects])
 
-        self.needsFlush.add(client)
+        if doIds:
+            data = _packUint16(OBJECT_DISABLE_CMU) + struct.pack('<%sI' % (len(doIds)), *doIds)
+            self.queueFramed((client, ), self.frameData(data))
 
+    def addObjectToZone(self, owner, object, zoneId):
+        """ Puts the object in the indicated zone, opening its owner's
+        interest in the zone if needed. """
+
+        object.zoneId = zoneId
+        self.objectsByZoneId.setdefault(zoneId, set()).add(object)
+
+        objects = owner.objectsByZoneId.get(zoneId)
+        if objects is not None:
+            objects.add(object)
+            return
+
+        # This is the first object the owner has in this zone.
+        owner.objectsByZoneId[zoneId] = {object}
+        self.ownersByZoneId.setdefault(zoneId, set()).add(owner)
+        if zoneId not in owner.currentInterestZoneIds:
+            self.changeClientInterestZones(owner, (zoneId, ), ())
+
+    def removeObjectFromZone(self, owner, object, updateInterest = True):
+        """ Takes the object out of its zone.  If updateInterest is
+        true and this was the owner's last reason to be interested in
+        the zone, its interest in the zone is closed. """
+
+        zoneId = object.zoneId
+        objects = self.objectsByZoneId[zoneId]
+        objects.remove(object)
+        if not objects:
+            del self.objectsByZoneId[zoneId]
+
+        objects = owner.objectsByZoneId[zoneId]
+        objects.remove(object)
+        if objects:
+            return
+
+        # That was the owner's last object in this zone.
+        del owner.objectsByZoneId[zoneId]
+        owners = self.ownersByZoneId[zoneId]
+        owners.remove(owner)
+        if not owners:
+            del self.ownersByZoneId[zoneId]
+        if updateInterest and zoneId not in owner.explicitInterestZoneIds:
+            self.changeClientInterestZones(owner, (), (zoneId, ))
+
+    def requestGenerates(self, zoneId, client):
+        """ Arranges for the owners of the objects in the indicated
+        zone to generate them again, for the client that has just
+        opened interest in it.  Requests for the same zone are merged
+        until generateRequestTask() sends them out. """
+
+        requesters = self.pendingGenerateRequests.get(zoneId)
+        if requesters is None:
+            self.pendingGenerateRequests[zoneId] = {client}
+        else:
+            requesters.add(client)
+
+    def generateRequestTask(self, task):
+        """ Sends REQUEST_GENERATES_CMU for the zones in
+        pendingGenerateRequests, oldest first.  Only the clients that
+        own objects in a zone answer these, so only they are sent one.
+        No more than maxGenerateRequests are sent in one frame, so
+        that a client opening interest in many crowded zones at once
+        doesn't flood the server with generates; the rest wait for the
+        next frame. """
+
+        pending = self.pendingGenerateRequests
+        budget = self.maxGenerateRequests
+        while pending:
+            zoneId = next(iter(pending))
+            requesters = pending.pop(zoneId)
+
+            owners = self.ownersByZoneId.get(zoneId)
+            if not owners:
+                continue
+
+            # Skip the request if its clients have since lost interest
+            # in the zone, or disconnected.
+            requesters = [client for client in requesters
+                          if zoneId in client.currentInterestZoneIds]
+            if not requesters:
+                continue
+            if len(requesters) == 1:
+                # A client doesn't need to generate its own objects
+                # for itself.
+                owners = owners.difference(requesters)
+                if not owners:
+                    continue
+
+            self.queueFramed(owners, self.frameData(_packZoneMessage(REQUEST_GENERATES_CMU, zoneId)))
+            if budget > 0:
+                budget -= len(owners)
+                if budget <= 0:
+                    break
+
+        return Task.cont
 
     def clientHardDisconnectTask(self, task):
         """ client did not tell us he was leaving but we lost connection to
@@ -732,19 +1025,30 @@ class ServerRepository:
     def sendToZoneExcept(self, zoneId, datagram, exceptionList):
         """sends a message to everyone who has interest in the
         indicated zone, except for the clients on exceptionList."""
+        self.sendDataToZoneExcept(zoneId, datagram.getMessage(), exceptionList)
+
+    def sendDataToZoneExcept(self, zoneId, data, exceptionList):
+        """ Like sendToZoneExcept(), but takes the bytes of the
+        message.  The message is framed once, however many clients it
+        goes to. """
 
         if self.notify.getDebug():
             self.notify.debug(
                 "ServerRepository sending to all in zone %s except %s:" % (zoneId, [c.doIdBase for c in exceptionList]))
-            #datagram.dumpHex(ostream)
 
-        for client in self.zonesToClients.get(zoneId, []):
-            if client not in exceptionList:
-                if self.notify.getDebug():
-                    self.notify.debug(
-                        "  -> %s" % (client.doIdBase))
-                self.cw.send(datagram, client.connection)
-                self.needsFlush.add(client)
+        clients = self.zonesToClients.get(zoneId)
+        if not clients:
+            return
+        if exceptionList:
+            clients = clients.difference(exceptionList)
+            if not clients:
+                return
+
+        if self.notify.getDebug():
+            for client in clients:
+                self.notify.debug(
+                    "  -> %s" % (client.doIdBase))
+        self.queueFramed(clients, self.frameData(data))
 
     def sendToAllExcept(self, datagram, exceptionList):
         """ sends a message to all connected clients, except for
@@ -755,10 +1059,12 @@ class ServerRepository:
                 "ServerRepository sending to all except %s:" % ([c.doIdBase for c in exceptionList],))
             #datagram.dumpHex(ostream)
 
-        for client in self.clientsByConnection.values():
-            if client not in exceptionList:
-                if self.notify.getDebug():
-                    self.notify.debug(
-                        "  -> %s" % (client.doIdBase))
-                self.cw.send(datagram, client.connection)
-                self.needsFlush.add(client)
+        clients = set(self.clientsByConnection.values())
+        if exceptionList:
+            clients.difference_update(exceptionList)
+
+        if self.notify.getDebug():
+            for client in clients:
+                self.notify.debug(
+                    "  -> %s" % (client.doIdBase))
+        self.queueFramed(clients, self.frameData(datagram.getMessage()))
@@ -0,0 +1,131 @@
+"""Measures how a :class:`.ShardedServerRepository` scales with the number
+of shards, without any networking.  Run it with::
+
+    python -m direct.distributed.ShardBenchmark [numClients] [numZones] [seconds] [backend]
+
+A simulated set of clients, each with an object and interest in a few
+zones, broadcast an update every frame through a ShardRouter.  The shards
+frame the updates and join them per recipient; the runs they return are
+queued for each client by the repository's own writeShardOutput(), and
+joined per client as sendQueuedTask() does, short of writing to the
+sockets.  The updates and deliveries per second are printed for
+increasing numbers of shards, with the share of the time the front end
+spends queueing the shards' output."""
+
+from direct.distributed.ServerRepository import ServerRepository
+from direct.distributed.ShardedServerRepository import ShardedServerRepository
+from direct.distributed.ZoneShard import ShardRouter
+import os
+import random
+import sys
+import time
+
+
+class FrontEnd:
+    """ Stands in for a ShardedServerRepository, with just the state that
+    writeShardOutput() uses, so that queueing the shards' output is
+    timed with the repository's own code. """
+
+    notify = ShardedServerRepository.notify
+    writeShardOutput = ShardedServerRepository.writeShardOutput
+    queueFramed = ServerRepository.queueFramed
+    batchSends = True
+
+    def __init__(self, router):
+        self.router = router
+        self.clientsByDoIdBase = {}
+        self.needsSend = set()
+
+    def getTcpHeaderSize(self):
+        return 2
+
+    def addClient(self, doIdBase):
+        self.clientsByDoIdBase[doIdBase] = ServerRepository.Client(None, None, doIdBase)
+        return self.router.addClient(doIdBase)
+
+    def joinQueuedSends(self):
+        # What sendQueuedTask() does before writing to the socket.
+        numBytes = 0
+        for client in self.needsSend:
+            numBytes += len(b''.join(client.pendingSends))
+            client.pendingSends = []
+        self.needsSend = set()
+        return numBytes
+
+
+def runBenchmark(numShards, numClients=2000, numZones=200, zonesPerClient=5,
+                 duration=3.0, backend='process', updateSize=32, seed=0):
+    """ Runs the load for the given number of seconds, and returns
+    (updates per second, deliveries per second, fraction of the time
+    the front end spent queueing the shards' output). """
+    rng = random.Random(seed)
+    router = ShardRouter(numShards, backend, tcpHeaderSize=2)
+    frontEnd = FrontEnd(router)
+    payload = bytes(updateSize)
+    doIdRange = 1000000
+    clock = time.perf_counter
+    try:
+        doIds = []
+        for i in range(numClients):
+            doIdBase = (i + 1) * doIdRange
+            client = frontEnd.addClient(doIdBase)
+            router.setInterest(client, rng.sample(range(numZones), zonesPerClient))
+            doId = doIdBase + 1
+            router.createObject(client, doId, rng.randrange(numZones), 1, payload)
+            doIds.append((doId, (doIdBase, )))
+        router.flush()
+        frontEnd.writeShardOutput(router.collect(wait=True))
+        frontEnd.joinQueuedSends()
+
+        numUpdates = 0
+        numDeliveries = 0
+        fanOutTime = 0.0
+        start = clock()
+        end = start + duration
+        while True:
+            for doId, exceptDoIdBases in doIds:
+                router.broadcast(doId, exceptDoIdBases, payload)
+            router.flush()
+            numUpdates += len(doIds)
+            output = router.collect(wait=True)
+            fanOutStart = clock()
+            frontEnd.writeShardOutput(output)
+            numBytes = frontEnd.joinQueuedSends()
+            fanOutTime += clock() - fanOutStart
+            numDeliveries += numBytes // (updateSize + 2)
+            if clock() >= end:
+                break
+        elapsed = clock() - start
+    finally:
+        router.destroy()
+
+    return numUpdates / elapsed, numDeliveries / elapsed, fanOutTime / elapsed
+
+
+def main(args):
+    numClients = int(args[0]) if len(args) > 0 else 2000
+    numZones = int(args[1]) if len(args) > 1 else 200
+    duration = float(args[2]) if len(args) > 2 else 3.0
+    backend = args[3] if len(args) > 3 else 'process'
+
+    maxShards = max(1, (os.cpu_count() or 2) - 1)
+    counts = [1]
+    while counts[-1] * 2 <= maxShards:
+        counts.append(counts[-1] * 2)
+
+    print('%s clients, %s zones, %.1f s per run, %s shards' % (
+        numClients, numZones, duration, backend))
+    print('%8s %14s %16s %8s %9s' % ('shards', 'updates/s', 'deliveries/s',
+                                     'speedup', 'front end'))
+    baseline = None
+    for numShards in counts:
+        updates, deliveries, fanOut = runBenchmark(
+            numShards, numClients, numZones, duration=duration, backend=backend)
+        if baseline is None:
+            baseline = deliveries
+        print('%8s %14.0f %16.0f %7.2fx %8.0f%%' % (
+            numShards, updates, deliveries, deliveries / baseline, fanOut * 100.0))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,289 @@
+"""ShardedServerRepository module: contains the ShardedServerRepository
+class, a ServerRepository that spreads its zones over several shards."""
+
+from panda3d.core import ConfigVariableInt, ConfigVariableString
+from direct.distributed.MsgTypesCMU import (
+    OBJECT_DELETE_CMU,
+    OBJECT_GENERATE_CMU,
+    OBJECT_UPDATE_FIELD_CMU,
+)
+from direct.distributed.ServerRepository import ServerRepository
+from direct.distributed.ZoneShard import ShardRouter
+from direct.task import Task
+from direct.task.TaskManagerGlobal import taskMgr
+from direct.directnotify import DirectNotifyGlobal
+
+import multiprocessing
+import os
+import struct
+
+
+_packDelete = struct.Struct('<HI').pack
+_packGenerateHeader = struct.Struct('<HIIHI').pack
+_packUpdateHeader = struct.Struct('<HIIH').pack
+
+
+class ShardedServerRepository(ServerRepository):
+
+    """ A ServerRepository that hands the work on each zone to one of
+    several shards, each a ZoneShard in a worker process or thread.  The
+    shards keep which clients are interested in which of their zones and
+    which objects are in them, and work out who each message goes to.
+
+    This repository remains the front end: it accepts the connections,
+    reads the datagrams, validates them and routes them to the shard of
+    the zone they concern, by zoneId, or for updates by the zone of the
+    object, found from its doId.  The state that spans zones, the
+    interest of each client and the zone and owner of each object, is
+    kept here by a ShardRouter, which also splits interest changes
+    between the shards they concern.  Once a frame, the work of the frame
+    is sent to the shards, and what they have finished is written to the
+    clients.
+
+    Since each zone belongs to one shard, messages about one zone keep
+    their order; this includes targeted and p2p updates, which go through
+    the shard of the object's zone too.  But a message may reach its
+    recipients a frame later than it would from a ServerRepository.
+
+    The shards also do the fan-out: they frame each message with the TCP
+    header and join the messages of the batch per recipient, so the
+    front end only queues one run of bytes per client and shard, which
+    sendQueuedTask() writes out.  The shards only run in parallel with
+    the 'process' backend, which is the default where processes are
+    started by forking.  Elsewhere the workers import the main module
+    again, so 'process' must be asked for, and the main module guarded
+    by "if __name__ == '__main__'". """
+
+    notify = DirectNotifyGlobal.directNotify.newCategory("ShardedServerRepository")
+
+    def __init__(self, tcpPort, serverAddress = None,
+                 udpPort = None, dcFileNames = None,
+                 threadedNet = None, numShards = None, shardBackend = None):
+        if numShards is None:
+            # Zero means one shard per core, leaving one for this
+            # thread.
+            numShards = ConfigVariableInt('server-shards', 0).value
+            if numShards <= 0:
+                numShards = max(1, (os.cpu_count() or 2) - 1)
+        if shardBackend is None:
+            # 'process' runs the shards in parallel, but unless the
+            # workers are forked, each of them imports the main module
+            # again, which must then be guarded by
+            # "if __name__ == '__main__'".
+            startMethod = multiprocessing.get_start_method(allow_none=True) or \
+                          multiprocessing.get_all_start_methods()[0]
+            if startMethod == 'fork':
+                defaultBackend = 'process'
+            else:
+                defaultBackend = 'thread'
+            shardBackend = ConfigVariableString('server-shard-backend', defaultBackend).value
+
+        ServerRepository.__init__(self, tcpPort, serverAddress = serverAddress,
+                                  udpPort = udpPort, dcFileNames = dcFileNames,
+                                  threadedNet = threadedNet)
+
+        self.router = ShardRouter(numShards, shardBackend, self.getTcpHeaderSize())
+
+        # This runs after serverReaderPollTask, so that what was read
+        # in the frame goes to the shards in the same frame, and before
+        # serverSendQueuedTask, which writes out what came back.
+        taskMgr.add(self.shardPollTask, "serverShardPollTask", sort = 10)
+
+    def destroy(self):
+        taskMgr.remove("serverShardPollTask")
+        self.router.destroy()
+
+    def setTcpHeaderSize(self, headerSize):
+        ServerRepository.setTcpHeaderSize(self, headerSize)
+        self.router.setTcpHeaderSize(headerSize)
+
+    def shardPollTask(self, task):
+        """ Sends what was queued for the shards this frame, and writes
+        out what the shards have finished. """
+        self.router.flush()
+        self.writeShardOutput(self.router.collect())
+        return Task.cont
+
+    def writeShardOutput(self, output):
+        clientsByDoIdBase = self.clientsByDoIdBase
+        routerClients = self.router.clients
+        for doIdBase, data, unlessZoneId in output:
+            client = clientsByDoIdBase.get(doIdBase)
+            if client is None:
+                if doIdBase is None:
+                    self.notify.warning(
+                        "Dropping message of %s bytes; too long for a TCP header of %s bytes" % (
+                        data, self.getTcpHeaderSize()))
+                # Otherwise, disconnected in the meantime.
+                continue
+            if unlessZoneId is not None and \
+               unlessZoneId in routerClients[doIdBase].currentInterestZoneIds:
+                continue
+            self.queueFramed((client, ), data)
+
+    def sendDoIdRange(self, client):
+        # This is called once for each new client.
+        self.router.addClient(client.doIdBase)
+        ServerRepository.sendDoIdRange(self, client)
+
+    def handleClientCreateObject(self, datagram, dgi):
+        connection = datagram.getConnection()
+        zoneId  = dgi.getUint32()
+        classId = dgi.getUint16()
+        doId    = dgi.getUint32()
+
+        client = self.clientsByConnection[connection]
+
+        if self.getDoIdBase(doId) != client.doIdBase:
+            self.notify.warning(
+                "Ignoring attempt to create invalid doId %s from client %s" % (doId, client.doIdBase))
+            return
+
+        dclass = self.dclassesByNumber[classId]
+
+        data = _packGenerateHeader(OBJECT_GENERATE_CMU, client.doIdBase,
+                                   zoneId, classId, doId) + dgi.getRemainingBytes()
+
+        if not self.router.createObject(self.router.clients[client.doIdBase],
+                                        doId, zoneId, classId, data):
+            self.notify.warning(
+                "Ignoring attempt to change object %s to %s by client %s" % (
+                doId, dclass.getName(), client.doIdBase))
+
+    def handleClientObjectUpdateField(self, datagram, dgi, targeted = False):
+        connection = datagram.getConnection()
+        client = self.clientsByConnection[connection]
+
+        if targeted:
+            targetId = dgi.getUint32()
+        doId = dgi.getUint32()
+        fieldId = dgi.getUint16()
+
+        object = self.router.objects.get(doId)
+        if not object:
+            self.notify.warning(
+                "Ignoring update for unknown object %s from client %s" % (
+                doId, client.doIdBase))
+            return
+        zoneId, ownerDoIdBase, classId = object
+
+        mode = self.getFieldMode(classId, fieldId)
+        if mode is None:
+            self.notify.warning(
+                "Ignoring update for field %s on object %s from client %s; no such field for class %s." % (
+                fieldId, doId, client.doIdBase, self.dclassesByNumber[classId].getName()))
+            return
+
+        if client.doIdBase != ownerDoIdBase:
+            # This message was not sent by the object's owner.
+            if not mode.startswith('p2p') and not mode.endswith('+clsend'):
+                self.notify.warning(
+                    "Ignoring update for field %s on object %s from client %s: not owner" % (
+                    fieldId, doId, client.doIdBase))
+                return
+
+        data = _packUpdateHeader(OBJECT_UPDATE_FIELD_CMU, client.doIdBase,
+                                 doId, fieldId) + dgi.getRemainingBytes()
+
+        # Updates for one client still go through the shard of the
+        # object's zone, so that they reach the client after the
+        # generate of the object.
+        if targeted:
+            if targetId not in self.clientsByDoIdBase:
+                self.notify.warning(
+                    "Ignoring targeted update to %s for field %s on object %s from client %s: target not known" % (
+                    targetId, fieldId, doId, client.doIdBase))
+                return
+            self.router.sendToClient(doId, targetId, data)
+
+        elif mode.startswith('p2p'):
+            if ownerDoIdBase in self.clientsByDoIdBase:
+                self.router.sendToClient(doId, ownerDoIdBase, data)
+
+        elif mode.startswith('broadcast'):
+            self.router.broadcast(doId, (client.doIdBase, ), data)
+
+        elif mode.startswith('reflect'):
+            self.router.broadcast(doId, (), data)
+
+        else:
+            self.notify.warning(
+                "Message is not broadcast or p2p")
+
+    def sendSmoothNodeUpdate(self, client, doId, fieldName, args):
+        object = self.router.objects.get(doId)
+        if not object or object[1] != client.doIdBase:
+            self.notify.warning(
+                "Ignoring smooth node update for unknown object %s from client %s" % (
+                doId, client.doIdBase))
+            return
+        classId = object[2]
+        fieldId = self.getFieldIdByName(classId, fieldName)
+        if fieldId is None:
+            self.notify.warning(
+                "Ignoring smooth node update for object %s from client %s; no field %s for class %s." % (
+                doId, client.doIdBase, fieldName, self.dclassesByNumber[classId].getName()))
+            return
+        data = _packUpdateHeader(OBJECT_UPDATE_FIELD_CMU, client.doIdBase,
+                                 doId, fieldId) + args
+        self.router.broadcast(doId, (client.doIdBase, ), data)
+
+    def handleClientDeleteObject(self, datagram, doId):
+        connection = datagram.getConnection()
+        client = self.clientsByConnection[connection]
+        object = self.router.objects.get(doId)
+        if not object or object[1] != client.doIdBase:
+            self.notify.warning(
+                "Ignoring update for unknown object %s from client %s" % (
+                doId, client.doIdBase))
+            return
+
+        self.router.deleteObject(self.router.clients[client.doIdBase], doId,
+                                 datagram.getMessage())
+        if client.smoothNodeDecoder is not None:
+            client.smoothNodeDecoder.removeNode(doId)
+
+    def handleClientObjectSetZone(self, datagram, dgi):
+        doId = dgi.getUint32()
+        zoneId = dgi.getUint32()
+
+        connection = datagram.getConnection()
+        client = self.clientsByConnection[connection]
+        object = self.router.objects.get(doId)
+        if not object or object[1] != client.doIdBase:
+            # Don't know this object.
+            self.notify.warning("Ignoring object location for %s: unknown" % (doId))
+            return
+
+        self.router.setObjectZone(self.router.clients[client.doIdBase], doId, zoneId)
+
+    def handleClientSetInterest(self, client, dgi):
+        zoneIds = set()
+        while dgi.getRemainingSize() > 0:
+            zoneIds.add(dgi.getUint32())
+
+        self.router.setInterest(self.router.clients[client.doIdBase], zoneIds)
+
+    def handleClientDisconnect(self, client):
+        self.router.removeClient(
+            client.doIdBase, lambda doId: _packDelete(OBJECT_DELETE_CMU, doId))
+
+        client.pendingSends = []
+        self.needsSend.discard(client)
+        self.needsFlush.discard(client)
+
+        del self.clientsByConnection[client.connection]
+        del self.clientsByDoIdBase[client.doIdBase]
+
+        id = client.doIdBase // self.doIdRange
+        self.idAllocator.free(id)
+
+        self.qcr.removeConnection(client.connection)
+        self.qcm.closeConnection(client.connection)
+
+    def sendToZoneExcept(self, zoneId, datagram, exceptionList):
+        """sends a message to everyone who has interest in the
+        indicated zone, except for the clients on exceptionList."""
+        self.router.sendToZoneExcept(
+            zoneId, tuple(client.doIdBase for client in exceptionList),
+            datagram.getMessage())
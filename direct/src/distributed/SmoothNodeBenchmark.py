@@ -0,0 +1,252 @@
+"""Compares the bandwidth and CPU time of the QUANTIZED smooth node broadcast
+with those of broadcastPosHprFull(), and the cost of broadcasting from a task
+per node with that of the shared SmoothNodeBroadcaster.  Run it with::
+
+    python -m direct.distributed.SmoothNodeBenchmark [numNodes] [numTicks]
+
+The updates are sent over a real connection to a local socket that only
+counts the bytes it receives, and acknowledges the QUANTIZED batches as the
+ServerRepository does."""
+
+from panda3d.core import ClockObject, Datagram, Filename, NodePath, URLSpec
+from panda3d.direct import CConnectionRepository, CDistributedSmoothNodeBase
+from direct.distributed.ClockDelta import globalClockDelta
+from direct.distributed.MsgTypesCMU import CLIENT_SMOOTH_NODE_BATCH_CMU, SMOOTH_NODE_BATCH_ACK_CMU
+from direct.distributed.SmoothNodeBroadcaster import QuantizedPosHprEncoder, SmoothNodeBatch, SmoothNodeBroadcaster
+from direct.task.TaskManagerGlobal import taskMgr
+import math
+import os
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+
+
+class ByteCounter:
+    """ A local TCP server that reads and counts everything sent to it, and
+    acknowledges the smooth node batches among it. """
+
+    def __init__(self):
+        self.numBytes = 0
+        self.numAcks = 0
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.listen(1)
+        self.port = self.socket.getsockname()[1]
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def __run(self):
+        connection, address = self.socket.accept()
+        pending = b''
+        while True:
+            data = connection.recv(65536)
+            if not data:
+                break
+            self.numBytes += len(data)
+
+            # Split the stream into its messages, with their 2-byte headers.
+            pending += data
+            acks = []
+            offset = 0
+            while offset + 2 <= len(pending):
+                length, = struct.unpack_from('<H', pending, offset)
+                if offset + 2 + length > len(pending):
+                    break
+                msgType, = struct.unpack_from('<H', pending, offset + 2)
+                if msgType == CLIENT_SMOOTH_NODE_BATCH_CMU:
+                    sequence, = struct.unpack_from('<H', pending, offset + 4)
+                    acks.append(struct.pack('<HHH', 4, SMOOTH_NODE_BATCH_ACK_CMU, sequence))
+                offset += 2 + length
+            pending = pending[offset:]
+            if acks:
+                connection.sendall(b''.join(acks))
+                self.numAcks += len(acks)
+
+    def waitForBytes(self, timeout=2.0):
+        # Returns the count once it has stopped changing.
+        last = -1
+        end = time.perf_counter() + timeout
+        while self.numBytes != last and time.perf_counter() < end:
+            last = self.numBytes
+            time.sleep(0.05)
+        return self.numBytes
+
+
+class Mover:
+    """ Moves a node around like an avatar: walking, turning and standing
+    still, with some jitter when standing. """
+
+    def __init__(self, nodePath, rng, idleFraction):
+        self.nodePath = nodePath
+        self.rng = rng
+        self.idleFraction = idleFraction
+        self.idle = rng.random() < idleFraction
+        nodePath.setPos(rng.uniform(-500, 500), rng.uniform(-500, 500), 0)
+        nodePath.setH(rng.uniform(0, 360))
+
+    def step(self, dt):
+        rng = self.rng
+        if rng.random() < 0.02:
+            self.idle = rng.random() < self.idleFraction
+        np = self.nodePath
+        if self.idle:
+            # Animation and physics keep a standing avatar from being
+            # perfectly still.
+            np.setX(np.getX() + rng.uniform(-0.02, 0.02))
+            np.setY(np.getY() + rng.uniform(-0.02, 0.02))
+        else:
+            h = np.getH() + rng.uniform(-20, 20) * dt
+            # Let the heading run past 360, as it does when turning.
+            np.setH(h)
+            speed = 15.0 * dt
+            np.setX(np.getX() - math.sin(math.radians(h)) * speed)
+            np.setY(np.getY() + math.cos(math.radians(h)) * speed)
+
+
+def readDCFile(cr, dcFileName=None):
+    if dcFileName is None:
+        dcFileName = os.path.join(os.path.dirname(__file__), 'direct.dc')
+    dcFile = cr.getDcFile()
+    dcFile.clear()
+    if not dcFile.read(Filename.fromOsSpecific(dcFileName)):
+        raise IOError('could not read %s' % dcFileName)
+    return dcFile.getClassByName('DistributedSmoothNode')
+
+
+def runBandwidth(quantized, numNodes, numTicks, period=0.2, idleFraction=0.5,
+                 seed=0, dcFileName=None):
+    """ Broadcasts numNodes moving nodes numTicks times, and returns
+    (bytes sent, seconds spent broadcasting).  The quantized nodes are sent
+    in one batch per tick, with the acknowledgements that have arrived by
+    then handled first. """
+    counter = ByteCounter()
+    cr = CConnectionRepository()
+    if not cr.tryConnectNet(URLSpec('http://127.0.0.1:%s' % (counter.port))):
+        raise IOError('could not connect to the byte counter')
+    dclass = readDCFile(cr, dcFileName)
+
+    rng = random.Random(seed)
+    movers = []
+    broadcasts = []
+    broadcaster = SmoothNodeBroadcaster()
+    batch = SmoothNodeBatch(cr, broadcaster)
+    for i in range(numNodes):
+        doId = 1000 + i
+        np = NodePath('node-%s' % (i))
+        movers.append(Mover(np, rng, idleFraction))
+        if quantized:
+            encoder = QuantizedPosHprEncoder(np, doId, lambda: 0, batch)
+            encoder.initialize()
+            broadcasts.append(encoder.broadcastPosHpr)
+        else:
+            cnode = CDistributedSmoothNodeBase()
+            cnode.setRepository(cr, False, 0)
+            cnode.setClockDelta(globalClockDelta)
+            cnode.initialize(np, dclass, doId)
+            broadcasts.append(cnode.broadcastPosHprFull)
+
+    elapsed = 0.0
+    clock = time.perf_counter
+    datagram = Datagram()
+    for tick in range(numTicks):
+        for mover in movers:
+            mover.step(period)
+        start = clock()
+        if quantized:
+            while cr.checkDatagram():
+                cr.getDatagram(datagram)
+                msgType, sequence = struct.unpack('<HH', datagram.getMessage())
+                assert msgType == SMOOTH_NODE_BATCH_ACK_CMU
+                batch.handleAck(sequence)
+        for broadcast in broadcasts:
+            broadcast()
+        broadcaster.sendBatches()
+        cr.flush()
+        elapsed += clock() - start
+        # Give the acknowledgements some time to arrive, as a frame would.
+        time.sleep(0.001)
+
+    broadcaster.destroy()
+    cr.disconnect()
+    return counter.waitForBytes(), elapsed
+
+
+class _ScheduledNode:
+    # Stands in for a smooth node, for timing the scheduling alone.
+    def __init__(self, period):
+        self.period = period
+        self.count = 0
+
+    def getPosHprBroadcastPeriod(self):
+        return self.period
+
+    def d_broadcastPosHpr(self):
+        self.count += 1
+
+    def posHprBroadcastTask(self, task):
+        self.d_broadcastPosHpr()
+        task.setDelay(self.period)
+        return task.again
+
+
+def runScheduling(shared, numNodes, numFrames, period=0.2, frameRate=60,
+                  seed=0):
+    """ Steps the task manager numFrames times, at frameRate frames per
+    second of frame time, with numNodes nodes broadcasting, and returns the
+    seconds spent stepping. """
+    globalClock = taskMgr.globalClock
+    mode = globalClock.getMode()
+    globalClock.setMode(ClockObject.MNonRealTime)
+    globalClock.setFrameRate(frameRate)
+
+    rng = random.Random(seed)
+    nodes = [_ScheduledNode(period) for i in range(numNodes)]
+    broadcaster = SmoothNodeBroadcaster()
+    taskNames = []
+    for i, node in enumerate(nodes):
+        delay = rng.uniform(0, period)
+        if shared:
+            broadcaster.add(node, delay)
+        else:
+            taskName = 'benchmarkPosHpr-%s' % (i)
+            taskMgr.doMethodLater(period + delay, node.posHprBroadcastTask, taskName)
+            taskNames.append(taskName)
+
+    clock = time.perf_counter
+    start = clock()
+    for frame in range(numFrames):
+        taskMgr.step()
+    elapsed = clock() - start
+
+    broadcaster.destroy()
+    for taskName in taskNames:
+        taskMgr.remove(taskName)
+    globalClock.setMode(mode)
+    return elapsed
+
+
+def main(args):
+    numNodes = int(args[0]) if len(args) > 0 else 500
+    numTicks = int(args[1]) if len(args) > 1 else 200
+
+    print('%s nodes, %s broadcasts each' % (numNodes, numTicks))
+    fullBytes, fullTime = runBandwidth(False, numNodes, numTicks)
+    quantizedBytes, quantizedTime = runBandwidth(True, numNodes, numTicks)
+    perUpdate = 1e6 / (numNodes * numTicks)
+    print('%-22s %12s %16s' % ('', 'bytes', 'us per broadcast'))
+    print('%-22s %12d %16.2f' % ('broadcastPosHprFull', fullBytes, fullTime * perUpdate))
+    print('%-22s %12d %16.2f' % ('QUANTIZED', quantizedBytes, quantizedTime * perUpdate))
+    print('bandwidth: %.1f%% of broadcastPosHprFull' % (100.0 * quantizedBytes / max(fullBytes, 1)))
+
+    numFrames = 600
+    perNodeTime = runScheduling(False, numNodes, numFrames)
+    sharedTime = runScheduling(True, numNodes, numFrames)
+    print('scheduling, %s frames: task per node %.1f ms, shared %.1f ms' % (
+        numFrames, perNodeTime * 1000.0, sharedTime * 1000.0))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
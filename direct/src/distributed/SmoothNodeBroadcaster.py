@@ -0,0 +1,510 @@
+"""SmoothNodeBroadcaster module: contains the SmoothNodeBroadcaster class,
+which broadcasts the positions of all local smooth nodes from one task, and
+the classes behind the QUANTIZED broadcast type of DistributedSmoothNodeBase:
+QuantizedPosHprEncoder and SmoothNodeBatch on the client, and
+SmoothNodeBatchDecoder on the ServerRepository."""
+
+__all__ = ['SmoothNodeBroadcaster', 'QuantizedPosHprEncoder',
+           'SmoothNodeBatch', 'SmoothNodeBatchDecoder',
+           'globalSmoothNodeBroadcaster']
+
+from panda3d.core import Datagram
+from .ClockDelta import globalClockDelta
+from .MsgTypesCMU import CLIENT_SMOOTH_NODE_BATCH_CMU
+from direct.directnotify.DirectNotifyGlobal import directNotify
+from direct.task.TaskManagerGlobal import taskMgr
+import collections
+import heapq
+import itertools
+import struct
+
+
+# A batch holds the x, y, z, h, p and r of each node as the int16 values
+# of the DC file, which are a tenth of a unit, and a tenth of a degree
+# taken modulo 360.
+PosScale = 10
+HprScale = 10
+HprRange = 360 * HprScale
+
+# The bits of the flags of an entry in a batch.  The low six bits are the
+# components that follow, in the order x, y, z, h, p, r.
+AllComponents = 0x3f
+# The components are int16 values, rather than int8 deltas.
+Absolute = 0x40
+# The entry starts with the uint64 location (zoneId) of the node.
+Location = 0x80
+
+# msgType, sequence, baseSequence, timestamp
+_packHeader = struct.Struct('<HHHh').pack
+# sequence, baseSequence, timestamp; after the msgType
+_unpackHeader = struct.Struct('<HHh').unpack_from
+_headerSize = 6
+_packStop = struct.Struct('<IB').pack
+_unpackEntry = struct.Struct('<IB').unpack_from
+_unpackLocation = struct.Struct('<Q').unpack_from
+
+# A batch may only take deltas against the batches this many before it.
+_MaxUnacked = 1 << 12
+
+# The fields to send for a change in the components with these bits,
+# checked in order, with the indices of the components they carry.  These
+# are the choices of the broadcastPosHprFull() of
+# CDistributedSmoothNodeBase.
+_Fields = [
+    (0x08, 'setSmH', (3, )),
+    (0x04, 'setSmZ', (2, )),
+    (0x03, 'setSmXY', (0, 1)),
+    (0x05, 'setSmXZ', (0, 2)),
+    (0x07, 'setSmPos', (0, 1, 2)),
+    (0x38, 'setSmHpr', (3, 4, 5)),
+    (0x0b, 'setSmXYH', (0, 1, 3)),
+    (0x0f, 'setSmXYZH', (0, 1, 2, 3)),
+    (0x3f, 'setSmPosHpr', (0, 1, 2, 3, 4, 5)),
+]
+
+# changed bits -> (field name, component indices)
+FieldsByFlags = {}
+for _flags in range(1, AllComponents + 1):
+    for _mask, _fieldName, _indices in _Fields:
+        if (_flags & _mask) == _flags:
+            FieldsByFlags[_flags] = (_fieldName, _indices)
+            break
+del _flags, _mask, _fieldName, _indices
+
+# flags -> the struct of the entry, from the doId on
+_entryStructs = {}
+
+
+def getEntryStruct(flags):
+    entryStruct = _entryStructs.get(flags)
+    if entryStruct is None:
+        fmt = '<IB'
+        if flags & Location:
+            fmt += 'Q'
+        fmt += ('h' if flags & Absolute else 'b') * bin(flags & AllComponents).count('1')
+        entryStruct = _entryStructs[flags] = struct.Struct(fmt)
+    return entryStruct
+
+
+def isNotAfter(sequence, other):
+    # Compares two sequence numbers of batches, which wrap around.
+    return ((other - sequence) & 0xffff) < 0x8000
+
+
+class QuantizedPosHprEncoder:
+    """
+    Broadcasts the position of one smooth node with the QUANTIZED broadcast
+    type, by adding it to the SmoothNodeBatch of its repository.  Like the
+    broadcastPosHprFull() of CDistributedSmoothNodeBase, it sends only what
+    changed since the last broadcast, a single stop once the node stands
+    still, and the whole position with the location when getLocation()
+    changes.  But it compares positions as the DC file quantizes them, so
+    that movement too small to send, and angles that only wrap around, send
+    nothing.
+    """
+
+    def __init__(self, nodePath, doId, getLocation, batch):
+        self.nodePath = nodePath
+        self.doId = doId
+        self.getLocation = getLocation
+        self.batch = batch
+
+        # The quantized position and location last broadcast.
+        self.sent = None
+        self.sentLocation = None
+        self.stopped = False
+
+        # The quantized position of the last batch with this node that the
+        # server acknowledged, which the deltas are taken against; None
+        # until there is one.
+        self.acked = None
+
+    def quantize(self):
+        pos = self.nodePath.getPos()
+        hpr = self.nodePath.getHpr()
+        return (round(pos[0] * PosScale),
+                round(pos[1] * PosScale),
+                round(pos[2] * PosScale),
+                round(hpr[0] * HprScale) % HprRange,
+                round(hpr[1] * HprScale) % HprRange,
+                round(hpr[2] * HprScale) % HprRange)
+
+    def initialize(self):
+        """ Takes the node's current position and location as the ones
+        last broadcast. """
+        self.sent = self.quantize()
+        self.sentLocation = self.getLocation()
+        self.stopped = False
+
+    def broadcastPosHpr(self):
+        current = self.quantize()
+        location = self.getLocation()
+        if location != self.sentLocation:
+            # The location has changed; send everything.
+            self.sentLocation = location
+            self.sent = current
+            self.stopped = False
+            self.batch.addPosHpr(self, current, location)
+
+        elif current == self.sent:
+            # No change.  Send one and only one "stop" message.
+            if not self.stopped:
+                self.stopped = True
+                self.batch.addStop(self)
+
+        else:
+            self.sent = current
+            self.stopped = False
+            self.batch.addPosHpr(self, current)
+
+
+class SmoothNodeBatch:
+    """
+    Sends the broadcasts of the QUANTIZED smooth nodes of one repository
+    together, in one CLIENT_SMOOTH_NODE_BATCH_CMU message per frame.  The
+    ServerRepository acknowledges each batch, and turns each node in it into
+    the setSm* update that broadcastPosHprFull() would have sent, for the
+    clients interested in the node's zone.
+
+    A batch is the uint16 sequence number of the batch, the uint16 sequence
+    number of the last batch acknowledged, the int16 timestamp of all of its
+    nodes, and an entry for each node.  An entry is the uint32 doId, uint8
+    flags, the uint64 location if the Location flag is set, and the
+    components in the low six bits of the flags.  These are int8 deltas
+    against the node's position as of the last batch acknowledged, or int16
+    values if the Absolute flag is set.  An entry without components or
+    location is a stop.  The position of a node that is not in any batch
+    acknowledged yet is sent whole.
+    """
+
+    notify = directNotify.newCategory("SmoothNodeBatch")
+
+    def __init__(self, repository, broadcaster=None):
+        self.repository = repository
+        # The SmoothNodeBroadcaster that sends the batch at the end of the
+        # frame.
+        self.broadcaster = broadcaster
+
+        # The sequence numbers of the next batch, and of the last one the
+        # server acknowledged.
+        self.sequence = 0
+        self.ackedSequence = 0xffff
+
+        # The entries of the batch being built, and the (encoder,
+        # position) of the nodes in it.
+        self.entries = []
+        self.positions = []
+
+        # (sequence, positions) of the batches sent and not acknowledged
+        # yet, oldest first.
+        self.unacked = collections.deque()
+
+    def clear(self):
+        """ Drops the batch being built. """
+        self.entries = []
+        self.positions = []
+
+    def addPosHpr(self, encoder, position, location=None):
+        """ Adds the node's quantized position to the batch, and its
+        location if it has changed. """
+        for value in position[:3]:
+            if not -0x8000 <= value < 0x8000:
+                raise ValueError(
+                    "Node position out of range for DC file: %s pos = %s hpr = %s zoneId = %s" % (
+                    encoder.nodePath, encoder.nodePath.getPos(), encoder.nodePath.getHpr(),
+                    location))
+
+        acked = encoder.acked
+        if acked is None:
+            flags = AllComponents | Absolute
+            values = position
+        else:
+            deltas = (position[0] - acked[0],
+                      position[1] - acked[1],
+                      position[2] - acked[2],
+                      (position[3] - acked[3] + HprRange // 2) % HprRange - HprRange // 2,
+                      (position[4] - acked[4] + HprRange // 2) % HprRange - HprRange // 2,
+                      (position[5] - acked[5] + HprRange // 2) % HprRange - HprRange // 2)
+            flags = 0
+            values = []
+            for i in range(6):
+                if deltas[i]:
+                    flags |= 1 << i
+                    values.append(deltas[i])
+            if not flags:
+                # Back where it was when last acknowledged.  This is not a
+                # stop, so it carries a component anyway.
+                flags = 1
+                values = [0]
+            elif min(values) < -0x80 or max(values) >= 0x80:
+                # Too far for a delta.
+                flags |= Absolute
+                values = [position[i] for i in range(6) if flags & (1 << i)]
+
+        if location is not None:
+            flags |= Location
+            entry = getEntryStruct(flags).pack(encoder.doId, flags, location, *values)
+        else:
+            entry = getEntryStruct(flags).pack(encoder.doId, flags, *values)
+
+        if not self.entries:
+            self.__queue()
+        self.entries.append(entry)
+        self.positions.append((encoder, position))
+
+    def addStop(self, encoder):
+        if not self.entries:
+            self.__queue()
+        self.entries.append(_packStop(encoder.doId, 0))
+
+    def __queue(self):
+        broadcaster = self.broadcaster
+        if broadcaster is None:
+            broadcaster = globalSmoothNodeBroadcaster
+        broadcaster.addBatch(self)
+
+    def send(self):
+        """ Sends the batch being built, if there is anything in it. """
+        if not self.entries:
+            return
+
+        self.entries.insert(0, _packHeader(
+            CLIENT_SMOOTH_NODE_BATCH_CMU, self.sequence, self.ackedSequence,
+            globalClockDelta.getRealNetworkTime()))
+        self.repository.sendDatagram(Datagram(b''.join(self.entries)))
+
+        unacked = self.unacked
+        if self.positions:
+            unacked.append((self.sequence, self.positions))
+            if len(unacked) > _MaxUnacked:
+                # Too long without an acknowledgement to keep taking deltas
+                # against it; these nodes are sent whole again.
+                for encoder, position in unacked.popleft()[1]:
+                    encoder.acked = None
+        self.sequence = (self.sequence + 1) & 0xffff
+        self.clear()
+
+    def handleAck(self, sequence):
+        """ The server has received the batches up to and including the
+        indicated one. """
+        self.ackedSequence = sequence
+        unacked = self.unacked
+        while unacked and isNotAfter(unacked[0][0], sequence):
+            for encoder, position in unacked.popleft()[1]:
+                encoder.acked = position
+
+
+class SmoothNodeBatchDecoder:
+    """
+    Unpacks the SmoothNodeBatch messages of one client, for the
+    ServerRepository.  It keeps the positions each node of the client was
+    sent with, in the batches the client may still take deltas against.
+    """
+
+    notify = directNotify.newCategory("SmoothNodeBatchDecoder")
+
+    def __init__(self):
+        # doId -> [(sequence, position), ...], oldest first
+        self.positions = {}
+
+    def removeNode(self, doId):
+        self.positions.pop(doId, None)
+
+    def decode(self, data):
+        """ Unpacks the batch in data, which starts after the message
+        type.  Returns its sequence number, and a list of (doId, field
+        name, packed arguments) of the setSm* updates to send for it. """
+        sequence, baseSequence, timestamp = _unpackHeader(data)
+        packedTimestamp = struct.pack('<h', timestamp)
+        updates = []
+        offset = _headerSize
+        while offset < len(data):
+            doId, flags = _unpackEntry(data, offset)
+            entryStruct = getEntryStruct(flags)
+            values = entryStruct.unpack_from(data, offset)[2:]
+            offset += entryStruct.size
+
+            components = flags & AllComponents
+            if flags & Location:
+                location = values[0]
+                values = values[1:]
+            elif not components:
+                updates.append((doId, 'setSmStop', packedTimestamp))
+                continue
+
+            history = self.positions.get(doId)
+            previous = None
+            baseline = None
+            if history:
+                previous = history[-1][1]
+                for i in range(len(history) - 1, -1, -1):
+                    if isNotAfter(history[i][0], baseSequence):
+                        baseline = history[i][1]
+                        # The client won't take deltas against the older
+                        # ones again.
+                        del history[:i]
+                        break
+
+            if flags & Absolute:
+                if baseline is None:
+                    if components != AllComponents:
+                        self.notify.warning(
+                            "Ignoring partial position of %s; no position to complete it" % (doId))
+                        continue
+                    position = list(values)
+                else:
+                    position = list(baseline)
+                    values = iter(values)
+                    for i in range(6):
+                        if components & (1 << i):
+                            position[i] = next(values)
+            else:
+                if baseline is None:
+                    self.notify.warning(
+                        "Ignoring delta position of %s; no position to take it against" % (doId))
+                    continue
+                position = list(baseline)
+                values = iter(values)
+                for i in range(6):
+                    if components & (1 << i):
+                        position[i] += next(values)
+                        if i >= 3:
+                            position[i] %= HprRange
+
+            if not all(-0x8000 <= value < 0x8000 for value in position[:3]):
+                self.notify.warning(
+                    "Ignoring position of %s; out of range for the DC file" % (doId))
+                continue
+
+            position = tuple(position)
+            if history is None:
+                history = self.positions[doId] = []
+            history.append((sequence, position))
+
+            if flags & Location:
+                updates.append((doId, 'setSmPosHprL', struct.pack(
+                    '<Q6h', location, *position) + packedTimestamp))
+                continue
+
+            changed = 0
+            for i in range(6):
+                if previous is None or position[i] != previous[i]:
+                    changed |= 1 << i
+            if changed:
+                fieldName, indices = FieldsByFlags[changed]
+                updates.append((doId, fieldName, struct.pack(
+                    '<%sh' % (len(indices)), *[position[i] for i in indices]) + packedTimestamp))
+
+        return sequence, updates
+
+
+class SmoothNodeBroadcaster:
+    """
+    Calls d_broadcastPosHpr() on every registered smooth node once per
+    its broadcast period, from a single task, instead of from one task per
+    node, and then sends the SmoothNodeBatches that the QUANTIZED nodes were
+    added to, so that each goes out once per frame.  Each node stays aligned
+    with the period it was started with, unless it falls a whole period
+    behind.
+
+    The period is read from the node's getPosHprBroadcastPeriod() every
+    time, so setPosHprBroadcastPeriod() works as it does with a task per
+    node.
+    """
+
+    notify = directNotify.newCategory("SmoothNodeBroadcaster")
+
+    def __init__(self):
+        # (nextTime, serial, node)
+        self._heap = []
+        # id(node) -> serial of its entry in the heap
+        self._serials = {}
+        self._serial = itertools.count()
+        # The batches to send at the end of the frame.
+        self._batches = []
+        self._task = None
+
+    def destroy(self):
+        if self._task is not None:
+            self._task.remove()
+            self._task = None
+        del self._heap[:]
+        self._serials.clear()
+        for batch in self._batches:
+            batch.clear()
+        del self._batches[:]
+
+    def add(self, node, delay=0.0):
+        """ Starts broadcasting the node's position, first after its
+        period plus the given delay. """
+        now = taskMgr.globalClock.getFrameTime()
+        serial = next(self._serial)
+        self._serials[id(node)] = serial
+        heapq.heappush(self._heap, (now + node.getPosHprBroadcastPeriod() + delay,
+                                    serial, node))
+        self.__startTask()
+
+    def remove(self, node):
+        """ Stops broadcasting the node's position.  Returns true if it
+        was being broadcast. """
+        # It is dropped from the heap when it comes up.
+        return self._serials.pop(id(node), None) is not None
+
+    def has(self, node):
+        return id(node) in self._serials
+
+    def getNumNodes(self):
+        return len(self._serials)
+
+    def addBatch(self, batch):
+        """ Sends the SmoothNodeBatch after the broadcasts of this
+        frame. """
+        self._batches.append(batch)
+        self.__startTask()
+
+    def sendBatches(self):
+        batches = self._batches
+        self._batches = []
+        for batch in batches:
+            batch.send()
+
+    def __startTask(self):
+        if self._task is None:
+            self._task = taskMgr.add(self.__broadcastTask, 'smoothNodeBroadcast')
+
+    def __broadcastTask(self, task):
+        now = taskMgr.globalClock.getFrameTime()
+        heap = self._heap
+        serials = self._serials
+        again = []
+        while heap and heap[0][0] <= now:
+            nextTime, serial, node = heapq.heappop(heap)
+            if serials.get(id(node)) != serial:
+                # Removed, or added again since.
+                continue
+
+            node.d_broadcastPosHpr()
+
+            # The node may have stopped broadcasting from the call.
+            if serials.get(id(node)) == serial:
+                period = node.getPosHprBroadcastPeriod()
+                nextTime += period
+                if nextTime <= now:
+                    nextTime = now + period
+                again.append((nextTime, serial, node))
+
+        # These are pushed back afterwards, so that each node is
+        # broadcast at most once per frame.
+        for entry in again:
+            heapq.heappush(heap, entry)
+
+        self.sendBatches()
+
+        if not serials:
+            del heap[:]
+            self._task = None
+            return task.done
+        return task.cont
+
+
+globalSmoothNodeBroadcaster = SmoothNodeBroadcaster()
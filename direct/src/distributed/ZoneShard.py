@@ -0,0 +1,502 @@
+"""ZoneShard module: contains the ZoneShard class, which keeps track of the
+zones owned by one shard of a :class:`.ShardedServerRepository`, and the
+ShardRouter, which keeps the state that spans zones and routes work to the
+shards.  Neither depends on Panda, so that shards can run in worker
+processes."""
+
+__all__ = ['ZoneShard', 'ShardRouter']
+
+from direct.distributed.MsgTypesCMU import (
+    OBJECT_DISABLE_CMU,
+    REQUEST_GENERATES_CMU,
+)
+import struct
+
+
+# Messages sent to a shard, as tuples that start with one of these.
+# (GENERATE, zoneId, doId, ownerDoIdBase, data): the object is created in
+# the zone, or just generated again if it already is; data goes to everyone
+# in the zone but the owner.
+GENERATE = 0
+# (BROADCAST, zoneId, exceptDoIdBases, data): data goes to everyone in the
+# zone except the clients with the given doIdBases, a tuple.
+BROADCAST = 1
+# (DELETE, zoneId, doId, data): data goes to everyone in the zone.
+DELETE = 2
+# (MOVE_OUT, zoneId, doId, ownerDoIdBase, newZoneId): the object leaves the
+# zone, and is disabled for everyone in it that is not interested in the
+# new zone.
+MOVE_OUT = 3
+# (MOVE_IN, zoneId, doId)
+MOVE_IN = 4
+# (INTEREST, doIdBase, addedZoneIds, removedZoneIds)
+INTEREST = 5
+# (DISCONNECT, doIdBase, zoneIds)
+DISCONNECT = 6
+# (TCP_HEADER_SIZE, headerSize): the messages after this are framed with a
+# TCP header of the given size.
+TCP_HEADER_SIZE = 7
+# (SEND, doIdBase, data): data goes to the client with the given doIdBase.
+# It is queued for the shard of the zone it concerns, so that it follows
+# what was sent about that zone before.
+SEND = 8
+
+# Datagrams are little-endian, like Panda's.
+# The TCP headers of each header size, as ServerRepository.frameData()
+# writes them.
+_tcpHeaderPackers = {
+    2: struct.Struct('<H').pack,
+    4: struct.Struct('<I').pack,
+}
+_packHeader = struct.Struct('<HI').pack
+_packUint16 = struct.Struct('<H').pack
+
+
+def _packDisable(doIds):
+    return _packUint16(OBJECT_DISABLE_CMU) + struct.pack('<%sI' % (len(doIds)), *doIds)
+
+
+class ZoneShard:
+    """ The zones of one shard: which clients are interested in each
+    zone, and which objects are in it.  handleBatch() takes a list of
+    messages and returns what must be sent as a list of (doIdBase, data,
+    unlessZoneId) records.  The data is a run of messages for the client
+    with the given doIdBase, each framed with the TCP header the
+    ConnectionWriter would put in front of it, and joined, ready to be
+    written to its socket.  It is not sent if the client is interested
+    in unlessZoneId, if that is not None.  A message that is too long
+    for the header size is dropped, and reported by a record of (None,
+    its length, None). """
+
+    def __init__(self, tcpHeaderSize=2):
+        self.tcpHeaderSize = tcpHeaderSize
+
+        # zoneId -> set of the doIdBases of the clients interested in it
+        self.clientsByZoneId = {}
+        # zoneId -> set of the doIds of the objects in it
+        self.objectsByZoneId = {}
+
+        # doIdBase -> the framed messages queued for the client in this
+        # batch, that are not in the output yet
+        self.runsByDoIdBase = {}
+
+        self._handlers = {
+            GENERATE: self.handleGenerate,
+            BROADCAST: self.handleBroadcast,
+            DELETE: self.handleDelete,
+            MOVE_OUT: self.handleMoveOut,
+            MOVE_IN: self.handleMoveIn,
+            INTEREST: self.handleInterest,
+            DISCONNECT: self.handleDisconnect,
+            TCP_HEADER_SIZE: self.handleTcpHeaderSize,
+            SEND: self.handleSend,
+        }
+
+    def handleBatch(self, messages):
+        output = []
+        handlers = self._handlers
+        for message in messages:
+            handlers[message[0]](message, output)
+        for doIdBase, run in self.runsByDoIdBase.items():
+            output.append((doIdBase, b''.join(run), None))
+        self.runsByDoIdBase = {}
+        return output
+
+    def frameData(self, data, output):
+        headerSize = self.tcpHeaderSize
+        if headerSize == 0:
+            return data
+        if len(data) >= 1 << (headerSize * 8):
+            output.append((None, len(data), None))
+            return None
+        return _tcpHeaderPackers[headerSize](len(data)) + data
+
+    def sendToZoneExcept(self, zoneId, data, exceptDoIdBases, output, unlessZoneId=None):
+        clients = self.clientsByZoneId.get(zoneId)
+        if not clients:
+            return
+        framed = self.frameData(data, output)
+        if framed is None:
+            return
+        runs = self.runsByDoIdBase
+        for doIdBase in clients:
+            if doIdBase in exceptDoIdBases:
+                continue
+            if unlessZoneId is not None:
+                self.sendUnless(doIdBase, framed, unlessZoneId, output)
+                continue
+            run = runs.get(doIdBase)
+            if run is None:
+                runs[doIdBase] = [framed]
+            else:
+                run.append(framed)
+
+    def sendUnless(self, doIdBase, framed, unlessZoneId, output):
+        # Whether this is sent is decided by the front end, so what was
+        # queued for the client before it goes to the output first.
+        run = self.runsByDoIdBase.pop(doIdBase, None)
+        if run is not None:
+            output.append((doIdBase, b''.join(run), None))
+        output.append((doIdBase, framed, unlessZoneId))
+
+    def handleGenerate(self, message, output):
+        type, zoneId, doId, ownerDoIdBase, data = message
+        self.objectsByZoneId.setdefault(zoneId, set()).add(doId)
+        self.sendToZoneExcept(zoneId, data, (ownerDoIdBase, ), output)
+
+    def handleBroadcast(self, message, output):
+        type, zoneId, exceptDoIdBases, data = message
+        self.sendToZoneExcept(zoneId, data, exceptDoIdBases, output)
+
+    def handleDelete(self, message, output):
+        type, zoneId, doId, data = message
+        self.sendToZoneExcept(zoneId, data, (), output)
+        self.__removeObject(zoneId, doId)
+
+    def handleMoveOut(self, message, output):
+        type, zoneId, doId, ownerDoIdBase, newZoneId = message
+        self.__removeObject(zoneId, doId)
+        self.sendToZoneExcept(zoneId, _packDisable([doId]), (ownerDoIdBase, ),
+                              output, unlessZoneId=newZoneId)
+
+    def handleMoveIn(self, message, output):
+        type, zoneId, doId = message
+        self.objectsByZoneId.setdefault(zoneId, set()).add(doId)
+
+    def handleInterest(self, message, output):
+        type, doIdBase, addedZoneIds, removedZoneIds = message
+        for zoneId in addedZoneIds:
+            self.clientsByZoneId.setdefault(zoneId, set()).add(doIdBase)
+            # The client is opening interest in this zone, so the
+            # owners of the objects in it must generate them again.
+            self.sendToZoneExcept(zoneId, _packHeader(REQUEST_GENERATES_CMU, zoneId),
+                                  (doIdBase, ), output)
+
+        if removedZoneIds:
+            # Any objects in the zones the client is abandoning are
+            # disabled for it.
+            doIds = []
+            for zoneId in removedZoneIds:
+                self.__removeClient(zoneId, doIdBase)
+                doIds.extend(self.objectsByZoneId.get(zoneId, ()))
+            if doIds:
+                framed = self.frameData(_packDisable(doIds), output)
+                if framed is not None:
+                    self.runsByDoIdBase.setdefault(doIdBase, []).append(framed)
+
+    def handleDisconnect(self, message, output):
+        type, doIdBase, zoneIds = message
+        for zoneId in zoneIds:
+            self.__removeClient(zoneId, doIdBase)
+
+    def handleTcpHeaderSize(self, message, output):
+        type, self.tcpHeaderSize = message
+
+    def handleSend(self, message, output):
+        type, doIdBase, data = message
+        framed = self.frameData(data, output)
+        if framed is not None:
+            self.runsByDoIdBase.setdefault(doIdBase, []).append(framed)
+
+    def __removeClient(self, zoneId, doIdBase):
+        clients = self.clientsByZoneId.get(zoneId)
+        if clients is not None:
+            clients.discard(doIdBase)
+            if not clients:
+                del self.clientsByZoneId[zoneId]
+
+    def __removeObject(self, zoneId, doId):
+        objects = self.objectsByZoneId.get(zoneId)
+        if objects is not None:
+            objects.discard(doId)
+            if not objects:
+                del self.objectsByZoneId[zoneId]
+
+
+def _runShardProcess(connection, tcpHeaderSize):
+    # The main loop of a shard in a worker process.
+    shard = ZoneShard(tcpHeaderSize)
+    while True:
+        messages = connection.recv()
+        if messages is None:
+            break
+        connection.send(shard.handleBatch(messages))
+    connection.close()
+
+
+def _runShardThread(inQueue, outQueue, tcpHeaderSize):
+    shard = ZoneShard(tcpHeaderSize)
+    while True:
+        messages = inQueue.get()
+        if messages is None:
+            break
+        outQueue.put(shard.handleBatch(messages))
+
+
+class _InlineShard:
+    # Runs the shard in the calling thread, when submitted.
+    def __init__(self, tcpHeaderSize):
+        self.shard = ZoneShard(tcpHeaderSize)
+        self.output = []
+        self.numPending = 0
+
+    def submit(self, messages):
+        self.output.extend(self.shard.handleBatch(messages))
+
+    def collect(self, wait):
+        output = self.output
+        self.output = []
+        return output
+
+    def stop(self):
+        pass
+
+
+class _QueuedShard:
+    # The output of the shard is put on outQueue, in the order of the
+    # batches submitted.
+    def __init__(self):
+        import queue
+        self.outQueue = queue.SimpleQueue()
+        self.numPending = 0
+
+    def collect(self, wait):
+        output = []
+        while self.numPending and (wait or not self.outQueue.empty()):
+            output.extend(self.outQueue.get())
+            self.numPending -= 1
+        return output
+
+
+class _ThreadShard(_QueuedShard):
+    def __init__(self, name, tcpHeaderSize):
+        import queue
+        import threading
+        _QueuedShard.__init__(self)
+        self.inQueue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=_runShardThread, name=name,
+                                       args=(self.inQueue, self.outQueue, tcpHeaderSize),
+                                       daemon=True)
+        self.thread.start()
+
+    def submit(self, messages):
+        self.numPending += 1
+        self.inQueue.put(messages)
+
+    def stop(self):
+        self.inQueue.put(None)
+        self.thread.join()
+
+
+class _ProcessShard(_QueuedShard):
+    def __init__(self, name, tcpHeaderSize):
+        import multiprocessing
+        import threading
+        _QueuedShard.__init__(self)
+        self.connection, childConnection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_runShardProcess, name=name,
+                                               args=(childConnection, tcpHeaderSize),
+                                               daemon=True)
+        self.process.start()
+        childConnection.close()
+
+        # The output is read as soon as the worker sends it, whether or
+        # not anyone is collecting it.  Otherwise the worker could block
+        # sending its output while submit() blocks sending it more work.
+        self.reader = threading.Thread(target=self.__read, name=name + '-reader',
+                                       daemon=True)
+        self.reader.start()
+
+    def __read(self):
+        while True:
+            try:
+                output = self.connection.recv()
+            except EOFError:
+                break
+            self.outQueue.put(output)
+
+    def submit(self, messages):
+        self.numPending += 1
+        self.connection.send(messages)
+
+    def stop(self):
+        self.connection.send(None)
+        self.process.join()
+        self.reader.join()
+        self.connection.close()
+
+
+class ShardRouter:
+    """ Keeps the state that spans zones: the clients and their interest,
+    and the zone and owner of every object.  Work on a zone is queued for
+    the shard that owns it, which is given by the zoneId, and flush()
+    sends it to the shards, which run inline, in threads or in processes
+    depending on the backend.  Since every zone is owned by one shard,
+    the messages for a zone are handled in order.  The shards also frame
+    the messages with the given TCP header size and join them per
+    recipient, so that fanning them out to the clients is done in
+    parallel with the 'process' backend. """
+
+    class Client:
+        def __init__(self, doIdBase):
+            self.doIdBase = doIdBase
+            self.explicitInterestZoneIds = set()
+            self.currentInterestZoneIds = set()
+            # zoneId -> number of objects the client owns in it
+            self.objectCountsByZoneId = {}
+            # the doIds of the objects the client owns
+            self.doIds = set()
+
+    def __init__(self, numShards, backend='thread', tcpHeaderSize=2):
+        self.numShards = numShards
+        self.backend = backend
+        self.shards = []
+        for i in range(numShards):
+            name = 'ZoneShard-%s' % (i)
+            if backend == 'process':
+                self.shards.append(_ProcessShard(name, tcpHeaderSize))
+            elif backend == 'thread':
+                self.shards.append(_ThreadShard(name, tcpHeaderSize))
+            elif backend == 'inline':
+                self.shards.append(_InlineShard(tcpHeaderSize))
+            else:
+                raise ValueError('unknown shard backend: %s' % backend)
+        self._pending = [[] for i in range(numShards)]
+
+        # doIdBase -> Client
+        self.clients = {}
+        # doId -> [zoneId, ownerDoIdBase, classId]
+        self.objects = {}
+
+    def destroy(self):
+        for shard in self.shards:
+            shard.stop()
+        self.shards = []
+
+    def getShardIndex(self, zoneId):
+        return zoneId % self.numShards
+
+    def queue(self, zoneId, message):
+        self._pending[zoneId % self.numShards].append(message)
+
+    def flush(self):
+        """ Sends the queued messages to the shards. """
+        for index, messages in enumerate(self._pending):
+            if messages:
+                self.shards[index].submit(messages)
+                self._pending[index] = []
+
+    def collect(self, wait=False):
+        """ Returns the records the shards have produced so far, as a
+        list of (doIdBase, data, unlessZoneId); see ZoneShard.  If
+        wait is true, waits until everything flushed has been handled. """
+        output = []
+        for shard in self.shards:
+            output.extend(shard.collect(wait))
+        return output
+
+    def setTcpHeaderSize(self, headerSize):
+        """ Changes the TCP header size the shards frame the messages
+        queued from now on with. """
+        for messages in self._pending:
+            messages.append((TCP_HEADER_SIZE, headerSize))
+
+    def addClient(self, doIdBase):
+        client = self.Client(doIdBase)
+        self.clients[doIdBase] = client
+        return client
+
+    def removeClient(self, doIdBase, deleteData):
+        """ Forgets the client, deleting all of its objects.  deleteData
+        is called with each doId, and returns the datagram to send. """
+        client = self.clients.pop(doIdBase)
+        for zoneId in client.currentInterestZoneIds:
+            self.queue(zoneId, (DISCONNECT, doIdBase, [zoneId]))
+        for doId in client.doIds:
+            zoneId = self.objects.pop(doId)[0]
+            self.queue(zoneId, (DELETE, zoneId, doId, deleteData(doId)))
+
+    def createObject(self, owner, doId, zoneId, classId, data):
+        """ Handles a generate from the owner; returns false if the
+        object exists with another class. """
+        object = self.objects.get(doId)
+        if object is not None:
+            if object[2] != classId:
+                return False
+            self.setObjectZone(owner, doId, zoneId)
+        else:
+            self.objects[doId] = [zoneId, owner.doIdBase, classId]
+            owner.doIds.add(doId)
+            counts = owner.objectCountsByZoneId
+            counts[zoneId] = counts.get(zoneId, 0) + 1
+            self.queue(zoneId, (MOVE_IN, zoneId, doId))
+            self.updateInterest(owner)
+        self.queue(zoneId, (GENERATE, zoneId, doId, owner.doIdBase, data))
+        return True
+
+    def deleteObject(self, owner, doId, data):
+        object = self.objects.pop(doId)
+        owner.doIds.discard(doId)
+        zoneId = object[0]
+        self.queue(zoneId, (DELETE, zoneId, doId, data))
+        self.__uncountObject(owner, zoneId)
+        self.updateInterest(owner)
+
+    def setObjectZone(self, owner, doId, zoneId):
+        object = self.objects[doId]
+        oldZoneId = object[0]
+        if oldZoneId == zoneId:
+            return
+        object[0] = zoneId
+        self.__uncountObject(owner, oldZoneId)
+        counts = owner.objectCountsByZoneId
+        counts[zoneId] = counts.get(zoneId, 0) + 1
+        self.queue(zoneId, (MOVE_IN, zoneId, doId))
+        # The zones may be on different shards; the old one disables the
+        # object for its clients that don't also see the new one.  This
+        # must reach the shard before any change to the owner's interest,
+        # or the shard would disable the object for its owner.
+        self.queue(oldZoneId, (MOVE_OUT, oldZoneId, doId, owner.doIdBase, zoneId))
+        self.updateInterest(owner)
+
+    def broadcast(self, doId, exceptDoIdBases, data):
+        """ Sends the data to every client interested in the object's
+        zone, except those with the given doIdBases. """
+        self.sendToZoneExcept(self.objects[doId][0], exceptDoIdBases, data)
+
+    def sendToZoneExcept(self, zoneId, exceptDoIdBases, data):
+        self.queue(zoneId, (BROADCAST, zoneId, exceptDoIdBases, data))
+
+    def sendToClient(self, doId, doIdBase, data):
+        """ Sends the data, a message about the object, to the client
+        with the given doIdBase.  It goes through the shard of the
+        object's zone, so that the client gets it after the generate of
+        the object, and whatever else was sent about the zone before. """
+        zoneId = self.objects[doId][0]
+        self.queue(zoneId, (SEND, doIdBase, data))
+
+    def setInterest(self, client, zoneIds):
+        client.explicitInterestZoneIds = set(zoneIds)
+        self.updateInterest(client)
+
+    def updateInterest(self, client):
+        origZoneIds = client.currentInterestZoneIds
+        newZoneIds = client.explicitInterestZoneIds.union(client.objectCountsByZoneId)
+        if origZoneIds == newZoneIds:
+            return
+        client.currentInterestZoneIds = newZoneIds
+
+        # Tell each shard about the change in its own zones.
+        changes = {}
+        for zoneId in newZoneIds - origZoneIds:
+            changes.setdefault(zoneId % self.numShards, ([], []))[0].append(zoneId)
+        for zoneId in origZoneIds - newZoneIds:
+            changes.setdefault(zoneId % self.numShards, ([], []))[1].append(zoneId)
+        for index, (added, removed) in changes.items():
+            self._pending[index].append((INTEREST, client.doIdBase, added, removed))
+
+    def __uncountObject(self, owner, zoneId):
+        counts = owner.objectCountsByZoneId
+        counts[zoneId] -= 1
+        if not counts[zoneId]:
+            del counts[zoneId]
@@ -51,6 +51,7 @@ PUBLISHED:
   void broadcast_pos_hpr_xy();
 
   void set_curr_l(uint64_t l);
+  INLINE uint64_t get_curr_l() const;
   void print_curr_l();
 
 private:
@@ -5,14 +5,19 @@ import direct.showbase.DConfig as config
 from direct.showbase.PythonUtil import makeFlywheelGen, flywheel
 from direct.showbase.PythonUtil import itype, serialNum, safeRepr, fastRepr
 from direct.showbase.PythonUtil import getBase, uniqueName, ScratchPad, nullGen
-from direct.showbase.Job import Job
+from direct.showbase.Job import Job, IsolatedJob
 from direct.showbase.JobManagerGlobal import jobMgr
 from direct.showbase.MessengerGlobal import messenger
 from direct.task.TaskManagerGlobal import taskMgr
+from panda3d.core import ConfigVariableDouble, ConfigVariableInt, ConfigVariableString
+from collections import deque
+from array import array
 import types
 import weakref
 import random
 import builtins
+import gc
+import sys
 
 
 deadEndTypes = frozenset((
@@ -974,6 +979,278 @@ class PruneObjectRefs(Job):
         yield Job.Done
 
 
+def _compareHeapSnapshots(ids, lengths, lastIds, lastLengths, objectsPerYield):
+    # The isolated work of a HeapSnapshot, see Job.getIsolatedWork().  Compares
+    # the sizes of the containers to those in the last snapshot, by id.
+    # Yields None while working, then a list of (index, size in the last
+    # snapshot) for the containers that have grown
+    lastSizes = dict(zip(lastIds, lastLengths))
+    yield None
+    grown = []
+    for i in range(len(ids)):
+        if i % objectsPerYield == 0:
+            yield None
+        lastLength = lastSizes.get(ids[i])
+        if lastLength is not None and lengths[i] > lastLength:
+            grown.append((i, lastLength))
+    yield grown
+    yield Job.Done
+
+
+class HeapSnapshot(Job):
+    """
+    Job that measures every container on the heap and compares the sizes to
+    those of the previous snapshot; sub-job of ContainerLeakDetector in
+    snapshot mode.  The containers come from gc.get_objects(), so they are
+    found no matter how they are referenced, including from C++ objects.
+    A snapshot only keeps a histogram of the number of objects of each type
+    and the ids and sizes of the containers.  Measuring has to walk the live
+    heap, but comparing the sizes to the last snapshot is handed to the
+    JobManager as isolated work, see Job.getIsolatedWork().
+    """
+    ContainerTypes = (dict, list, set, deque)
+    ReprItems = 5
+    # objects to measure between yields
+    ObjectsPerYield = 500
+    # limits on the search for a path to a growing container, as each step
+    # is a gc.get_referrers() call over the whole heap
+    MaxPathDepth = 12
+    MaxPathSearches = 64
+
+    def __init__(self, name, leakDetector):
+        Job.__init__(self, name)
+        self._leakDetector = leakDetector
+        self.notify = self._leakDetector.notify
+        # compares the sizes while the snapshot waits, see _compareHeapSnapshots()
+        self._compareJob = None
+        self._grown = None
+        ContainerLeakDetector.addPrivateObj(self.__dict__)
+
+    def destroy(self):
+        if self._compareJob is not None:
+            self.ignore(self._compareJob.getResultEvent())
+            if not self._compareJob.isFinished():
+                jobMgr.remove(self._compareJob)
+            self._compareJob.destroy()
+            self._compareJob = None
+        ContainerLeakDetector.removePrivateObj(self.__dict__)
+        Job.destroy(self)
+
+    def getPriority(self):
+        return Job.Priorities.Normal
+
+    @staticmethod
+    def _getIdentity(obj):
+        # something to tell whether an id still refers to the same object in
+        # the next snapshot; the type has to do for objects that can't be
+        # weakly referenced, which includes the built-in containers
+        try:
+            return weakref.ref(obj)
+        except TypeError:
+            return type(obj)
+
+    @staticmethod
+    def _isSame(obj, identity):
+        if isinstance(identity, weakref.ref):
+            return identity() is obj
+        return type(obj) is identity
+
+    def run(self):
+        try:
+            ld = self._leakDetector
+            numPeriods = ld._snapshotPeriods
+            minLength = ld._snapshotMinLength
+            privateIds = ContainerLeakDetector.PrivateIds
+            containerTypes = self.ContainerTypes
+            growth = ld._snapshotGrowth
+
+            typeCounts = {}
+            # the measured containers, and their ids and sizes
+            containers = []
+            ids = array('Q')
+            lengths = array('q')
+            newGrowth = {}
+            ContainerLeakDetector.addPrivateObj(typeCounts)
+            ContainerLeakDetector.addPrivateObj(containers)
+            ContainerLeakDetector.addPrivateObj(newGrowth)
+            candidates = []
+
+            objs = gc.get_objects()
+            yield None
+            for i in range(len(objs)):
+                if i % self.ObjectsPerYield == 0:
+                    yield None
+                obj = objs[i]
+                objType = type(obj)
+                typeCounts[objType] = typeCounts.get(objType, 0) + 1
+                if not isinstance(obj, containerTypes):
+                    continue
+                objId = id(obj)
+                if objId in privateIds:
+                    continue
+                length = len(obj)
+                if length < minLength:
+                    continue
+                containers.append(obj)
+                ids.append(objId)
+                lengths.append(length)
+            del obj
+            # the list of all objects would show up as a referrer of everything
+            del objs
+
+            # the measured containers are kept alive until the comparison is
+            # done, so that their ids still refer to them
+            self._compareJob = IsolatedJob(
+                '%s-compare' % self.getJobName(), _compareHeapSnapshots,
+                (ids, lengths, ld._snapshotIds, ld._snapshotLengths, self.ObjectsPerYield),
+                priority=self.getPriority())
+            self.accept(self._compareJob.getResultEvent(), self._handleGrown)
+            jobMgr.add(self._compareJob)
+            while not self._compareJob.isFinished():
+                yield Job.Sleep
+            self.ignore(self._compareJob.getResultEvent())
+            self._compareJob.destroy()
+            self._compareJob = None
+            grown = self._grown or []
+            self._grown = None
+
+            for index, lastLength in grown:
+                # this container has grown since the last snapshot
+                container = containers[index]
+                objId = ids[index]
+                entry = growth.get(objId)
+                if entry is None or not self._isSame(container, entry[2]):
+                    # [number of snapshots it grew in a row, size before that, identity]
+                    entry = [0, lastLength, self._getIdentity(container)]
+                entry[0] += 1
+                newGrowth[objId] = entry
+                if entry[0] % numPeriods == 0:
+                    candidates.append(container)
+            ContainerLeakDetector.removePrivateObj(containers)
+            del containers
+            container = None
+
+            lastTypeCounts = ld._snapshotTypeCounts
+            typeGrowth = {}
+            ContainerLeakDetector.addPrivateObj(typeGrowth)
+            for objType, count in typeCounts.items():
+                lastCount = lastTypeCounts.get(objType)
+                if lastCount is not None and count > lastCount and count >= minLength:
+                    streak = ld._snapshotTypeGrowth.get(objType, 0) + 1
+                    typeGrowth[objType] = streak
+                    if streak % numPeriods == 0:
+                        self.notify.info('number of %s objects increased over the last %s snapshots '
+                                         '(%s objects at last measurement)' % (
+                                         objType.__name__, streak, count))
+
+            for table in (ld._snapshotGrowth, ld._snapshotTypeCounts,
+                          ld._snapshotTypeGrowth):
+                ContainerLeakDetector.removePrivateObj(table)
+            ld._snapshotIds = ids
+            ld._snapshotLengths = lengths
+            ld._snapshotGrowth = newGrowth
+            ld._snapshotTypeCounts = typeCounts
+            ld._snapshotTypeGrowth = typeGrowth
+            ld._snapshotIndex += 1
+            yield None
+
+            # only now, for the few containers that keep growing, find out where they are
+            while candidates:
+                container = candidates.pop()
+                for name in self._getPathGen(container, candidates):
+                    yield None
+                periods, firstLength, identity = newGrowth[id(container)]
+                msg = ('leak detected: %s (%s) consistently increased in size over the last '
+                       '%s snapshots, from %s to %s items (current contents: %s)' % (
+                       name, itype(container), periods, firstLength, len(container),
+                       fastRepr(container, maxLen=HeapSnapshot.ReprItems)))
+                self.notify.warning(msg)
+                yield None
+                messenger.send(ld.getLeakEvent(), [container, name])
+                if config.GetBool('pdb-on-leak-detect', 0):
+                    import pdb;pdb.set_trace()
+                    pass
+                del container
+        except Exception as e:
+            print('HeapSnapshot job caught exception: %s' % e)
+            if __dev__:
+                raise
+        yield Job.Done
+
+    def _handleGrown(self, grown):
+        self._grown = grown
+
+    def _getPathGen(self, container, candidates):
+        # breadth-first search up the referrers of the container for a module,
+        # yields None while working, then a name for the container such as
+        # 'module.attribute[key]'
+        moduleDicts = {}
+        for moduleName, module in list(sys.modules.items()):
+            moduleDict = getattr(module, '__dict__', None)
+            if moduleDict is not None:
+                moduleDicts[id(moduleDict)] = moduleName
+        moduleDicts[id(builtins.__dict__)] = 'builtins'
+
+        # objects still to search the referrers of, with the path from each one
+        # to the container and its length
+        queue = [container]
+        paths = [('', 0)]
+        visited = {id(container)}
+        # ignore ourselves, and the bookkeeping of the search
+        ignoreIds = {id(candidates), id(queue), id(visited), id(moduleDicts)}
+        ignoreIds.update(ContainerLeakDetector.PrivateIds)
+        searches = 0
+        index = 0
+        while index < len(queue) and searches < self.MaxPathSearches:
+            obj = queue[index]
+            path, depth = paths[index]
+            index += 1
+            if depth >= self.MaxPathDepth:
+                continue
+            yield None
+            referrers = gc.get_referrers(obj)
+            searches += 1
+            for referrer in referrers:
+                referrerId = id(referrer)
+                if (referrerId in visited or referrerId in ignoreIds or
+                    isinstance(referrer, types.FrameType)):
+                    continue
+                visited.add(referrerId)
+                step = self._getPathStep(referrer, obj)
+                if referrerId in moduleDicts:
+                    yield moduleDicts[referrerId] + step + path
+                    return
+                queue.append(referrer)
+                paths.append((step + path, depth + 1))
+            del referrers
+            del obj
+        yield '<%s at 0x%x, no path from a module found>' % (itype(container), id(container))
+
+    @staticmethod
+    def _getPathStep(referrer, obj):
+        # describes how the referrer refers to obj
+        if isinstance(referrer, dict):
+            for key, value in referrer.items():
+                if value is obj:
+                    if isinstance(key, str) and key.isidentifier():
+                        return '.%s' % key
+                    return '[%s]' % safeRepr(key)
+            return '[<key>]'
+        if isinstance(referrer, (list, tuple, deque)):
+            for i, value in enumerate(referrer):
+                if value is obj:
+                    return '[%s]' % i
+            return '[<index>]'
+        objDict = getattr(referrer, '__dict__', None)
+        if isinstance(objDict, dict):
+            if objDict is obj:
+                return ''
+            for key, value in objDict.items():
+                if value is obj:
+                    return '.%s' % key
+        return '-><%s>' % type(referrer).__name__
+
+
 class ContainerLeakDetector(Job):
     """
     Low-priority Python object-graph walker that looks for leaking containers.
@@ -981,18 +1258,31 @@ class ContainerLeakDetector(Job):
     discover containers rather than keep a set of all visited objects; it may
     visit the same object many times but eventually it will discover every object.
     Checks container sizes at ever-increasing intervals.
+
+    In snapshot mode, set with the mode argument or the leak-detector-mode
+    config variable, the walk is replaced by periodic HeapSnapshots of every
+    container on the heap, which also finds containers that are only
+    reachable through C++ objects.  Containers that grow in every one of
+    several snapshots in a row are reported, with a path to them from a
+    module.
     """
     notify = directNotify.newCategory("ContainerLeakDetector")
     # set of containers that should not be examined
     PrivateIds: set[int] = set()
 
-    def __init__(self, name, firstCheckDelay = None):
+    def __init__(self, name, firstCheckDelay = None, mode = None):
         Job.__init__(self, name)
         self._serialNum = serialNum()
 
+        # 'crawl' or 'snapshot'
+        if mode is None:
+            mode = ConfigVariableString('leak-detector-mode', 'crawl').value
+        self._mode = mode
+
         self._findContainersJob = None
         self._checkContainersJob = None
         self._pruneContainersJob = None
+        self._snapshotJob = None
 
         if firstCheckDelay is None:
             firstCheckDelay = 60. * 15.
@@ -1008,6 +1298,19 @@ class ContainerLeakDetector(Job):
         self._index2containerId2len = {}
         self._index2delay = {}
 
+        # state of snapshot mode: the ids and sizes of the containers and
+        # type->number of objects at the last snapshot, and for what has been
+        # growing, id(container)->[snapshots, len, identity] and type->snapshots
+        self._snapshotPeriod = ConfigVariableDouble('leak-detector-snapshot-period', 60. * 5.).value
+        self._snapshotPeriods = ConfigVariableInt('leak-detector-snapshot-periods', 5).value
+        self._snapshotMinLength = ConfigVariableInt('leak-detector-snapshot-min-length', 20).value
+        self._snapshotIndex = 0
+        self._snapshotIds = array('Q')
+        self._snapshotLengths = array('q')
+        self._snapshotTypeCounts = {}
+        self._snapshotGrowth = {}
+        self._snapshotTypeGrowth = {}
+
         if config.GetBool('leak-container', 0):
             _createContainerLeak()
         if config.GetBool('leak-tasks', 0):
@@ -1016,6 +1319,9 @@ class ContainerLeakDetector(Job):
         # don't check our own tables for leaks
         ContainerLeakDetector.addPrivateObj(ContainerLeakDetector.PrivateIds)
         ContainerLeakDetector.addPrivateObj(self.__dict__)
+        for table in (self._snapshotTypeCounts, self._snapshotGrowth,
+                      self._snapshotTypeGrowth):
+            ContainerLeakDetector.addPrivateObj(table)
 
         self.setPriority(Job.Priorities.Min)
         jobMgr.add(self)
@@ -1029,11 +1335,22 @@ class ContainerLeakDetector(Job):
         if self._checkContainersJob is not None:
             jobMgr.remove(self._checkContainersJob)
             self._checkContainersJob = None
-        jobMgr.remove(self._findContainersJob)
-        self._findContainersJob = None
+        if self._findContainersJob is not None:
+            jobMgr.remove(self._findContainersJob)
+            self._findContainersJob = None
+        taskMgr.remove(self._getSnapshotTaskName())
+        if self._snapshotJob is not None:
+            jobMgr.remove(self._snapshotJob)
+            self._snapshotJob.destroy()
+            self._snapshotJob = None
         del self._id2ref
         del self._index2containerId2len
         del self._index2delay
+        del self._snapshotIds
+        del self._snapshotLengths
+        del self._snapshotTypeCounts
+        del self._snapshotGrowth
+        del self._snapshotTypeGrowth
 
     def _getDestroyEvent(self):
         # sent when leak detector is about to be destroyed
@@ -1058,6 +1375,12 @@ class ContainerLeakDetector(Job):
     def _getPruneTaskName(self):
         return 'pruneLeakingContainerRefs-%s' % self._serialNum
 
+    def _getSnapshotTaskName(self):
+        return 'snapshotLeakingContainers-%s' % self._serialNum
+
+    def getMode(self):
+        return self._mode
+
     def getContainerIds(self):
         return list(self._id2ref.keys())
 
@@ -1084,6 +1407,13 @@ class ContainerLeakDetector(Job):
             del self._id2ref[id]
 
     def run(self):
+        if self._mode == 'snapshot':
+            # the first snapshot just takes measurements, like the first check
+            taskMgr.doMethodLater(self._nextCheckDelay, self._takeSnapshot,
+                                  self._getSnapshotTaskName())
+            while True:
+                yield Job.Sleep
+
         # start looking for containers
         self._findContainersJob = FindContainers(
             '%s-findContainers' % self.getJobName(), self)
@@ -1139,3 +1469,17 @@ class ContainerLeakDetector(Job):
                         self._scheduleNextPruning)
         jobMgr.add(self._pruneContainersJob)
         return task.done
+
+    def _takeSnapshot(self, task=None):
+        self._snapshotJob = HeapSnapshot(
+            '%s-heapSnapshot-%s' % (self.getJobName(), self._snapshotIndex), self)
+        self.acceptOnce(self._snapshotJob.getFinishedEvent(),
+                        self._scheduleNextSnapshot)
+        jobMgr.add(self._snapshotJob)
+        return task.done
+
+    def _scheduleNextSnapshot(self):
+        self._snapshotJob.destroy()
+        self._snapshotJob = None
+        taskMgr.doMethodLater(self._snapshotPeriod, self._takeSnapshot,
+                              self._getSnapshotTaskName())
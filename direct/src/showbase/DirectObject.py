@@ -25,9 +25,15 @@ class DirectObject:
     def acceptOnce(self, event, method, extraArgs=[]):
         return messenger.accept(event, self, method, extraArgs, 0)
 
+    def acceptPattern(self, pattern, method, extraArgs=[]):
+        return messenger.acceptPattern(pattern, self, method, extraArgs, 1)
+
     def ignore(self, event):
         return messenger.ignore(event, self)
 
+    def ignorePattern(self, pattern):
+        return messenger.ignorePattern(pattern, self)
+
     def ignoreAll(self):
         return messenger.ignoreAll(self)
 
@@ -106,6 +112,8 @@ class DirectObject:
     do_method_later = doMethodLater
     detect_leaks = detectLeaks
     accept_once = acceptOnce
+    accept_pattern = acceptPattern
+    ignore_pattern = ignorePattern
     ignore_all = ignoreAll
     get_all_accepting = getAllAccepting
     is_ignoring = isIgnoring
@@ -7,7 +7,7 @@ __all__ = ['EventManager']
 from direct.directnotify.DirectNotifyGlobal import directNotify
 from direct.task.TaskManagerGlobal import taskMgr
 from direct.showbase.MessengerGlobal import messenger
-from panda3d.core import PStatCollector, EventQueue, EventHandler
+from panda3d.core import PStatCollector, Event, EventQueue, EventHandler
 from panda3d.core import ConfigVariableBool
 
 
@@ -27,6 +27,7 @@ class EventManager:
         self.eventHandler = None
 
         self._wantPstats = ConfigVariableBool('pstats-eventmanager', False)
+        self._wantBatch = ConfigVariableBool('eventmanager-batch', True)
 
     def doEvents(self):
         """
@@ -36,6 +37,9 @@ class EventManager:
         # for efficiency
         if self._wantPstats:
             processFunc = self.processEventPstats
+        elif self._wantBatch and not EventManager.notify.getDebug():
+            self.processEvents()
+            return
         else:
             processFunc = self.processEvent
         isEmptyFunc = self.eventQueue.isQueueEmpty
@@ -43,6 +47,56 @@ class EventManager:
         while not isEmptyFunc():
             processFunc(dequeueFunc())
 
+    def processEvents(self):
+        """
+        Process all the events on the C++ event queue in batches.  All
+        pending events are taken off the queue at once and handed to the
+        messenger together.  The parameters of an event are only decoded
+        if something in Python is listening for it.  Events thrown while
+        a batch is being processed are picked up in the next batch.  If a
+        handler raises, the events of the batch that were not sent yet are
+        put back on the queue before the exception propagates.
+        Duplicate any changes in processEvent
+        """
+        dequeueFunc = self.eventQueue.dequeueEvents
+        handler = self.eventHandler
+        afterEach = handler.dispatchEvent if handler else None
+        while True:
+            events = dequeueFunc()
+            if not events:
+                break
+            batch = []
+            for event in events:
+                eventName = event.name
+                if eventName:
+                    batch.append((eventName, event))
+                else:
+                    # An unnamed event from C++ is probably a bad thing
+                    EventManager.notify.warning('unnamed event in processEvents')
+            # Sent from an iterator, so that what is left of it is what
+            # was not sent.
+            pending = iter(batch)
+            try:
+                messenger.sendBatch(pending, Event.getParameterValues, afterEach)
+            except BaseException:
+                self.__requeueEvents([event for eventName, event in pending])
+                raise
+
+    def __requeueEvents(self, events):
+        """
+        Puts events taken off the C++ event queue back on it, ahead of
+        those thrown since, where processing them one at a time would
+        have left them.
+        """
+        if not events:
+            return
+        eventQueue = self.eventQueue
+        thrown = eventQueue.dequeueEvents()
+        for event in events:
+            eventQueue.queueEvent(event)
+        for event in thrown:
+            eventQueue.queueEvent(event)
+
     def eventLoopTask(self, task):
         """
         Process all the events on the C++ event queue
@@ -53,7 +107,9 @@ class EventManager:
 
     def parseEventParameter(self, eventParameter):
         """
-        Extract the actual data from the eventParameter
+        Extract the actual data from the eventParameter.  To extract all
+        parameters of an event at once, use Event.getParameterValues(),
+        which does the same in C++.
         """
         if eventParameter.isInt():
             return eventParameter.getIntValue()
@@ -75,7 +131,7 @@ class EventManager:
     def processEvent(self, event):
         """
         Process a C++ event
-        Duplicate any changes in processEventPstats
+        Duplicate any changes in processEventPstats and processEvents
         """
         # **************************************************************
         # ******** Duplicate any changes in processEventPstats *********
@@ -183,3 +239,4 @@ class EventManager:
 
     do_events = doEvents
     process_event = processEvent
+    process_events = processEvents
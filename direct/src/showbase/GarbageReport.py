@@ -3,12 +3,13 @@
 __all__ = ['FakeObject', '_createGarbage', 'GarbageReport', 'GarbageLogger']
 
 from direct.directnotify.DirectNotifyGlobal import directNotify
-from direct.showbase.PythonUtil import ScratchPad, Stack, AlphabetCounter
+from direct.showbase.PythonUtil import ScratchPad, AlphabetCounter
 from direct.showbase.PythonUtil import itype, deeptype, fastRepr
-from direct.showbase.Job import Job
+from direct.showbase.Job import Job, IsolatedJob
 from direct.showbase.JobManagerGlobal import jobMgr
 from direct.showbase.MessengerGlobal import messenger
 from panda3d.core import ConfigVariableBool
+from array import array
 import gc
 
 GarbageCycleCountAnnounceEvent = 'announceGarbageCycleDesc2num'
@@ -35,28 +36,194 @@ def _createGarbage(num=1):
         b.other = a
 
 
+class _IncrementalGlobals:
+    # garbage analyzed by the last incremental GarbageReport, kept alive so
+    # that the next one doesn't find it again
+    AnalyzedGarbage = []
+
+
+def _getNormalizedCycle(cycle):
+    # returns a representation of a cycle (list of indices) that will be
+    # reliably derived from a unique cycle regardless of ordering
+    # this lets us detect duplicate cycles that appear different because of
+    # which element appears first
+    if len(cycle) == 0:
+        return cycle
+    min = 1<<30
+    minIndex = None
+    for i in range(len(cycle)):
+        elem = cycle[i]
+        if elem < min:
+            min = elem
+            minIndex = i
+    return cycle[minIndex:] + cycle[:minIndex]
+
+
+def _getComponents(offsets, targets, stepsPerYield):
+    # finds the strongly connected components of the references between garbage
+    # items, using Tarjan's algorithm with an explicit stack
+    # yields None while working, then a list of the components that contain a
+    # cycle, each a sorted list of garbage item numbers
+    numGarbage = len(offsets) - 1
+    # visit order of each item, -1 if not visited yet
+    order = array('l', [-1]) * numGarbage
+    # lowest visit order reachable from each item
+    lowLink = array('l', [0]) * numGarbage
+    onStack = bytearray(numGarbage)
+    stack = []
+    components = []
+    counter = 0
+    steps = 0
+    for root in range(numGarbage):
+        if order[root] != -1:
+            continue
+        order[root] = lowLink[root] = counter
+        counter += 1
+        stack.append(root)
+        onStack[root] = 1
+        # (item, position of its next referent)
+        work = [(root, offsets[root])]
+        while work:
+            steps += 1
+            if steps % stepsPerYield == 0:
+                yield None
+            node, pos = work[-1]
+            if pos < offsets[node + 1]:
+                work[-1] = (node, pos + 1)
+                referent = targets[pos]
+                if order[referent] == -1:
+                    order[referent] = lowLink[referent] = counter
+                    counter += 1
+                    stack.append(referent)
+                    onStack[referent] = 1
+                    work.append((referent, offsets[referent]))
+                elif onStack[referent] and order[referent] < lowLink[node]:
+                    lowLink[node] = order[referent]
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                if lowLink[node] < lowLink[parent]:
+                    lowLink[parent] = lowLink[node]
+            if lowLink[node] == order[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    onStack[member] = 0
+                    component.append(member)
+                    if member == node:
+                        break
+                # a single item is only a cycle if it refers to itself
+                if len(component) > 1 or node in targets[offsets[node]:offsets[node + 1]]:
+                    component.sort()
+                    components.append(component)
+    yield components
+
+
+def _getComponentCycle(component, offsets, targets, delFlags):
+    # finds the shortest cycle through the first item of a strongly connected
+    # component, with a breadth-first search inside the component
+    # yields None while working, then the cycle as a list of garbage item numbers
+    # that repeats the first at the end, or None if the component does not need to
+    # be reported
+    start = component[0]
+    if delFlags is not None:
+        # cycles with no instances that define __del__ will be
+        # cleaned up by Python
+        for num in component:
+            if delFlags[num]:
+                start = num
+                break
+        else:
+            yield None
+            return
+    members = set(component)
+    parents = {start: None}
+    queue = [start]
+    last = None
+    for node in queue:
+        if len(parents) % 20 == 0:
+            yield None
+        for pos in range(offsets[node], offsets[node + 1]):
+            referent = targets[pos]
+            if referent == start:
+                last = node
+                break
+            if referent in members and referent not in parents:
+                parents[referent] = node
+                queue.append(referent)
+        if last is not None:
+            break
+    cycle = []
+    while last is not None:
+        cycle.append(last)
+        last = parents[last]
+    cycle.reverse()
+    cycle = _getNormalizedCycle(cycle)
+    yield cycle + [cycle[0]]
+
+
+def _findGarbageCycles(offsets, targets, delFlags, stepsPerYield):
+    # The isolated work of a GarbageReport, see Job.getIsolatedWork().  Takes
+    # the references between garbage items as a compressed adjacency list: the
+    # referents of item i are targets[offsets[i]:offsets[i+1]].  If delFlags is
+    # given, only cycles through the items flagged in it are reported.
+    # Yields None while working, then a list with a (component, cycle) pair for
+    # each strongly connected component, with the cycle as returned by
+    # _getComponentCycle()
+    for components in _getComponents(offsets, targets, stepsPerYield):
+        yield None
+    componentCycles = []
+    for component in components:
+        for cycle in _getComponentCycle(component, offsets, targets, delFlags):
+            yield None
+        componentCycles.append((component, cycle))
+    yield componentCycles
+    yield Job.Done
+
+
 class GarbageReport(Job):
     """Detects leaked Python objects (via gc.collect()) and reports on garbage
     items, garbage-to-garbage references, and garbage cycles.
-    If you just want to dump the report to the log, use GarbageLogger."""
+    If you just want to dump the report to the log, use GarbageLogger.
+
+    The references between garbage items are gathered once into a compact
+    graph, and the cycles are found as its strongly connected components,
+    in time linear in the number of references.  Each group of garbage
+    items that reference each other is reported as one cycle through it.
+    As that search only needs the graph, it is handed to the JobManager as
+    isolated work, which can run in a worker; see Job.getIsolatedWork().
+
+    An incremental report only analyzes the garbage created since the last
+    incremental report.  The garbage of a report is kept alive until the
+    next incremental report has collected, which then lets it be freed, so
+    only the garbage of the last report is held at any time."""
     notify = directNotify.newCategory("GarbageReport")
 
+    # Tarjan steps to take between yields
+    StepsPerYield = 200
+
     def __init__(self, name, log=True, verbose=False, fullReport=False, findCycles=True,
                  threaded=False, doneCallback=None, autoDestroy=False, priority=None,
-                 safeMode=False, delOnly=False, collect=True):
+                 safeMode=False, delOnly=False, collect=True, incremental=False):
         # if autoDestroy is True, GarbageReport will self-destroy after logging
         # if false, caller is responsible for calling destroy()
         # if threaded is True, processing will be performed over multiple frames
         # if collect is False, we assume that the caller just did a collect and the results
         # are still in gc.garbage
+        # if incremental is True, the garbage is kept alive after the report, so that the
+        # next incremental report only analyzes garbage created since, and frees it; see
+        # releaseAnalyzedGarbage()
         Job.__init__(self, name)
         # stick the arguments onto a ScratchPad so we can delete them all at once
         self._args = ScratchPad(name=name, log=log, verbose=verbose, fullReport=fullReport,
-                                findCycles=findCycles, doneCallback=doneCallback,
+                                findCycles=findCycles, threaded=threaded, doneCallback=doneCallback,
                                 autoDestroy=autoDestroy, safeMode=safeMode, delOnly=delOnly,
-                                collect=collect)
+                                collect=collect, incremental=incremental)
         if priority is not None:
             self.setPriority(priority)
+        # finds the cycles while the report waits, see _findGarbageCycles()
+        self._cycleJob = None
         jobMgr.add(self)
         if not threaded:
             jobMgr.finish(self)
@@ -102,6 +269,15 @@ class GarbageReport(Job):
             gc.collect()
         self.garbage = gc.garbage[:]
         del gc.garbage[:]
+        if self._args.incremental:
+            # the garbage of the last incremental report was kept alive so that this
+            # collect didn't find it again; now that it has been passed over, free it
+            # for good, with a collect that doesn't save it, and keep this report's
+            # garbage alive instead
+            numAnalyzed = len(_IncrementalGlobals.AnalyzedGarbage)
+            _IncrementalGlobals.AnalyzedGarbage = self.garbage[:]
+            gc.set_debug(0)
+            gc.collect()
         # only yield if there's more time-consuming work to do,
         # if there's no garbage, give instant feedback
         if len(self.garbage) > 0:
@@ -118,7 +294,11 @@ class GarbageReport(Job):
             yield None
 
         if self._args.verbose:
-            self.notify.info('found %s garbage items' % self.numGarbage)
+            if self._args.incremental:
+                self.notify.info('found %s new garbage items, freed %s analyzed before' % (
+                    self.numGarbage, numAnalyzed))
+            else:
+                self.notify.info('found %s garbage items' % self.numGarbage)
 
         # print the types of the garbage first, in case the repr of an object
         # causes a crash
@@ -138,6 +318,14 @@ class GarbageReport(Job):
 
         self._id2garbageInfo = {}
 
+        # garbage-to-garbage references, as a compressed adjacency list: the
+        # referents of item i are _referentTargets[_referentOffsets[i]:_referentOffsets[i+1]]
+        self._referentOffsets = array('l', [0])
+        self._referentTargets = array('l')
+
+        self.components = []
+        # (component, cycle through it) pairs, see _findGarbageCycles()
+        self._componentCycles = []
         self.cycles = []
         self.cyclesBySyntax = []
         self.uniqueCycleSets = set()
@@ -149,29 +337,20 @@ class GarbageReport(Job):
             if i % 20 == 0:
                 yield None
 
-        # grab the referrers (pointing to garbage)
-        if self._args.fullReport and (self.numGarbage != 0):
-            if self._args.verbose:
-                self.notify.info('getting referrers...')
-            for i in range(self.numGarbage):
-                yield None
-                for result in self._getReferrers(self.garbage[i]):
-                    yield None
-                byNum, byRef = result
-                self.referrersByNumber[i] = byNum
-                self.referrersByReference[i] = byRef
-
         # grab the referents (pointed to by garbage)
         if self.numGarbage > 0:
             if self._args.verbose:
                 self.notify.info('getting referents...')
-            for i in range(self.numGarbage):
+            for result in self._getReferents():
+                yield None
+
+        # grab the referrers (pointing to garbage); only other garbage can
+        # refer to garbage, so they are the referents the other way around
+        if self._args.fullReport and (self.numGarbage != 0):
+            if self._args.verbose:
+                self.notify.info('getting referrers...')
+            for result in self._getReferrers():
                 yield None
-                for result in self._getReferents(self.garbage[i]):
-                    yield None
-                byNum, byRef = result
-                self.referentsByNumber[i] = byNum
-                self.referentsByReference[i] = byRef
 
         for i in range(self.numGarbage):
             if hasattr(self.garbage[i], '_garbageInfo') and callable(self.garbage[i]._garbageInfo):
@@ -189,10 +368,37 @@ class GarbageReport(Job):
         if self._args.findCycles and self.numGarbage > 0:
             if self._args.verbose:
                 self.notify.info('calculating cycles...')
-            for i in range(self.numGarbage):
+            delFlags = None
+            if self._args.delOnly:
+                # which garbage items are instances that define __del__
+                delFlags = bytearray(self.numGarbage)
+                for i in range(self.numGarbage):
+                    if id(self.garbage[i]) in self.garbageInstanceIds:
+                        delFlags[i] = 1
+                    if i % 20 == 0:
+                        yield None
+            # finding the cycles only needs the garbage item numbers, so the
+            # JobManager can do it in a worker
+            self._cycleJob = IsolatedJob(
+                '%s-cycles' % self.getJobName(), _findGarbageCycles,
+                (self._referentOffsets, self._referentTargets, delFlags, self.StepsPerYield),
+                priority=self.getPriority())
+            self.accept(self._cycleJob.getResultEvent(), self._handleComponentCycles)
+            jobMgr.add(self._cycleJob)
+            if not self._args.threaded:
+                jobMgr.finish(self._cycleJob)
+            while not self._cycleJob.isFinished():
+                yield Job.Sleep
+            self.ignore(self._cycleJob.getResultEvent())
+            self._cycleJob.destroy()
+            self._cycleJob = None
+            for component, cycle in self._componentCycles:
+                self.components.append(component)
                 yield None
-                for newCycles in self._getCycles(i, self.uniqueCycleSets):
-                    yield None
+                if cycle is None:
+                    continue
+                newCycles = [cycle]
+                self.uniqueCycleSets.add(tuple(cycle[:-1]))
                 self.cycles.extend(newCycles)
                 # create a representation of the cycle in human-readable form
                 newCyclesBySyntax = []
@@ -412,6 +618,10 @@ class GarbageReport(Job):
         del self.referentsByNumber
         if hasattr(self, 'cycles'):
             del self.cycles
+            del self.components
+            del self._componentCycles
+            del self._referentOffsets
+            del self._referentTargets
         del self._report
         if hasattr(self, '_reportStr'):
             del self._reportStr
@@ -432,6 +642,19 @@ class GarbageReport(Job):
     def getGarbage(self):
         return self.garbage
 
+    def getComponents(self):
+        # lists of garbage item numbers that all reference each other
+        return self.components
+
+    @staticmethod
+    def releaseAnalyzedGarbage():
+        # lets go of the garbage kept alive by incremental reports, so that the next
+        # report sees all of it again
+        del _IncrementalGlobals.AnalyzedGarbage[:]
+
+    def _handleComponentCycles(self, componentCycles):
+        self._componentCycles = componentCycles
+
     def getReport(self):
         if not hasattr(self, '_reportStr'):
             self._reportStr = ''
@@ -439,112 +662,47 @@ class GarbageReport(Job):
                 self._reportStr += '\n' + str
         return self._reportStr
 
-    def _getReferrers(self, obj):
-        # referrers (pointing to garbage)
-        # returns two lists, first by index into gc.garbage, second by
-        # direct reference
-        yield None
-        byRef = gc.get_referrers(obj)
-        yield None
-        # look to see if each referrer is another garbage item
-        byNum = []
-        for i in range(len(byRef)):
+    def _getReferents(self):
+        # referents (pointed to by garbage)
+        # fills in the compressed adjacency list of references between garbage
+        # items, and for a full report, the referents of each item by index into
+        # gc.garbage and by direct reference
+        offsets = self._referentOffsets
+        targets = self._referentTargets
+        id2index = self._id2index
+        for i in range(self.numGarbage):
             if i % 20 == 0:
                 yield None
-            referrer = byRef[i]
-            num = self._id2index.get(id(referrer), None)
-            byNum.append(num)
-        yield byNum, byRef
-
-    def _getReferents(self, obj):
-        # referents (pointed to by garbage)
-        # returns two lists, first by index into gc.garbage, second by
-        # direct reference
-        yield None
-        byRef = gc.get_referents(obj)
+            byRef = gc.get_referents(self.garbage[i])
+            for referent in byRef:
+                num = id2index.get(id(referent))
+                if num is not None:
+                    targets.append(num)
+            offsets.append(len(targets))
+            if self._args.fullReport:
+                self.referentsByNumber[i] = [id2index.get(id(referent)) for referent in byRef]
+                self.referentsByReference[i] = byRef
         yield None
-        # look to see if each referent is another garbage item
-        byNum = []
-        for i in range(len(byRef)):
+
+    def _getReferrers(self):
+        # referrers (pointing to garbage)
+        # fills in the referrers of each item by index into gc.garbage and by direct
+        # reference, by reversing the references between garbage items, which is much
+        # faster than gc.get_referrers(), which searches every object for each item
+        offsets = self._referentOffsets
+        targets = self._referentTargets
+        for i in range(self.numGarbage):
+            self.referrersByNumber[i] = []
+        for i in range(self.numGarbage):
             if i % 20 == 0:
                 yield None
-            referent = byRef[i]
-            num = self._id2index.get(id(referent), None)
-            byNum.append(num)
-        yield byNum, byRef
-
-    def _getNormalizedCycle(self, cycle):
-        # returns a representation of a cycle (list of indices) that will be
-        # reliably derived from a unique cycle regardless of ordering
-        # this lets us detect duplicate cycles that appear different because of
-        # which element appears first
-        if len(cycle) == 0:
-            return cycle
-        min = 1<<30
-        minIndex = None
-        for i in range(len(cycle)):
-            elem = cycle[i]
-            if elem < min:
-                min = elem
-                minIndex = i
-        return cycle[minIndex:] + cycle[:minIndex]
-
-    def _getCycles(self, index, uniqueCycleSets=None):
-        # detect garbage cycles for a particular item of garbage
-        assert self.notify.debugCall()
-        # returns list of lists, sublists are garbage reference cycles
-        cycles = []
-        # this lets us eliminate duplicate cycles
-        if uniqueCycleSets is None:
-            uniqueCycleSets = set()
-        stateStack = Stack()
-        rootId = index
-        # check if the root object is one of the garbage instances (has __del__)
-        objId = id(self.garbage[rootId])
-        numDelInstances = int(objId in self.garbageInstanceIds)
-        stateStack.push(([rootId], rootId, numDelInstances, 0))
-        while True:
-            yield None
-            if len(stateStack) == 0:
-                break
-            candidateCycle, curId, numDelInstances, resumeIndex = stateStack.pop()
-            if self.notify.getDebug():
-                if self._args.delOnly:
-                    print('restart: %s root=%s cur=%s numDelInstances=%s resume=%s' % (
-                        candidateCycle, rootId, curId, numDelInstances, resumeIndex))
-                else:
-                    print('restart: %s root=%s cur=%s resume=%s' % (
-                        candidateCycle, rootId, curId, resumeIndex))
-            for index in range(resumeIndex, len(self.referentsByNumber[curId])):
+            for pos in range(offsets[i], offsets[i + 1]):
+                self.referrersByNumber[targets[pos]].append(i)
+        for i in range(self.numGarbage):
+            if i % 20 == 0:
                 yield None
-                refId = self.referentsByNumber[curId][index]
-                if self.notify.getDebug():
-                    print('       : %s -> %s' % (curId, refId))
-                if refId == rootId:
-                    # we found a cycle! mark it down and move on to the next refId
-                    normCandidateCycle = self._getNormalizedCycle(candidateCycle)
-                    normCandidateCycleTuple = tuple(normCandidateCycle)
-                    if not normCandidateCycleTuple in uniqueCycleSets:
-                        # cycles with no instances that define __del__ will be
-                        # cleaned up by Python
-                        if (not self._args.delOnly) or numDelInstances >= 1:
-                            if self.notify.getDebug():
-                                print('  FOUND: ', normCandidateCycle + [normCandidateCycle[0],])
-                            cycles.append(normCandidateCycle + [normCandidateCycle[0],])
-                            uniqueCycleSets.add(normCandidateCycleTuple)
-                elif refId in candidateCycle:
-                    pass
-                elif refId is not None:
-                    # check if this object is one of the garbage instances (has __del__)
-                    objId = id(self.garbage[refId])
-                    numDelInstances += int(objId in self.garbageInstanceIds)
-                    # this refId does not complete a cycle. Mark down
-                    # where we are in this list of referents, then
-                    # start looking through the referents of the new refId
-                    stateStack.push((list(candidateCycle), curId, numDelInstances, index+1))
-                    stateStack.push((list(candidateCycle) + [refId], refId, numDelInstances, 0))
-                    break
-        yield cycles
+            self.referrersByReference[i] = [self.garbage[num] for num in self.referrersByNumber[i]]
+        yield None
 
 
 class GarbageLogger(GarbageReport):
@@ -1,5 +1,7 @@
 from direct.showbase.DirectObject import DirectObject
+from direct.showbase.MessengerGlobal import messenger
 from direct.showbase.PythonUtil import ScratchPad, SerialNumGen
+import types
 
 if __debug__:
     from panda3d.core import PStatCollector
@@ -45,6 +47,9 @@ class Job(DirectObject):
     def getFinishedEvent(self):
         return 'job-finished-%s' % self._id
 
+    def getResultEvent(self):
+        return 'job-result-%s' % self._id
+
     def run(self):
         """This should be overridden with a generator that does the
         needful processing.
@@ -56,6 +61,29 @@ class Job(DirectObject):
         """
         raise NotImplementedError("don't call down")
 
+    def getIsolatedWork(self):
+        """Override this to make the job isolatable, meaning that it does
+        not touch any state of the program while it runs, so that the
+        JobManager may run it in a worker process or thread instead of in
+        its timeslice on the main thread.
+
+        Return a ``(function, args)`` tuple.  Both must be picklable, so
+        the function has to be defined at the top level of a module.
+        The function may return a single result, or be a generator that
+        yields any number of results, ending with `Job.Done`; yielding
+        `Job.Continue` or `Job.Sleep` is allowed but has no effect in a
+        worker.  Every result is passed to `handleResult()` on the main
+        thread, and sent as the job's result event.
+
+        If the JobManager has no worker pool, the function is run in the
+        timeslice on the main thread instead, as though it were `run()`.
+        """
+        return None
+
+    def handleResult(self, result):
+        """Called on the main thread with every result of the isolated
+        work, see `getIsolatedWork()`."""
+
     def getPriority(self):
         return self._priority
     def setPriority(self, priority):
@@ -101,12 +129,59 @@ class Job(DirectObject):
 
     def _getGenerator(self):
         if self._generator is None:
-            self._generator = self.run()
+            work = self.getIsolatedWork()
+            if work is None:
+                self._generator = self.run()
+            else:
+                self._generator = self._runIsolatedWork(*work)
         return self._generator
+    def _runIsolatedWork(self, function, args):
+        # runs the isolated work on the main thread, for a JobManager that
+        # has no worker pool
+        results = function(*args)
+        if not isinstance(results, types.GeneratorType):
+            if results is not None:
+                self._deliverResult(results)
+            yield Job.Done
+            return
+        for result in results:
+            if result is Job.Done:
+                break
+            if result is Job.Sleep:
+                yield Job.Sleep
+                continue
+            if result is not Job.Continue:
+                self._deliverResult(result)
+            yield Job.Continue
+        yield Job.Done
+    def _deliverResult(self, result):
+        self.handleResult(result)
+        messenger.send(self.getResultEvent(), [result])
     def _cleanupGenerator(self):
         if self._generator is not None:
             self._generator = None
 
+
+class IsolatedJob(Job):
+    """Job that runs a function as isolated work, see
+    `Job.getIsolatedWork()`.  Lets a job hand the part of its work that
+    doesn't touch program state to the JobManager's worker pool, and
+    collect the results through the result event.
+    """
+
+    def __init__(self, name, function, args=(), priority=None):
+        Job.__init__(self, name)
+        self._work = (function, tuple(args))
+        if priority is not None:
+            self.setPriority(priority)
+
+    def destroy(self):
+        del self._work
+        Job.destroy(self)
+
+    def getIsolatedWork(self):
+        return self._work
+
 if __debug__: # __dev__ not yet available at this point
     class TestJob(Job):
         def __init__(self):
@@ -1,9 +1,54 @@
-from panda3d.core import ConfigVariableBool, ConfigVariableDouble, ClockObject
+from panda3d.core import ConfigVariableBool, ConfigVariableDouble, ConfigVariableInt, ConfigVariableString, ClockObject
 from direct.directnotify.DirectNotifyGlobal import directNotify
 from direct.task.TaskManagerGlobal import taskMgr
 from direct.showbase.Job import Job
 from direct.showbase.PythonUtil import flywheel
 from direct.showbase.MessengerGlobal import messenger
+import heapq
+import os
+import types
+
+
+# messages sent back from the worker pool, as (jobId, kind, value)
+_Result = 'result'
+_Done = 'done'
+_Error = 'error'
+
+# the result queue of a worker process, see _initWorkerProcess()
+_processQueue = None
+
+
+def _runIsolatedWork(put, jobId, function, args, cancelled=None):
+    # Runs the isolated work of a job in a worker, see Job.getIsolatedWork(),
+    # and passes every result to put().
+    try:
+        results = function(*args)
+        if not isinstance(results, types.GeneratorType):
+            if results is not None:
+                put((jobId, _Result, results))
+        else:
+            for result in results:
+                if result is Job.Done:
+                    break
+                if cancelled is not None and jobId in cancelled:
+                    results.close()
+                    break
+                if result is not Job.Continue and result is not Job.Sleep:
+                    put((jobId, _Result, result))
+    except Exception:
+        import traceback
+        put((jobId, _Error, traceback.format_exc()))
+    else:
+        put((jobId, _Done, None))
+
+
+def _initWorkerProcess(queue):
+    global _processQueue
+    _processQueue = queue
+
+
+def _runIsolatedWorkInProcess(jobId, function, args):
+    _runIsolatedWork(_processQueue.put, jobId, function, args)
 
 
 class JobManager:
@@ -11,15 +56,38 @@ class JobManager:
     Similar to the taskMgr but designed for tasks that are CPU-intensive and/or
     not time-critical. Jobs run in a fixed timeslice that the JobManager is
     allotted each frame.
+
+    Jobs that are isolatable, see Job.getIsolatedWork(), run in a pool of
+    worker processes or threads instead, set by the
+    job-manager-isolated-backend config variable, and are given a worker in
+    order of priority.  Only handling their results takes from the
+    timeslice.
     """
     notify = directNotify.newCategory("JobManager")
 
     # there's one task for the JobManager, all jobs run in this task
     TaskName = 'jobManager'
+    # except for isolated jobs, which this task collects the results of
+    IsolatedTaskName = 'jobManager-isolated'
 
-    def __init__(self, timeslice=None):
+    def __init__(self, timeslice=None, isolatedBackend=None, numIsolatedWorkers=None):
         # how long do we run per frame
         self._timeslice = timeslice
+        # where isolated jobs run: 'process', 'thread', or 'none' to run them
+        # in the timeslice like other jobs
+        self._isolatedBackend = isolatedBackend
+        self._numIsolatedWorkers = numIsolatedWorkers
+        self._isolatedPool = None
+        self._isolatedQueue = None
+        # jobId -> job, for every isolated job that is waiting or running
+        self._isolatedJobs = {}
+        # heap of (-priority, jobId, work) for isolated jobs that
+        # are waiting for a worker
+        self._isolatedPending = []
+        # jobId -> future, for isolated jobs that have a worker
+        self._isolatedRunning = {}
+        # jobIds of removed jobs whose workers should stop
+        self._isolatedCancelled = set()
         # store the jobs in these structures to allow fast lookup by various keys
         # priority -> jobId -> job
         self._pri2jobId2job = {}
@@ -42,11 +110,27 @@ class JobManager:
 
     def destroy(self):
         taskMgr.remove(JobManager.TaskName)
+        taskMgr.remove(JobManager.IsolatedTaskName)
+        if self._isolatedPool is not None:
+            self._isolatedCancelled.update(self._isolatedJobs)
+            # shutdown() only takes cancel_futures from Python 3.9
+            for future in self._isolatedRunning.values():
+                future.cancel()
+            self._isolatedPool.shutdown(wait=False)
+            self._isolatedPool = None
+        self._isolatedJobs.clear()
+        self._isolatedRunning.clear()
+        del self._isolatedPending[:]
         del self._pri2jobId2job
 
     def add(self, job):
         pri = job.getPriority()
         jobId = job._getJobId()
+        if self.getIsolatedBackend() != 'none':
+            work = job.getIsolatedWork()
+            if work is not None:
+                self._addIsolated(job, work)
+                return
         # store the job in the main table
         self._pri2jobId2job.setdefault(pri, {})
         self._pri2jobId2job[pri][jobId] = job
@@ -70,6 +154,9 @@ class JobManager:
 
     def remove(self, job):
         jobId = job._getJobId()
+        if jobId in self._isolatedJobs:
+            self._removeIsolated(job)
+            return
         # look up the job's priority
         pri = self._jobId2pri.pop(jobId)
         # TODO: this removal is a linear search
@@ -99,6 +186,9 @@ class JobManager:
         # run this job, right now, until it finishes
         assert self.notify.debugCall()
         jobId = job._getJobId()
+        if jobId in self._isolatedJobs:
+            self._finishIsolated(job)
+            return
         # look up the job's priority
         pri = self._jobId2pri[jobId]
         # grab the job
@@ -139,6 +229,150 @@ class JobManager:
     def setTimeslice(self, timeslice):
         self._timeslice = timeslice
 
+    def getIsolatedBackend(self):
+        if self._isolatedBackend is None:
+            # 'process' runs them in parallel, but forks or spawns workers
+            # from a process that may hold a graphics context and Panda
+            # threads, and spawn imports the main module again; so it has
+            # to be asked for
+            self._isolatedBackend = ConfigVariableString(
+                'job-manager-isolated-backend', 'thread').value
+        return self._isolatedBackend
+
+    def getNumIsolatedWorkers(self):
+        if self._numIsolatedWorkers is None:
+            # zero means one per core, leaving one for the main thread
+            numWorkers = ConfigVariableInt('job-manager-isolated-workers', 0).value
+            if numWorkers <= 0:
+                numWorkers = max(1, (os.cpu_count() or 2) - 1)
+            self._numIsolatedWorkers = numWorkers
+        return self._numIsolatedWorkers
+
+    def _getIsolatedPool(self):
+        if self._isolatedPool is None:
+            from concurrent import futures
+            backend = self.getIsolatedBackend()
+            numWorkers = self.getNumIsolatedWorkers()
+            if backend == 'process':
+                import multiprocessing
+                # SimpleQueue pickles in put(), so that a result that can't
+                # be pickled fails the job instead of being lost
+                self._isolatedQueue = multiprocessing.SimpleQueue()
+                self._isolatedPool = futures.ProcessPoolExecutor(
+                    numWorkers, initializer=_initWorkerProcess,
+                    initargs=(self._isolatedQueue, ))
+            elif backend == 'thread':
+                import queue
+                self._isolatedQueue = queue.SimpleQueue()
+                self._isolatedPool = futures.ThreadPoolExecutor(
+                    numWorkers, thread_name_prefix='JobManager')
+            else:
+                raise ValueError('unknown job-manager-isolated-backend: %s' % backend)
+        return self._isolatedPool
+
+    def _addIsolated(self, job, work):
+        jobId = job._getJobId()
+        self._isolatedJobs[jobId] = job
+        # jobs get a worker in order of priority, and in the order they
+        # were added within a priority
+        heapq.heappush(self._isolatedPending, (-job.getPriority(), jobId, work))
+        if len(self._isolatedJobs) == 1:
+            taskMgr.add(self._processIsolated, JobManager.IsolatedTaskName)
+        self._startIsolated()
+        self.notify.debug('added isolated job: %s' % job.getJobName())
+
+    def _startIsolated(self, jobId=None):
+        # hands waiting jobs to free workers, or the given job right away
+        pending = self._isolatedPending
+        while pending and (jobId is not None or
+                           len(self._isolatedRunning) < self.getNumIsolatedWorkers()):
+            if jobId is not None:
+                entry = [entry for entry in pending if entry[1] == jobId][0]
+                pending.remove(entry)
+                heapq.heapify(pending)
+            else:
+                entry = heapq.heappop(pending)
+            pri, startId, work = entry
+            if startId not in self._isolatedJobs:
+                # removed while waiting
+                continue
+            function, args = work
+            pool = self._getIsolatedPool()
+            if self.getIsolatedBackend() == 'process':
+                future = pool.submit(_runIsolatedWorkInProcess, startId, function, args)
+            else:
+                future = pool.submit(_runIsolatedWork, self._isolatedQueue.put,
+                                     startId, function, args, self._isolatedCancelled)
+            self._isolatedRunning[startId] = future
+            if jobId is not None:
+                break
+
+    def _removeIsolated(self, job):
+        jobId = job._getJobId()
+        del self._isolatedJobs[jobId]
+        future = self._isolatedRunning.pop(jobId, None)
+        if future is not None and not future.cancel():
+            # already running; a thread checks this between results, a
+            # process runs to the end and its results are ignored
+            self._isolatedCancelled.add(jobId)
+        if not self._isolatedJobs:
+            taskMgr.remove(JobManager.IsolatedTaskName)
+        self._startIsolated()
+        self.notify.debug('removed isolated job: %s' % job.getJobName())
+
+    def _finishIsolated(self, job):
+        jobId = job._getJobId()
+        if jobId not in self._isolatedRunning:
+            self._startIsolated(jobId)
+        from concurrent import futures
+        while jobId in self._isolatedJobs:
+            if not self._isolatedQueue.empty():
+                self._handleIsolatedMessage(self._isolatedQueue.get())
+                continue
+            self._checkIsolatedFutures()
+            future = self._isolatedRunning.get(jobId)
+            if future is not None:
+                # a worker puts its last message before its future is done
+                futures.wait([future], timeout=.01)
+
+    def _handleIsolatedMessage(self, message):
+        jobId, kind, value = message
+        job = self._isolatedJobs.get(jobId)
+        if job is None:
+            # it was removed
+            self._isolatedCancelled.discard(jobId)
+            return
+        if kind == _Result:
+            job._deliverResult(value)
+            return
+        if kind == _Error:
+            self.notify.warning('isolated job %s failed:\n%s' % (job.getJobName(), value))
+        self._isolatedRunning.pop(jobId, None)
+        self._removeIsolated(job)
+        job._setFinished()
+        messenger.send(job.getFinishedEvent())
+
+    def _checkIsolatedFutures(self):
+        # a job can fail without reaching the worker, if its work can't be
+        # pickled or the pool broke
+        for jobId, future in list(self._isolatedRunning.items()):
+            if future.done() and not future.cancelled() and future.exception() is not None:
+                self._handleIsolatedMessage((jobId, _Error, repr(future.exception())))
+
+    def _processIsolated(self, task):
+        # Only handling the results is charged to the timeslice; the work
+        # itself is done by the workers.
+        clock = ClockObject.getGlobalClock()
+        endT = clock.getRealTime() + (self.getTimeslice() * .9)
+        queue = self._isolatedQueue
+        while queue is not None and not queue.empty():
+            self._handleIsolatedMessage(queue.get())
+            if clock.getRealTime() >= endT:
+                break
+        self._checkIsolatedFutures()
+        self._startIsolated()
+        return task.cont
+
     def _getSortedPriorities(self):
         # returns all job priorities in ascending order
         return sorted(self._pri2jobId2job)
@@ -238,5 +472,10 @@ class JobManager:
                 for jobId in self._pri2jobIds[pri]:
                     job = jobId2job[jobId]
                     s += '\n%5d: %s (jobId %s)' % (pri, job.getJobName(), jobId)
+        if self._isolatedJobs:
+            s += '\nisolated jobs (%s backend):' % self.getIsolatedBackend()
+            for jobId, job in self._isolatedJobs.items():
+                state = 'running' if jobId in self._isolatedRunning else 'waiting'
+                s += '\n%5d: %s (jobId %s, %s)' % (job.getPriority(), job.getJobName(), jobId, state)
         s += '\n'
         return s
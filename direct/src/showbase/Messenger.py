@@ -7,6 +7,9 @@ __all__ = ['Messenger']
 from direct.stdpy.threading import Lock
 from direct.directnotify import DirectNotifyGlobal
 from .PythonUtil import safeRepr
+import fnmatch
+import re
+import time
 import types
 
 
@@ -14,6 +17,10 @@ class Messenger:
 
     notify = DirectNotifyGlobal.directNotify.newCategory("Messenger")
 
+    # Number of event names whose matching patterns, and acceptors when they
+    # are only accepted through patterns, are remembered.
+    _MaxPatternMatches = 4096
+
     def __init__(self):
         """
         One is keyed off the event name. It has the following structure::
@@ -37,6 +44,32 @@ class Messenger:
         self.__callbacks = {}
         # objMsgrId->set(eventName)
         self.__objectEvents = {}
+        # eventName->tuple of (acceptorDict, pattern, objMsgrId).  This is
+        # the precompiled list of acceptors that send() walks without
+        # taking the lock.  An entry is thrown away whenever the set of
+        # acceptors for its event changes, and recompiled on the next send.
+        self.__snapshots = {}
+        # The same, for events that are only accepted through patterns, or
+        # not accepted at all (an empty tuple) while there are patterns.
+        # These are kept apart so that they can be bounded like
+        # __patternMatches, since any number of event names may be sent.
+        self.__patternSnapshots = {}
+
+        # Glob-style pattern subscriptions, see acceptPattern().
+        # pattern->objMsgrId->callbackInfo
+        self.__patternCallbacks = {}
+        # objMsgrId->set(pattern)
+        self.__objectPatterns = {}
+        # Trie of patterns by their literal prefix, one nested dict per
+        # character.  The patterns ending at a node are stored under the
+        # '' key, as pattern->match function (None for a plain prefix).
+        self.__patternTrie = {}
+        # eventName->tuple of matching patterns
+        self.__patternMatches = {}
+
+        # Three-character substring of repr(eventName)->set(eventName),
+        # so findAll() need not search every event.
+        self.__eventIndex = {}
         self._messengerIdGen = 0
         # objMsgrId->listenerObject
         self._id2object = {}
@@ -49,6 +82,9 @@ class Messenger:
         # multithreaded access.
         self.lock = Lock()
 
+        # MessengerStats, while collecting statistics; see startStats().
+        self._stats = None
+
         if __debug__:
             self.__isWatching=0
             self.__watching={}
@@ -127,12 +163,36 @@ class Messenger:
         If the persistent flag is set, it will continue to respond
         to this event, otherwise it will respond only once.
         """
+        self.__accept(event, False, object, method, extraArgs, persistent)
+
+    def acceptPattern(self, pattern, object, method, extraArgs=[], persistent=1):
+        """ acceptPattern(self, string, DirectObject, Function, List, Boolean)
+
+        Like accept(), but makes this object accept every event whose name
+        matches the given glob-style pattern, as in the fnmatch module,
+        for instance ``'mouse*'`` or ``'*-into-*'``.  Matching is case
+        sensitive.  The method is called with the same arguments as for an
+        exact accept, so include the event name in the sent arguments or
+        use a separate method per pattern if the handler needs to know
+        which event matched.
+
+        Handlers accepting the exact event name are called before those
+        accepting it through a pattern.  If the persistent flag is not set,
+        the object stops accepting the pattern after the first matching
+        event.
+        """
+        if not isinstance(pattern, str):
+            raise TypeError("A string is required as pattern argument")
+
+        self.__accept(pattern, True, object, method, extraArgs, persistent)
+
+    def __accept(self, key, isPattern, object, method, extraArgs, persistent):
         notifyDebug = Messenger.notify.getDebug()
         if notifyDebug:
             Messenger.notify.debug(
-                "object: %s (%s)\n accepting: %s\n method: %s\n extraArgs: %s\n persistent: %s" %
-                (safeRepr(object), self._getMessengerId(object), event, safeRepr(method),
-                 safeRepr(extraArgs), persistent))
+                "object: %s (%s)\n accepting%s: %s\n method: %s\n extraArgs: %s\n persistent: %s" %
+                (safeRepr(object), self._getMessengerId(object), ' pattern' if isPattern else '',
+                 key, safeRepr(method), safeRepr(extraArgs), persistent))
 
         # Make sure that the method is callable
         assert hasattr(method, '__call__'), (
@@ -143,9 +203,22 @@ class Messenger:
         if not (isinstance(extraArgs, list) or isinstance(extraArgs, tuple) or isinstance(extraArgs, set)):
             raise TypeError("A list is required as extraArgs argument")
 
+        if isPattern:
+            callbacks = self.__patternCallbacks
+            objectKeys = self.__objectPatterns
+        else:
+            callbacks = self.__callbacks
+            objectKeys = self.__objectEvents
+
         self.lock.acquire()
         try:
-            acceptorDict = self.__callbacks.setdefault(event, {})
+            acceptorDict = callbacks.get(key)
+            if acceptorDict is None:
+                acceptorDict = callbacks[key] = {}
+                if isPattern:
+                    self.__addPattern(key)
+                else:
+                    self.__indexEvent(key)
 
             id = self._getMessengerId(object)
 
@@ -158,19 +231,26 @@ class Messenger:
                     if oldMethod == method:
                         self.notify.warning(
                             "object: %s was already accepting: \"%s\" with same callback: %s()" %
-                            (object.__class__.__name__, safeRepr(event), method.__name__))
+                            (object.__class__.__name__, safeRepr(key), method.__name__))
                     else:
                         self.notify.warning(
                             "object: %s accept: \"%s\" new callback: %s() supplanting old callback: %s()" %
-                            (object.__class__.__name__, safeRepr(event), method.__name__, oldMethod.__name__))
+                            (object.__class__.__name__, safeRepr(key), method.__name__, oldMethod.__name__))
+            elif isPattern:
+                # Any event may match the pattern.
+                self.__snapshots.clear()
+                self.__patternSnapshots.clear()
+            else:
+                self.__snapshots.pop(key, None)
+                self.__patternSnapshots.pop(key, None)
 
             acceptorDict[id] = [method, extraArgs, persistent]
 
             # Remember that this object is listening for this event
-            eventDict = self.__objectEvents.setdefault(id, {})
-            if event not in eventDict:
+            eventDict = objectKeys.setdefault(id, {})
+            if key not in eventDict:
                 self._storeObject(object)
-                eventDict[event] = None
+                eventDict[key] = None
         finally:
             self.lock.release()
 
@@ -185,32 +265,30 @@ class Messenger:
 
         self.lock.acquire()
         try:
-            id = self._getMessengerId(object)
-
-            # Find the dictionary of all the objects accepting this event
-            acceptorDict = self.__callbacks.get(event)
-            # If this object is there, delete it from the dictionary
-            if acceptorDict and id in acceptorDict:
-                del acceptorDict[id]
-                # If this dictionary is now empty, remove the event
-                # entry from the Messenger alltogether
-                if len(acceptorDict) == 0:
-                    del self.__callbacks[event]
+            self.__removeAcceptor(event, False, self._getMessengerId(object))
+        finally:
+            self.lock.release()
 
-            # This object is no longer listening for this event
-            eventDict = self.__objectEvents.get(id)
-            if eventDict and event in eventDict:
-                del eventDict[event]
-                if len(eventDict) == 0:
-                    del self.__objectEvents[id]
+    def ignorePattern(self, pattern, object):
+        """ ignorePattern(self, string, DirectObject)
+        Make this object no longer respond to events matching a pattern it
+        accepted with acceptPattern().  It is safe to call even if it was
+        not already accepting
+        """
+        if Messenger.notify.getDebug():
+            Messenger.notify.debug(
+                safeRepr(object) + ' (%s)\n now ignoring pattern: ' % (self._getMessengerId(object), ) + safeRepr(pattern))
 
-                self._releaseObject(object)
+        self.lock.acquire()
+        try:
+            self.__removeAcceptor(pattern, True, self._getMessengerId(object))
         finally:
             self.lock.release()
 
     def ignoreAll(self, object):
         """
-        Make this object no longer respond to any events it was accepting
+        Make this object no longer respond to any events it was accepting,
+        including patterns.
         Useful for cleanup
         """
         if Messenger.notify.getDebug():
@@ -224,20 +302,146 @@ class Messenger:
             eventDict = self.__objectEvents.get(id)
             if eventDict:
                 for event in list(eventDict.keys()):
-                    # Find the dictionary of all the objects accepting this event
-                    acceptorDict = self.__callbacks.get(event)
-                    # If this object is there, delete it from the dictionary
-                    if acceptorDict and id in acceptorDict:
-                        del acceptorDict[id]
-                        # If this dictionary is now empty, remove the event
-                        # entry from the Messenger alltogether
-                        if len(acceptorDict) == 0:
-                            del self.__callbacks[event]
-                    self._releaseObject(object)
-                del self.__objectEvents[id]
+                    self.__removeAcceptor(event, False, id)
+            patternDict = self.__objectPatterns.get(id)
+            if patternDict:
+                for pattern in list(patternDict.keys()):
+                    self.__removeAcceptor(pattern, True, id)
         finally:
             self.lock.release()
 
+    def __removeAcceptor(self, key, isPattern, id):
+        # Stops the object with the given id from accepting an event or
+        # pattern.  assumes lock is held.
+        if isPattern:
+            callbacks = self.__patternCallbacks
+            objectKeys = self.__objectPatterns
+        else:
+            callbacks = self.__callbacks
+            objectKeys = self.__objectEvents
+
+        # Find the dictionary of all the objects accepting this event
+        acceptorDict = callbacks.get(key)
+        # If this object is there, delete it from the dictionary
+        if acceptorDict and id in acceptorDict:
+            del acceptorDict[id]
+            if isPattern:
+                self.__snapshots.clear()
+                self.__patternSnapshots.clear()
+            else:
+                self.__snapshots.pop(key, None)
+                self.__patternSnapshots.pop(key, None)
+            # If this dictionary is now empty, remove the event
+            # entry from the Messenger alltogether
+            if len(acceptorDict) == 0:
+                del callbacks[key]
+                if isPattern:
+                    self.__removePattern(key)
+                else:
+                    self.__unindexEvent(key)
+
+        # This object is no longer listening for this event
+        eventDict = objectKeys.get(id)
+        if eventDict and key in eventDict:
+            del eventDict[key]
+            if len(eventDict) == 0:
+                del objectKeys[id]
+
+            self._releaseObject(self._getObject(id))
+
+    def __patternPrefix(self, pattern):
+        # The literal part of a pattern, before its first wildcard.
+        prefixLength = len(pattern)
+        for wildcard in '*?[':
+            index = pattern.find(wildcard)
+            if index >= 0:
+                prefixLength = min(prefixLength, index)
+        return pattern[:prefixLength]
+
+    def __addPattern(self, pattern):
+        # Files a new pattern in the trie under its literal prefix.
+        # assumes lock is held.
+        prefix = self.__patternPrefix(pattern)
+        node = self.__patternTrie
+        for char in prefix:
+            node = node.setdefault(char, {})
+
+        # A pattern that is just a prefix followed by * matches anything
+        # that reaches its node, so it needs no regular expression.
+        if pattern[len(prefix):] == '*':
+            matcher = None
+        else:
+            matcher = re.compile(fnmatch.translate(pattern)).match
+        node.setdefault('', {})[pattern] = matcher
+        self.__patternMatches.clear()
+
+    def __removePattern(self, pattern):
+        # Removes a pattern from the trie, pruning nodes left empty.
+        # assumes lock is held.
+        prefix = self.__patternPrefix(pattern)
+        path = [self.__patternTrie]
+        for char in prefix:
+            path.append(path[-1][char])
+
+        terminal = path[-1]['']
+        del terminal[pattern]
+        if not terminal:
+            del path[-1]['']
+        for i in range(len(prefix), 0, -1):
+            if path[i]:
+                break
+            del path[i - 1][prefix[i - 1]]
+        self.__patternMatches.clear()
+
+    def __matchPatterns(self, event):
+        """ Returns the patterns the given event name matches.  The trie is
+        walked along the event name, so only patterns whose literal prefix
+        is a prefix of the event are considered at all. """
+        matches = self.__patternMatches.get(event)
+        if matches is not None:
+            return matches
+
+        matches = []
+        if isinstance(event, str):
+            node = self.__patternTrie
+            index = 0
+            while node is not None:
+                terminal = node.get('')
+                if terminal:
+                    for pattern, matcher in terminal.items():
+                        if matcher is None or matcher(event):
+                            matches.append(pattern)
+                if index == len(event):
+                    break
+                node = node.get(event[index])
+                index += 1
+
+        matches = tuple(matches)
+        if len(self.__patternMatches) >= self._MaxPatternMatches:
+            # Many distinct event names are being sent; start over rather
+            # than letting the cache grow without bound.
+            self.__patternMatches.clear()
+        self.__patternMatches[event] = matches
+        return matches
+
+    def __indexEvent(self, event):
+        # Adds a newly accepted event to the findAll() index.
+        # assumes lock is held.
+        name = repr(event)
+        for i in range(len(name) - 2):
+            self.__eventIndex.setdefault(name[i:i + 3], set()).add(event)
+
+    def __unindexEvent(self, event):
+        # Removes an event nobody accepts anymore from the findAll() index.
+        # assumes lock is held.
+        name = repr(event)
+        for i in range(len(name) - 2):
+            events = self.__eventIndex.get(name[i:i + 3])
+            if events is not None:
+                events.discard(event)
+                if not events:
+                    del self.__eventIndex[name[i:i + 3]]
+
     def getAllAccepting(self, object):
         """
         Returns the list of all events accepted by the indicated object.
@@ -254,6 +458,21 @@ class Messenger:
         finally:
             self.lock.release()
 
+    def getAllAcceptingPatterns(self, object):
+        """
+        Returns the list of all patterns accepted by the indicated object.
+        """
+        self.lock.acquire()
+        try:
+            id = self._getMessengerId(object)
+
+            patternDict = self.__objectPatterns.get(id)
+            if patternDict:
+                return list(patternDict.keys())
+            return []
+        finally:
+            self.lock.release()
+
     def isAccepting(self, event, object):
         """ isAccepting(self, string, DirectOject)
         Is this object accepting this event?
@@ -273,9 +492,29 @@ class Messenger:
 
     def whoAccepts(self, event):
         """
-        Return objects accepting the given event
+        Return objects accepting the given event, as a dictionary of
+        messenger id to [method, extraArgs, persistent], or None if there
+        are none.  Objects accepting the event through a pattern are
+        included, but an object accepting it by name takes precedence.
         """
-        return self.__callbacks.get(event)
+        acceptorDict = self.__callbacks.get(event)
+        if not self.__patternCallbacks:
+            return acceptorDict
+
+        self.lock.acquire()
+        try:
+            patterns = self.__matchPatterns(event)
+            if not patterns:
+                return acceptorDict
+
+            acceptors = {}
+            for pattern in reversed(patterns):
+                acceptors.update(self.__patternCallbacks[pattern])
+            if acceptorDict:
+                acceptors.update(acceptorDict)
+            return acceptors
+        finally:
+            self.lock.release()
 
     def isIgnoring(self, event, object):
         """ isIgnorning(self, string, DirectObject)
@@ -297,42 +536,123 @@ class Messenger:
                 the event (possibly till next frame or even later) and create a
                 new, temporary task within the named taskChain, but this is the
                 only way to send an event across threads.
+
+        Sending does not take the lock unless the event is being queued
+        onto a task chain or a handler was accepting it only once.
+        Handlers are called with the lock released.
         """
         if Messenger.notify.getDebug() and not self.quieting.get(event):
             assert Messenger.notify.debug(
                 'sent event: %s sentArgs = %s, taskChain = %s' % (
                 event, sentArgs, taskChain))
 
-        self.lock.acquire()
-        try:
-            foundWatch = 0
-            if __debug__:
-                if self.__isWatching:
-                    for i in self.__watching:
-                        if str(event).find(i) >= 0:
-                            foundWatch = 1
-                            break
-            acceptorDict = self.__callbacks.get(event)
-            if not acceptorDict:
+        foundWatch = 0
+        if __debug__:
+            if self.__isWatching:
+                for i in self.__watching:
+                    if str(event).find(i) >= 0:
+                        foundWatch = 1
+                        break
+
+        # Reading the snapshot needs no lock: it is an immutable tuple, and
+        # it is replaced rather than modified when the acceptors change.
+        snapshot = self.__snapshots.get(event)
+        if snapshot is None:
+            snapshot = self.__patternSnapshots.get(event)
+            if snapshot is None and (self.__callbacks.get(event) or self.__patternCallbacks):
+                snapshot = self.__compileSnapshot(event)
+            if not snapshot:
                 if __debug__:
                     if foundWatch:
                         print("Messenger: \"%s\" was sent, but no function in Python listened."%(event,))
                 return
 
-            if taskChain:
-                # Queue the event onto the indicated task chain.
-                from direct.task.TaskManagerGlobal import taskMgr
+        if taskChain:
+            # Queue the event onto the indicated task chain.
+            from direct.task.TaskManagerGlobal import taskMgr
+            self.lock.acquire()
+            try:
                 queue = self._eventQueuesByTaskChain.setdefault(taskChain, [])
-                queue.append((acceptorDict, event, sentArgs, foundWatch))
+                queue.append((event, sentArgs, foundWatch))
                 if len(queue) == 1:
                     # If this is the first (only) item on the queue,
                     # spawn the task to empty it.
                     taskMgr.add(self.__taskChainDispatch, name = 'Messenger-%s' % (taskChain),
                                 extraArgs = [taskChain], taskChain = taskChain,
                                 appendTask = True)
+            finally:
+                self.lock.release()
+        else:
+            # Handle the event immediately.
+            self.__dispatch(snapshot, event, sentArgs, foundWatch)
+
+    def sendBatch(self, events, getArgs=None, afterEach=None):
+        """
+        Send a number of events in order, as if send() were called for
+        each of them in turn, but with less overhead per event.
+
+        Args:
+            events (list): A sequence of (event, data) pairs.  The data
+                is the list of arguments to pass to the handlers, unless
+                getArgs is given.
+            getArgs (callable, optional): If given, it is called with the
+                data of an event to obtain its arguments.  It is only called
+                for events that something is accepting, so this can be used
+                to avoid decoding the arguments of events nobody hears.
+            afterEach (callable, optional): If given, it is called with the
+                data of every event, after the handlers of that event have
+                run and before the next event is sent.
+        """
+        if Messenger.notify.getDebug() or (__debug__ and self.__isWatching):
+            # Let send() take care of the debug output.
+            for event, data in events:
+                self.send(event, data if getArgs is None else getArgs(data))
+                if afterEach is not None:
+                    afterEach(data)
+            return
+
+        snapshots = self.__snapshots
+        patternSnapshots = self.__patternSnapshots
+        callbacks = self.__callbacks
+        dispatch = self.__dispatch
+        for event, data in events:
+            snapshot = snapshots.get(event)
+            if snapshot is None:
+                snapshot = patternSnapshots.get(event)
+                if snapshot is None and (callbacks.get(event) or self.__patternCallbacks):
+                    snapshot = self.__compileSnapshot(event)
+            if snapshot:
+                dispatch(snapshot, event, data if getArgs is None else getArgs(data), 0)
+            if afterEach is not None:
+                afterEach(data)
+
+    def __compileSnapshot(self, event):
+        """ Builds and caches the snapshot of the acceptors of the given
+        event, which is empty if nothing is accepting it.  A snapshot is a
+        tuple of (acceptorDict, pattern, id) entries, with a pattern of
+        None for objects accepting the event by name. """
+        self.lock.acquire()
+        try:
+            acceptorDict = self.__callbacks.get(event)
+            snapshot = []
+            if acceptorDict:
+                snapshot.extend([(acceptorDict, None, id) for id in acceptorDict])
+            if self.__patternCallbacks:
+                for pattern in self.__matchPatterns(event):
+                    patternDict = self.__patternCallbacks[pattern]
+                    snapshot.extend([(patternDict, pattern, id) for id in patternDict])
+
+            snapshot = tuple(snapshot)
+            if acceptorDict:
+                self.__snapshots[event] = snapshot
             else:
-                # Handle the event immediately.
-                self.__dispatch(acceptorDict, event, sentArgs, foundWatch)
+                patternSnapshots = self.__patternSnapshots
+                if len(patternSnapshots) >= self._MaxPatternMatches:
+                    # Many distinct event names are being sent; start over
+                    # rather than letting the cache grow without bound.
+                    patternSnapshots.clear()
+                patternSnapshots[event] = snapshot
+            return snapshot
         finally:
             self.lock.release()
 
@@ -358,55 +678,49 @@ class Messenger:
                 if not eventTuple:
                     # No event; we're done.
                     return task.done
-
-                self.__dispatch(*eventTuple)
             finally:
                 self.lock.release()
 
+            # Deliver to whoever is accepting the event now, not when
+            # it was queued.
+            event, sentArgs, foundWatch = eventTuple
+            snapshot = self.__snapshots.get(event)
+            if snapshot is None:
+                snapshot = self.__patternSnapshots.get(event)
+                if snapshot is None:
+                    snapshot = self.__compileSnapshot(event)
+            if snapshot:
+                self.__dispatch(snapshot, event, sentArgs, foundWatch)
+
         return task.done
 
-    def __dispatch(self, acceptorDict, event, sentArgs, foundWatch):
-        for id in list(acceptorDict.keys()):
+    def __dispatch(self, snapshot, event, sentArgs, foundWatch):
+        """ Calls the acceptors of an event.  Must be called without the
+        lock held; it is only taken to remove acceptors that were
+        accepting the event once.
+        Duplicate any changes in __timedDispatch """
+        for acceptorDict, pattern, id in snapshot:
             # We have to make this apparently redundant check, because
             # it is possible that one object removes its own hooks
             # in response to a handler called by a previous object.
             #
             # NOTE: there is no danger of skipping over objects due to
-            # modifications to acceptorDict, since the for..in above
-            # iterates over a list of objects that is created once at
-            # the start
+            # modifications to acceptorDict, since the snapshot never
+            # changes.
             callInfo = acceptorDict.get(id)
             if callInfo:
                 method, extraArgs, persistent = callInfo
                 # If this object was only accepting this event once,
                 # remove it from the dictionary
-                if not persistent:
-                    # This object is no longer listening for this event
-                    eventDict = self.__objectEvents.get(id)
-                    if eventDict and event in eventDict:
-                        del eventDict[event]
-                        if len(eventDict) == 0:
-                            del self.__objectEvents[id]
-                        self._releaseObject(self._getObject(id))
-
-                    del acceptorDict[id]
-                    # If the dictionary at this event is now empty, remove
-                    # the event entry from the Messenger altogether
-                    if event in self.__callbacks \
-                            and (len(self.__callbacks[event]) == 0):
-                        del self.__callbacks[event]
+                if not persistent and not self.__removeOnce(acceptorDict, pattern, id, callInfo, event):
+                    continue
 
                 if __debug__:
                     if foundWatch:
                         print("Messenger: \"%s\" --> %s%s"%(
                             event,
                             self.__methodRepr(method),
-                            tuple(extraArgs + sentArgs)))
-
-                #print "Messenger: \"%s\" --> %s%s"%(
-                #            event,
-                #            self.__methodRepr(method),
-                #            tuple(extraArgs + sentArgs))
+                            (*extraArgs, *sentArgs)))
 
                 # It is important to make the actual call here, after
                 # we have cleaned up the accept hook, because the
@@ -414,18 +728,152 @@ class Messenger:
                 # again.
                 assert hasattr(method, '__call__')
 
-                # Release the lock temporarily while we call the method.
-                self.lock.release()
-                try:
-                    result = method(*(extraArgs + sentArgs))
-                finally:
-                    self.lock.acquire()
+                # Most events carry either extraArgs or sentArgs, not
+                # both; avoid building a new argument list in that case.
+                if not sentArgs:
+                    result = method(*extraArgs)
+                elif not extraArgs:
+                    result = method(*sentArgs)
+                else:
+                    result = method(*extraArgs, *sentArgs)
 
-                if hasattr(result, 'cr_await'):
+                if result is not None and hasattr(result, 'cr_await'):
                     # It's a coroutine, so schedule it with the task manager.
                     from direct.task.TaskManagerGlobal import taskMgr
                     taskMgr.add(result)
 
+    def __timedDispatch(self, snapshot, event, sentArgs, foundWatch):
+        """ Replaces __dispatch while statistics are being collected, see
+        startStats().  Keeping it separate means that __dispatch does not
+        pay for the instrumentation when it is off.
+        Duplicate any changes in __dispatch """
+        stats = self._stats
+        clock = time.perf_counter
+        eventSlot = stats.getEventSlot(event)
+        sendStart = clock()
+        for acceptorDict, pattern, id in snapshot:
+            callInfo = acceptorDict.get(id)
+            if callInfo:
+                method, extraArgs, persistent = callInfo
+                if not persistent and not self.__removeOnce(acceptorDict, pattern, id, callInfo, event):
+                    continue
+
+                if __debug__:
+                    if foundWatch:
+                        print("Messenger: \"%s\" --> %s%s"%(
+                            event,
+                            self.__methodRepr(method),
+                            (*extraArgs, *sentArgs)))
+
+                assert hasattr(method, '__call__')
+
+                start = clock()
+                if not sentArgs:
+                    result = method(*extraArgs)
+                elif not extraArgs:
+                    result = method(*sentArgs)
+                else:
+                    result = method(*extraArgs, *sentArgs)
+                stats.recordCall(eventSlot, id, clock() - start)
+
+                if result is not None and hasattr(result, 'cr_await'):
+                    # It's a coroutine, so schedule it with the task manager.
+                    from direct.task.TaskManagerGlobal import taskMgr
+                    taskMgr.add(result)
+
+        stats.recordSend(eventSlot, clock() - sendStart)
+
+    def __removeOnce(self, acceptorDict, pattern, id, callInfo, event):
+        """ Removes an acceptor that was accepting an event only once,
+        just before it is called.  Returns False if it should not be
+        called after all. """
+        self.lock.acquire()
+        try:
+            # Another thread may have sent the same event at
+            # the same time; only one of them gets to call it.
+            if acceptorDict.get(id) is not callInfo:
+                return False
+
+            if pattern is None:
+                self.__removeAcceptor(event, False, id)
+            else:
+                self.__removeAcceptor(pattern, True, id)
+            return True
+        finally:
+            self.lock.release()
+
+    def startStats(self, maxEvents=1024, maxObjects=1024):
+        """
+        Starts counting, per event and per accepting object, how often
+        handlers are called and how long they take.  Statistics are kept
+        for up to maxEvents event names and maxObjects acceptors; anything
+        beyond that is lumped together.  When statistics are not being
+        collected, dispatching events costs nothing extra.
+
+        See getStats(), dumpStats() and startStatsDump().
+        """
+        from .MessengerStats import MessengerStats
+        self._stats = MessengerStats(maxEvents, maxObjects)
+        # An instance attribute takes precedence over the method, which
+        # swaps the instrumented dispatch in for send() and sendBatch().
+        self.__dispatch = self.__timedDispatch
+
+    def stopStats(self):
+        """
+        Stops collecting statistics, and returns the MessengerStats object
+        holding what has been collected, or None if statistics were not
+        being collected.
+        """
+        stats = self._stats
+        if stats is not None:
+            del self.__dispatch
+            self._stats = None
+        self.stopStatsDump()
+        return stats
+
+    def getStats(self):
+        """
+        Returns a snapshot of the statistics collected since startStats()
+        was called, as returned by MessengerStats.getSnapshot(), or None if
+        statistics are not being collected.
+        """
+        if self._stats is None:
+            return None
+        return self._stats.getSnapshot()
+
+    def dumpStats(self, limit=20):
+        """
+        Writes the limit most expensive events and acceptors to the log.
+        """
+        if self._stats is not None:
+            Messenger.notify.info('event statistics:\n' + self._stats.format(limit))
+
+    def startStatsDump(self, interval=10.0, limit=20, reset=False):
+        """
+        Calls dumpStats() every interval seconds, starting statistics
+        collection first if needed.  If reset is set, the statistics are
+        cleared after each dump, so that every dump covers one interval.
+        """
+        from direct.task.TaskManagerGlobal import taskMgr
+        if self._stats is None:
+            self.startStats()
+
+        def dumpTask(task):
+            self.dumpStats(limit)
+            if reset and self._stats is not None:
+                self._stats.reset()
+            return task.again
+
+        self.stopStatsDump()
+        taskMgr.doMethodLater(interval, dumpTask, 'Messenger-statsDump')
+
+    def stopStatsDump(self):
+        """
+        Stops dumping statistics started with startStatsDump().
+        """
+        from direct.task.TaskManagerGlobal import taskMgr
+        taskMgr.remove('Messenger-statsDump')
+
     def clear(self):
         """
         Start fresh with a clear dict
@@ -433,13 +881,20 @@ class Messenger:
         self.lock.acquire()
         try:
             self.__callbacks.clear()
+            self.__snapshots.clear()
+            self.__patternSnapshots.clear()
             self.__objectEvents.clear()
+            self.__patternCallbacks.clear()
+            self.__objectPatterns.clear()
+            self.__patternTrie.clear()
+            self.__patternMatches.clear()
+            self.__eventIndex.clear()
             self._id2object.clear()
         finally:
             self.lock.release()
 
     def isEmpty(self):
-        return len(self.__callbacks) == 0
+        return len(self.__callbacks) == 0 and len(self.__patternCallbacks) == 0
 
     def getEvents(self):
         return list(self.__callbacks.keys())
@@ -540,9 +995,9 @@ class Messenger:
         return a matching event (needle) if found (in haystack).
         This is primarily a debugging tool.
         """
-        for event in sorted(self.__callbacks):
-            if repr(event).find(needle) >= 0:
-                return {event: self.__callbacks[event]}
+        matches = self.findAll(needle, 1)
+        if matches:
+            return matches
 
     def findAll(self, needle, limit=None):
         """
@@ -550,17 +1005,33 @@ class Messenger:
         limit may be None or an integer (e.g. 1).
         This is primarily a debugging tool.
         """
-        matches = {}
-        for event in sorted(self.__callbacks):
-            if repr(event).find(needle) >= 0:
-                matches[event] = self.__callbacks[event]
-                # if the limit is not None, decrement and
-                # check for break:
-                if limit > 0:
-                    limit -= 1
-                    if limit == 0:
-                        break
-        return matches
+        self.lock.acquire()
+        try:
+            if len(needle) < 3:
+                candidates = self.__callbacks
+            else:
+                # Only events containing every three-character piece of
+                # the needle can contain the needle.
+                candidates = None
+                for i in range(len(needle) - 2):
+                    events = self.__eventIndex.get(needle[i:i + 3])
+                    if not events:
+                        return {}
+                    candidates = events if candidates is None else candidates & events
+
+            matches = {}
+            for event in sorted(candidates):
+                if repr(event).find(needle) >= 0:
+                    matches[event] = self.__callbacks[event]
+                    # if the limit is not None, decrement and
+                    # check for break:
+                    if limit:
+                        limit -= 1
+                        if limit == 0:
+                            break
+            return matches
+        finally:
+            self.lock.release()
 
     def __methodRepr(self, method):
         """
@@ -641,12 +1112,22 @@ class Messenger:
 
     #snake_case alias:
     get_events = getEvents
+    send_batch = sendBatch
+    start_stats = startStats
+    stop_stats = stopStats
+    get_stats = getStats
+    dump_stats = dumpStats
+    start_stats_dump = startStatsDump
+    stop_stats_dump = stopStatsDump
     is_ignoring = isIgnoring
     who_accepts = whoAccepts
     find_all = findAll
     replace_method = replaceMethod
     ignore_all = ignoreAll
     is_accepting = isAccepting
+    accept_pattern = acceptPattern
+    ignore_pattern = ignorePattern
+    get_all_accepting_patterns = getAllAcceptingPatterns
     is_empty = isEmpty
     detailed_repr = detailedRepr
     get_all_accepting = getAllAccepting
@@ -0,0 +1,137 @@
+"""Micro-benchmark for :meth:`.Messenger.send`.
+
+Run it with ``python -m direct.showbase.MessengerBenchmark``.  Every case
+is timed both through the Messenger and through a copy of send() and
+__dispatch() as they were before acceptor snapshots were added, which
+locked on every send, copied the acceptor keys and concatenated the
+argument lists for every listener.
+"""
+
+__all__ = ['runBenchmark']
+
+import time
+
+from .Messenger import Messenger
+
+
+class _Listener:
+    def __init__(self):
+        self.calls = 0
+
+    def handle(self, *args):
+        self.calls += 1
+
+
+def _referenceSend(messenger, event, sentArgs=[]):
+    # Messenger.send() as it was before snapshots, without the taskChain
+    # case, for comparison.
+    if Messenger.notify.getDebug() and not messenger.quieting.get(event):
+        assert Messenger.notify.debug(
+            'sent event: %s sentArgs = %s, taskChain = %s' % (
+            event, sentArgs, None))
+
+    messenger.lock.acquire()
+    try:
+        foundWatch = 0
+        if __debug__:
+            if messenger._Messenger__isWatching:
+                for i in messenger._Messenger__watching:
+                    if str(event).find(i) >= 0:
+                        foundWatch = 1
+                        break
+        acceptorDict = messenger._Messenger__callbacks.get(event)
+        if not acceptorDict:
+            if __debug__:
+                if foundWatch:
+                    print("Messenger: \"%s\" was sent, but no function in Python listened."%(event,))
+            return
+
+        _referenceDispatch(messenger, acceptorDict, event, sentArgs, foundWatch)
+    finally:
+        messenger.lock.release()
+
+
+def _referenceDispatch(messenger, acceptorDict, event, sentArgs, foundWatch):
+    # Messenger.__dispatch() as it was before snapshots.
+    for id in list(acceptorDict.keys()):
+        callInfo = acceptorDict.get(id)
+        if callInfo:
+            method, extraArgs, persistent = callInfo
+            if not persistent:
+                objectEvents = messenger._Messenger__objectEvents
+                eventDict = objectEvents.get(id)
+                if eventDict and event in eventDict:
+                    del eventDict[event]
+                    if len(eventDict) == 0:
+                        del objectEvents[id]
+                    messenger._releaseObject(messenger._getObject(id))
+
+                del acceptorDict[id]
+                callbacks = messenger._Messenger__callbacks
+                if event in callbacks \
+                        and (len(callbacks[event]) == 0):
+                    del callbacks[event]
+
+            if __debug__:
+                if foundWatch:
+                    print("Messenger: \"%s\" --> %s%s"%(
+                        event,
+                        messenger._Messenger__methodRepr(method),
+                        tuple(extraArgs + sentArgs)))
+
+            assert hasattr(method, '__call__')
+
+            messenger.lock.release()
+            try:
+                result = method(*(extraArgs + sentArgs))
+            finally:
+                messenger.lock.acquire()
+
+            if hasattr(result, 'cr_await'):
+                from direct.task.TaskManagerGlobal import taskMgr
+                taskMgr.add(result)
+
+
+def _time(func, count):
+    start = time.perf_counter()
+    for i in range(count):
+        func()
+    return time.perf_counter() - start
+
+
+def runBenchmark(count=200000, listeners=(0, 1, 4, 16)):
+    """Times sending one event count times for each number of listeners,
+    with and without arguments.  Returns a list of (name, seconds,
+    reference seconds) tuples."""
+    results = []
+    for numListeners in listeners:
+        messenger = Messenger()
+        objects = [_Listener() for i in range(numListeners)]
+        for object in objects:
+            messenger.accept('bench', object, object.handle, [1])
+            messenger.accept('benchNoArgs', object, object.handle)
+
+        for event, sentArgs in (('benchNoArgs', []), ('bench', [2, 3])):
+            name = '%s, %d listeners' % (event, numListeners)
+            send = lambda: messenger.send(event, sentArgs)
+            reference = lambda: _referenceSend(messenger, event, sentArgs)
+            # Warm up, which also compiles the snapshot.
+            _time(send, 1000)
+            _time(reference, 1000)
+            results.append((name, _time(send, count), _time(reference, count)))
+
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--count', type=int, default=200000,
+                        help='Number of sends to time per case')
+    args = parser.parse_args()
+
+    print('%-28s %12s %12s %8s' % ('case', 'ns/send', 'before', 'speedup'))
+    for name, seconds, reference in runBenchmark(args.count):
+        print('%-28s %12.0f %12.0f %7.2fx' % (
+            name, seconds * 1e9 / args.count, reference * 1e9 / args.count,
+            reference / seconds))
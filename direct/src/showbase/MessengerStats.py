@@ -0,0 +1,137 @@
+"""Contains the MessengerStats class, which collects per-event and
+per-acceptor timing statistics for the :class:`~.Messenger.Messenger`.
+Enable it with :meth:`.Messenger.startStats`."""
+
+__all__ = ['MessengerStats']
+
+from array import array
+
+
+class MessengerStats:
+    """
+    Counters for the events dispatched by a Messenger and the objects
+    accepting them.  The counters are kept in preallocated arrays, one
+    slot per event name and one per acceptor, so recording a call never
+    allocates.  Slot 0 of each table collects everything that did not
+    fit once the table is full.
+
+    Events that nothing is accepting are never dispatched, so they are
+    not counted.
+    """
+
+    OtherName = '(other)'
+
+    def __init__(self, maxEvents=1024, maxObjects=1024):
+        self.maxEvents = maxEvents
+        self.maxObjects = maxObjects
+        self.reset()
+
+    def reset(self):
+        """ Forgets all statistics collected so far. """
+        # eventName->slot, objMsgrId->slot
+        self._eventSlots = {}
+        self._objectSlots = {}
+        self._eventNames = [self.OtherName]
+        self._objectIds = [self.OtherName]
+
+        self._eventSends = array('q', bytes(8 * self.maxEvents))
+        self._eventCalls = array('q', bytes(8 * self.maxEvents))
+        self._eventTime = array('d', bytes(8 * self.maxEvents))
+        self._eventMaxTime = array('d', bytes(8 * self.maxEvents))
+
+        self._objectCalls = array('q', bytes(8 * self.maxObjects))
+        self._objectTime = array('d', bytes(8 * self.maxObjects))
+        self._objectMaxTime = array('d', bytes(8 * self.maxObjects))
+
+    def getEventSlot(self, event):
+        """ Returns the slot the counters of the given event are kept in. """
+        slot = self._eventSlots.get(event)
+        if slot is None:
+            if len(self._eventNames) >= self.maxEvents:
+                return 0
+            slot = len(self._eventNames)
+            self._eventNames.append(event)
+            self._eventSlots[event] = slot
+        return slot
+
+    def recordCall(self, eventSlot, id, elapsed):
+        """ Records that the acceptor with the given messenger id handled
+        an event, taking the given number of seconds. """
+        self._eventCalls[eventSlot] += 1
+
+        slot = self._objectSlots.get(id)
+        if slot is None:
+            if len(self._objectIds) >= self.maxObjects:
+                slot = 0
+            else:
+                slot = len(self._objectIds)
+                self._objectIds.append(id)
+                self._objectSlots[id] = slot
+        self._objectCalls[slot] += 1
+        self._objectTime[slot] += elapsed
+        if elapsed > self._objectMaxTime[slot]:
+            self._objectMaxTime[slot] = elapsed
+
+    def recordSend(self, eventSlot, elapsed):
+        """ Records that an event was dispatched, with all of its handlers
+        taking the given number of seconds together. """
+        self._eventSends[eventSlot] += 1
+        self._eventTime[eventSlot] += elapsed
+        if elapsed > self._eventMaxTime[eventSlot]:
+            self._eventMaxTime[eventSlot] = elapsed
+
+    def getSnapshot(self):
+        """
+        Returns a copy of the statistics as a dictionary with an 'events'
+        and an 'objects' list, each sorted by total handler time, most
+        expensive first.  Every event is a dictionary with the keys
+        'event', 'sends', 'calls', 'time' and 'maxTime'; every object one
+        with 'object', 'calls', 'time' and 'maxTime'.  Times are in
+        seconds.
+        """
+        events = []
+        for slot, event in enumerate(self._eventNames):
+            if self._eventSends[slot] or self._eventCalls[slot]:
+                events.append({
+                    'event': event,
+                    'sends': self._eventSends[slot],
+                    'calls': self._eventCalls[slot],
+                    'time': self._eventTime[slot],
+                    'maxTime': self._eventMaxTime[slot],
+                    })
+
+        objects = []
+        for slot, id in enumerate(self._objectIds):
+            if self._objectCalls[slot]:
+                objects.append({
+                    'object': id,
+                    'calls': self._objectCalls[slot],
+                    'time': self._objectTime[slot],
+                    'maxTime': self._objectMaxTime[slot],
+                    })
+
+        events.sort(key=lambda entry: entry['time'], reverse=True)
+        objects.sort(key=lambda entry: entry['time'], reverse=True)
+        return {'events': events, 'objects': objects}
+
+    def format(self, limit=20):
+        """ Returns the most expensive events and acceptors as a table. """
+        snapshot = self.getSnapshot()
+        lines = ['%-40s %10s %10s %12s %12s' % (
+            'event', 'sends', 'calls', 'total ms', 'max ms')]
+        for entry in snapshot['events'][:limit]:
+            lines.append('%-40s %10d %10d %12.3f %12.3f' % (
+                str(entry['event'])[:40], entry['sends'], entry['calls'],
+                entry['time'] * 1000.0, entry['maxTime'] * 1000.0))
+
+        lines.append('')
+        lines.append('%-40s %10s %10s %12s %12s' % (
+            'acceptor', '', 'calls', 'total ms', 'max ms'))
+        for entry in snapshot['objects'][:limit]:
+            id = entry['object']
+            if isinstance(id, tuple):
+                id = '%s-%s' % id
+            lines.append('%-40s %10s %10d %12.3f %12.3f' % (
+                id[:40], '', entry['calls'],
+                entry['time'] * 1000.0, entry['maxTime'] * 1000.0))
+        return '\n'.join(lines)
@@ -0,0 +1,222 @@
+"""Contains the DeadlineScheduler class, which runs deferrable work within a
+per-frame time budget.  Set it up with :meth:`.TaskManager.setupDeadlineScheduler`.
+"""
+
+__all__ = ['DeadlineScheduler', 'DeadlineTask']
+
+from direct.directnotify.DirectNotifyGlobal import directNotify
+from direct.task import Task
+import heapq
+import itertools
+
+
+class DeadlineTask:
+    """
+    A unit of work run by the DeadlineScheduler.  It is called like a task
+    function; returning Task.done removes it, anything else keeps it
+    scheduled.  It must run at least once every maxStaleness frames.
+    """
+
+    # So that a function given the DeadlineTask can return task.done, as
+    # it would for a regular task.
+    done = Task.done
+    cont = Task.cont
+    again = Task.again
+
+    def __init__(self, name, function, extraArgs, maxStaleness, estimate, priority):
+        self.name = name
+        self.function = function
+        self.extraArgs = extraArgs
+        self.maxStaleness = maxStaleness
+        self.priority = priority
+        # Expected run time in seconds, refined every time it runs
+        self.estimate = estimate
+        self.lastFrame = None
+        self.deadline = None
+        self.removed = False
+
+        self.runs = 0
+        self.deferrals = 0
+        self.missedDeadlines = 0
+
+    def __repr__(self):
+        return 'DeadlineTask(%s, maxStaleness=%s, estimate=%.6f)' % (
+            self.name, self.maxStaleness, self.estimate)
+
+
+class DeadlineScheduler:
+    """
+    Runs DeadlineTasks from a single task on the main task chain, earliest
+    deadline first, until the frame's budget is used up.  Work that does not
+    fit is deferred to a later frame, as long as its deadline allows.
+
+    frameBudget is the most time, in seconds, the scheduler itself may take
+    in one frame.  If frameTarget is given, the scheduler also never runs
+    past that many seconds from the start of the frame, so that when the
+    rest of the frame was slow, less deferrable work is done.  A task whose
+    deadline has come is run even if it does not fit in the budget, unless
+    the frame is already over its target and the task has a priority of 0
+    or less; then it is deferred and counted as a missed deadline.
+    """
+
+    notify = directNotify.newCategory("DeadlineScheduler")
+
+    # Initial run time estimates, in seconds, of the cost classes.
+    CostClasses = {
+        'tiny': 0.0001,
+        'small': 0.0005,
+        'medium': 0.002,
+        'large': 0.008,
+    }
+
+    # Weight of the latest run time in a task's running estimate.
+    EstimateWeight = 0.2
+
+    def __init__(self, taskMgr, frameBudget=0.004, frameTarget=None, sort=45,
+                 taskChain=None):
+        self.taskMgr = taskMgr
+        self.frameBudget = frameBudget
+        self.frameTarget = frameTarget
+        self._tasks = {}
+        # (deadline, -priority, serial, DeadlineTask)
+        self._heap = []
+        self._serial = itertools.count()
+
+        self.lastFrameTime = 0.0
+        self.lastFrameRuns = 0
+        self.lastFrameDeferrals = 0
+
+        self._task = taskMgr.add(self.__runTask, 'deadlineScheduler',
+                                 sort=sort, taskChain=taskChain)
+
+    def destroy(self):
+        self._task.remove()
+        self._tasks.clear()
+        del self._heap[:]
+
+    def add(self, function, name, maxStaleness=1, costClass='medium',
+            priority=0, extraArgs=None, appendTask=False):
+        """
+        Schedules a function to be run at least once every maxStaleness
+        frames.  costClass is one of CostClasses, or an estimated run time
+        in seconds, and gives the initial guess of how long it takes.
+        Tasks with a higher priority go first among those with the same
+        deadline, and are still run when their deadline comes in a frame
+        that is over its target.  Returns the DeadlineTask.
+        """
+        if isinstance(costClass, str):
+            estimate = self.CostClasses[costClass]
+        else:
+            estimate = float(costClass)
+        if extraArgs is None:
+            extraArgs = []
+            appendTask = True
+
+        task = DeadlineTask(name, function, list(extraArgs), maxStaleness,
+                            estimate, priority)
+        if appendTask:
+            task.extraArgs.append(task)
+
+        self.remove(name)
+        self._tasks[name] = task
+        # A new task is due right away.
+        task.deadline = self.__getFrame()
+        self.__push(task)
+        return task
+
+    def remove(self, taskOrName):
+        """ Removes a DeadlineTask, given the task or its name.  Returns
+        true if it was scheduled. """
+        if isinstance(taskOrName, DeadlineTask):
+            taskOrName = taskOrName.name
+        task = self._tasks.pop(taskOrName, None)
+        if task is None:
+            return False
+        # It is dropped from the heap when it comes up.
+        task.removed = True
+        return True
+
+    def getTasks(self):
+        return list(self._tasks.values())
+
+    def __getFrame(self):
+        return self.taskMgr.globalClock.getFrameCount()
+
+    def __push(self, task):
+        heapq.heappush(self._heap, (task.deadline, -task.priority, next(self._serial), task))
+
+    def __runTask(self, task):
+        clock = self.taskMgr.globalClock
+        frame = clock.getFrameCount()
+        start = clock.getRealTime()
+
+        endTime = start + self.frameBudget
+        if self.frameTarget is not None:
+            targetTime = clock.getFrameTime() + self.frameTarget
+            if targetTime < endTime:
+                endTime = targetTime
+
+        heap = self._heap
+        ran = []
+        deferred = []
+        # The entry being run, so that it is not lost if it raises.
+        current = None
+        now = start
+        try:
+            while heap:
+                deadline, negPriority, serial, entry = heap[0]
+                if entry.removed:
+                    heapq.heappop(heap)
+                    continue
+
+                remaining = endTime - now
+                due = deadline <= frame
+                if not due and remaining <= 0:
+                    # Everything left can wait for a later frame.
+                    break
+
+                heapq.heappop(heap)
+                if entry.estimate > remaining:
+                    overTarget = self.frameTarget is not None and \
+                        now >= clock.getFrameTime() + self.frameTarget
+                    if not due or (overTarget and entry.priority <= 0):
+                        entry.deferrals += 1
+                        if due:
+                            entry.missedDeadlines += 1
+                        deferred.append(entry)
+                        continue
+
+                current = entry
+                result = entry.function(*entry.extraArgs)
+                current = None
+                after = clock.getRealTime()
+                entry.estimate += (after - now - entry.estimate) * self.EstimateWeight
+                entry.runs += 1
+                entry.lastFrame = frame
+                now = after
+
+                if result == Task.done:
+                    entry.removed = True
+                    if self._tasks.get(entry.name) is entry:
+                        del self._tasks[entry.name]
+                elif not entry.removed:
+                    ran.append(entry)
+        finally:
+            # Whatever was taken off the heap goes back on, even if a
+            # function raised; the one that raised is rescheduled as if
+            # it had run.
+            if current is not None and not current.removed:
+                ran.append(current)
+            for entry in ran:
+                entry.deadline = frame + entry.maxStaleness
+                self.__push(entry)
+            for entry in deferred:
+                if entry.deadline <= frame:
+                    # Overdue; it comes first next frame.
+                    entry.deadline = frame + 1
+                self.__push(entry)
+
+        self.lastFrameTime = now - start
+        self.lastFrameRuns = len(ran)
+        self.lastFrameDeferrals = len(deferred)
+        return task.cont
@@ -0,0 +1,263 @@
+"""Contains the SamplingProfiler class, a statistical profiler that is cheap
+enough to leave running.  Start it with
+:meth:`.TaskManager.startSamplingProfiler`, or by setting the
+``sampling-profiler`` config variable."""
+
+__all__ = ['SamplingProfiler']
+
+from panda3d.core import ConfigVariableDouble, ConfigVariableString
+from direct.directnotify.DirectNotifyGlobal import directNotify
+from collections import deque
+import os
+import sys
+import threading
+import time
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stack of the thread that runs the task manager from
+    a background thread, at a fixed interval, and counts how often every
+    stack is seen.  Unlike the cProfile-based TaskProfiler, the profiled
+    code is not slowed down at all; the cost is only that of taking the
+    samples.
+
+    The counts are kept in a ring of windows of a few seconds each, so
+    that getStacks() covers roughly the last window * numWindows seconds.
+    Stacks are tuples of frame labels, outermost first, and can be written
+    out in the collapsed format read by flame graph tools with
+    writeCollapsed().  While an event is being dispatched by the
+    Messenger, a label naming the event is inserted above its handlers.
+
+    If spikeThreshold is given, a frame that takes longer than that many
+    times the average frame time has the samples taken during it written
+    to outputDir.
+
+    This needs a threaded build of Panda3D; with SIMPLE_THREADS the
+    sampling thread cannot run while the task manager is busy.
+    """
+
+    notify = directNotify.newCategory("SamplingProfiler")
+
+    # Frames to see before spikes are looked for.
+    SpikeMinFrames = 30
+
+    # Seconds to wait after writing a spike before writing another.
+    SpikeMinInterval = 5.0
+
+    # Weight of the latest frame in the average frame time.
+    FrameTimeWeight = 0.05
+
+    def __init__(self, taskMgr, interval=None, window=1.0, numWindows=60,
+                 spikeThreshold=None, outputDir=None, maxDepth=64):
+        if interval is None:
+            interval = ConfigVariableDouble('sampling-profiler-interval', 0.005).value
+        if spikeThreshold is None:
+            spikeThreshold = ConfigVariableDouble('sampling-profiler-spike-threshold', 3.0).value
+        if outputDir is None:
+            outputDir = ConfigVariableString('sampling-profiler-output-dir', '').value
+
+        self.taskMgr = taskMgr
+        self.interval = interval
+        self.window = window
+        self.spikeThreshold = spikeThreshold
+        self.outputDir = outputDir
+        self.maxDepth = maxDepth
+
+        # code object->label
+        self._labels = {}
+        self._dispatchCodes = self.__getDispatchCodes()
+
+        # Guards the samples, which the sampling thread adds to while the
+        # main thread swaps out and reads them.
+        self._lock = threading.Lock()
+        self._windows = deque(maxlen=numWindows)
+        self._windowStart = None
+        # stack->count, for the frame in progress; replaced every frame
+        self._frameSamples = {}
+        self.numSamples = 0
+
+        self._avgFrameTime = None
+        self._numFrames = 0
+        self._lastSpikeTime = None
+
+        self._threadId = None
+        self._thread = None
+        self._stopEvent = threading.Event()
+        self._frameTask = None
+
+    def destroy(self):
+        self.stop()
+        self.reset()
+
+    def start(self):
+        """ Starts sampling the stack of the calling thread. """
+        if self._thread is not None:
+            return
+
+        self._threadId = threading.get_ident()
+        self._stopEvent.clear()
+        self._thread = threading.Thread(target=self.__sampleLoop,
+                                        name='SamplingProfiler', daemon=True)
+        self._thread.start()
+        self._frameTask = self.taskMgr.add(self.__frameTask, 'samplingProfiler-frame',
+                                           sort=1 << 30)
+
+    def stop(self):
+        """ Stops sampling.  The samples taken so far are kept. """
+        if self._thread is None:
+            return
+
+        self._stopEvent.set()
+        self._thread.join()
+        self._thread = None
+        self._frameTask.remove()
+        self._frameTask = None
+
+    def isRunning(self):
+        return self._thread is not None
+
+    def reset(self):
+        """ Forgets all samples taken so far. """
+        with self._lock:
+            self._windows.clear()
+            self._windowStart = None
+            self._frameSamples = {}
+            self.numSamples = 0
+
+    def getStacks(self):
+        """
+        Returns a dictionary of the number of times every stack was seen in
+        the rolling window of samples.  Every stack is a tuple of frame
+        labels, outermost first.
+        """
+        with self._lock:
+            windows = [dict(window) for window in self._windows]
+
+        stacks = {}
+        for window in windows:
+            for stack, count in window.items():
+                stacks[stack] = stacks.get(stack, 0) + count
+        return stacks
+
+    def getCollapsed(self, stacks=None):
+        """ Returns the stacks, all of the rolling window by default, as a
+        list of lines in the collapsed stack format. """
+        if stacks is None:
+            stacks = self.getStacks()
+        return ['%s %d' % (';'.join(stack), count)
+                for stack, count in sorted(stacks.items())]
+
+    def writeCollapsed(self, filename=None, stacks=None):
+        """
+        Writes the stacks, all of the rolling window by default, to a file
+        in the collapsed stack format, one stack per line followed by its
+        count, which flamegraph.pl, speedscope and similar tools read.
+        Returns the name of the file written.
+        """
+        if filename is None:
+            filename = 'profile-%s.collapsed' % (time.strftime('%Y%m%d-%H%M%S'))
+            if self.outputDir:
+                filename = os.path.join(self.outputDir, filename)
+
+        with open(filename, 'w') as file:
+            for line in self.getCollapsed(stacks):
+                file.write(line + '\n')
+        return filename
+
+    def __getDispatchCodes(self):
+        # The code objects of the Messenger's dispatch methods, whose frames
+        # are followed by a label with the event being dispatched.
+        from direct.showbase.Messenger import Messenger
+        codes = set()
+        for name in ('_Messenger__dispatch', '_Messenger__timedDispatch'):
+            method = getattr(Messenger, name, None)
+            if method is not None:
+                codes.add(method.__code__)
+        return codes
+
+    def __getLabel(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            name = getattr(code, 'co_qualname', code.co_name)
+            label = '%s@%s:%s' % (name, os.path.basename(code.co_filename),
+                                  code.co_firstlineno)
+            # These separate frames and counts in the collapsed format.
+            label = label.replace(';', ':').replace(' ', '_')
+            self._labels[code] = label
+        return label
+
+    def __sampleLoop(self):
+        wait = self._stopEvent.wait
+        interval = self.interval
+        while not wait(interval):
+            self.__sample()
+
+    def __sample(self):
+        frame = sys._current_frames().get(self._threadId)
+        if frame is None:
+            return
+
+        labels = []
+        dispatchCodes = self._dispatchCodes
+        depth = 0
+        while frame is not None and depth < self.maxDepth:
+            code = frame.f_code
+            if code in dispatchCodes:
+                event = frame.f_locals.get('event')
+                labels.append(('event:%s' % (event,)).replace(';', ':').replace(' ', '_'))
+            labels.append(self.__getLabel(code))
+            frame = frame.f_back
+            depth += 1
+        del frame
+        labels.reverse()
+        stack = tuple(labels)
+
+        now = time.perf_counter()
+        with self._lock:
+            if self._windowStart is None or now - self._windowStart >= self.window:
+                self._windows.append({})
+                self._windowStart = now
+            window = self._windows[-1]
+            window[stack] = window.get(stack, 0) + 1
+
+            frameSamples = self._frameSamples
+            frameSamples[stack] = frameSamples.get(stack, 0) + 1
+            self.numSamples += 1
+
+    def __frameTask(self, task):
+        # Once swapped out, the samples of the frame are no longer added
+        # to, so they can be read without the lock.
+        with self._lock:
+            frameSamples = self._frameSamples
+            self._frameSamples = {}
+
+        dt = self.taskMgr.globalClock.getDt()
+        if self._avgFrameTime is None:
+            self._avgFrameTime = dt
+        else:
+            self._numFrames += 1
+            if (self.spikeThreshold and frameSamples and
+                    self._numFrames > self.SpikeMinFrames and
+                    dt > self._avgFrameTime * self.spikeThreshold):
+                self.__writeSpike(dt, frameSamples)
+            self._avgFrameTime += (dt - self._avgFrameTime) * self.FrameTimeWeight
+        return task.cont
+
+    def __writeSpike(self, dt, frameSamples):
+        now = time.perf_counter()
+        if self._lastSpikeTime is not None and now - self._lastSpikeTime < self.SpikeMinInterval:
+            return
+        self._lastSpikeTime = now
+
+        frameCount = self.taskMgr.globalClock.getFrameCount()
+        filename = 'spike-%s-frame%s.collapsed' % (time.strftime('%Y%m%d-%H%M%S'), frameCount)
+        if self.outputDir:
+            filename = os.path.join(self.outputDir, filename)
+        try:
+            self.writeCollapsed(filename, frameSamples)
+        except OSError as e:
+            self.notify.warning('could not write %s: %s' % (filename, e))
+            return
+        self.notify.info('frame %s took %.1f ms, %.1fx the average; wrote %s' % (
+            frameCount, dt * 1000.0, dt / self._avgFrameTime, filename))
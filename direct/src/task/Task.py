@@ -155,6 +155,13 @@ class TaskManager:
 
         self._frameProfileQueue = []
 
+        # poolName->TaskPool, see setupTaskPool()
+        self._taskPools = {}
+        # see setupDeadlineScheduler()
+        self._deadlineScheduler = None
+        # see startSamplingProfiler()
+        self._samplingProfiler = None
+
         # this will be set when it's safe to import StateVar
         self._profileFrames = None
         self._frameProfiler = None
@@ -174,6 +181,8 @@ class TaskManager:
         self.setProfileTasks(ConfigVariableBool('profile-task-spikes', 0).getValue())
         self._profileFrames = StateVar(False)
         self.setProfileFrames(ConfigVariableBool('profile-frames', 0).getValue())
+        if ConfigVariableBool('sampling-profiler', False):
+            self.startSamplingProfiler()
 
     def destroy(self):
         # This should be safe to call multiple times.
@@ -181,6 +190,15 @@ class TaskManager:
         self.notify.info("TaskManager.destroy()")
         self.destroyed = True
         self._frameProfileQueue.clear()
+        for pool in self._taskPools.values():
+            pool.destroy()
+        self._taskPools.clear()
+        if self._deadlineScheduler is not None:
+            self._deadlineScheduler.destroy()
+            self._deadlineScheduler = None
+        if self._samplingProfiler is not None:
+            self._samplingProfiler.destroy()
+            self._samplingProfiler = None
         self.mgr.cleanup()
 
     def setClock(self, clockObject):
@@ -290,6 +308,101 @@ class TaskManager:
         if timeslicePriority is not None:
             chain.setTimeslicePriority(timeslicePriority)
 
+    def setupTaskPool(self, poolName, numWorkers = None, threadPriority = None,
+                      frameSync = None, stealInterval = 0.01):
+        """Defines a pool of worker threads that tasks can be added to
+        by passing poolName as the taskChain to add() or doMethodLater(),
+        just like a task chain.  Unlike a task chain with several threads,
+        every task in the pool runs on one worker at a time, and the pool
+        moves tasks from busy workers to idle ones, so CPU-heavy background
+        tasks spread over the available cores by themselves.
+
+        numWorkers is the number of worker threads, by default one less
+        than the number of CPU cores.  Each worker is a task chain named
+        poolName-N, configured with threadPriority and frameSync as in
+        setupTaskChain().  stealInterval is how often, in seconds, an idle
+        worker looks for a task to take over.
+
+        Returns the TaskPool, which can be used to pin tasks to a worker
+        and to query how busy the workers are.  Calling this again with
+        the same name returns the existing pool.
+
+        Note that tasks must be added through the task manager to be
+        spread over the pool; setting a task's task chain to poolName
+        directly puts it on an ordinary task chain of that name.
+        """
+        pool = self._taskPools.get(poolName)
+        if pool is None:
+            from .TaskPool import TaskPool
+            pool = TaskPool(self, poolName, numWorkers, threadPriority,
+                            frameSync, stealInterval)
+            self._taskPools[poolName] = pool
+        return pool
+
+    def getTaskPool(self, poolName):
+        """Returns the TaskPool with the indicated name, or None if
+        setupTaskPool() has not been called for it. """
+        return self._taskPools.get(poolName)
+
+    def setupDeadlineScheduler(self, frameBudget = 0.004, frameTarget = None,
+                               sort = 45, taskChain = None):
+        """Sets up the deadline scheduler, which runs work added with
+        addDeadlineTask() from a single task, earliest deadline first,
+        within a time budget per frame.  Work that does not fit in the
+        budget is deferred to later frames, up to its deadline, which
+        keeps the frame time flat when the load spikes.
+
+        frameBudget is the most time in seconds the scheduler may take
+        each frame.  frameTarget, if given, is the intended length of a
+        whole frame in seconds: the scheduler also stops when the frame
+        has taken that long so far, so that a frame that is already slow
+        only runs work that cannot wait.  sort is the sort of the
+        scheduler's task; the default runs it after ordinary tasks but
+        before the frame is rendered.
+
+        Calling this again changes the budget of the existing scheduler.
+        Returns the DeadlineScheduler.
+        """
+        if self._deadlineScheduler is None:
+            from .DeadlineScheduler import DeadlineScheduler
+            self._deadlineScheduler = DeadlineScheduler(
+                self, frameBudget, frameTarget, sort, taskChain)
+        else:
+            self._deadlineScheduler.frameBudget = frameBudget
+            self._deadlineScheduler.frameTarget = frameTarget
+        return self._deadlineScheduler
+
+    def addDeadlineTask(self, func, name, maxStaleness = 1, costClass = 'medium',
+                        priority = 0, extraArgs = None, appendTask = False):
+        """Adds a function to the deadline scheduler, setting it up with
+        default settings if setupDeadlineScheduler() was not called.  The
+        function is called like a task function, at least once every
+        maxStaleness frames, and possibly less often than every frame if
+        maxStaleness is more than 1 and the frame is busy.  It is removed
+        when it returns task.done.
+
+        costClass is one of 'tiny', 'small', 'medium' or 'large', or an
+        estimated run time in seconds; it is only the starting point for
+        the scheduler's own measurements.  Among tasks with the same
+        deadline, those with a higher priority run first, and only tasks
+        with a priority above 0 are still run when their deadline falls
+        in a frame that is already over its frameTarget.
+
+        Returns the DeadlineTask.  If extraArgs is omitted, the function
+        gets the DeadlineTask as its only argument, as for add().
+        """
+        if self._deadlineScheduler is None:
+            self.setupDeadlineScheduler()
+        return self._deadlineScheduler.add(func, name, maxStaleness, costClass,
+                                           priority, extraArgs, appendTask)
+
+    def removeDeadlineTask(self, taskOrName):
+        """Removes a task added with addDeadlineTask(), given the task or
+        its name.  Returns true if it was scheduled. """
+        if self._deadlineScheduler is None:
+            return False
+        return self._deadlineScheduler.remove(taskOrName)
+
     def hasTaskNamed(self, taskName):
         """Returns true if there is at least one task, active or
         sleeping, with the indicated name. """
@@ -463,7 +576,11 @@ class TaskManager:
                 task.setSort(sort)
 
         if taskChain is not None:
-            task.setTaskChain(taskChain)
+            pool = self._taskPools.get(taskChain)
+            if pool is not None:
+                pool.assign(task)
+            else:
+                task.setTaskChain(taskChain)
 
         if owner is not None:
             task.setOwner(owner)
@@ -685,6 +802,42 @@ class TaskManager:
             FP = importlib.import_module('direct.task.FrameProfiler')
             self._frameProfiler = FP.FrameProfiler()
 
+    def startSamplingProfiler(self, interval = None, spikeThreshold = None,
+                              outputDir = None):
+        """Starts sampling the stack of this thread in the background, at
+        the given interval in seconds.  Unlike profileFrames() and the
+        task profiler, this has little enough overhead to leave running.
+        The samples of the last minute or so can be written out at any
+        time with writeSamplingProfile(), and those of a frame that takes
+        longer than spikeThreshold times the average frame are written
+        to outputDir automatically.  The defaults come from the
+        sampling-profiler-* config variables.
+
+        Returns the SamplingProfiler. """
+        if self._samplingProfiler is None:
+            # import here due to import dependencies
+            SP = importlib.import_module('direct.task.SamplingProfiler')
+            self._samplingProfiler = SP.SamplingProfiler(
+                self, interval=interval, spikeThreshold=spikeThreshold,
+                outputDir=outputDir)
+        self._samplingProfiler.start()
+        return self._samplingProfiler
+
+    def stopSamplingProfiler(self):
+        if self._samplingProfiler is not None:
+            self._samplingProfiler.stop()
+
+    def getSamplingProfiler(self):
+        return self._samplingProfiler
+
+    def writeSamplingProfile(self, filename=None):
+        """Writes the recent samples of the sampling profiler to a file
+        in the collapsed stack format, for flame graph tools.  Returns the
+        name of the file, or None if the profiler was never started. """
+        if self._samplingProfiler is None:
+            return None
+        return self._samplingProfiler.writeCollapsed(filename)
+
     def getProfileTasks(self):
         return self._profileTasks.get()
 
@@ -0,0 +1,220 @@
+"""Contains the TaskPool class, a group of threaded task chains that share
+their tasks between them.  Create one with :meth:`.TaskManager.setupTaskPool`.
+"""
+
+__all__ = ['TaskPool']
+
+from direct.directnotify.DirectNotifyGlobal import directNotify
+import os
+import time
+
+
+class TaskPool:
+    """
+    A pool of worker threads that tasks can be added to as though it were a
+    single task chain, by passing the pool's name as the taskChain.  Each
+    worker is a task chain of its own, with one thread.  New tasks go to the
+    least loaded worker, and a worker that runs out of tasks steals one from
+    the most loaded worker, so the load evens out without having to assign
+    tasks to threads by hand.
+
+    A task can be pinned to one worker with setAffinity(), after which it is
+    never moved.  getUtilization() reports how busy each worker has been.
+    """
+
+    notify = directNotify.newCategory("TaskPool")
+
+    def __init__(self, taskMgr, name, numWorkers=None, threadPriority=None,
+                 frameSync=None, stealInterval=0.01):
+        if numWorkers is None:
+            # Leave a core for the main thread.
+            numWorkers = max(1, (os.cpu_count() or 2) - 1)
+
+        self.taskMgr = taskMgr
+        self.name = name
+        self.stealInterval = stealInterval
+        self.chainNames = ['%s-%s' % (name, i) for i in range(numWorkers)]
+        self.chains = []
+        for chainName in self.chainNames:
+            taskMgr.setupTaskChain(chainName, numThreads=1,
+                                   threadPriority=threadPriority,
+                                   frameSync=frameSync)
+            self.chains.append(taskMgr.mgr.findTaskChain(chainName))
+
+        # task id->[worker index, task, seen alive], for tasks that must
+        # not be moved.  Entries are dropped by the worker's steal task
+        # once the task has run or been seen alive, and is no longer
+        # alive.
+        self._affinity = {}
+
+        # Seconds each worker has spent running pool tasks, by worker
+        # index, added up by the worker's steal task from the tasks' own
+        # run times.  Each entry is only written from its own worker
+        # thread.
+        self._busyTime = [0.0] * numWorkers
+        self._lastBusyTime = list(self._busyTime)
+        self._lastUtilizationTime = time.perf_counter()
+        # task id->the task's total run time when last counted, for each
+        # worker
+        self._countedDt = [{} for i in range(numWorkers)]
+
+        # One task per worker looks for work to steal whenever its worker
+        # has nothing else to do.
+        self._stealTasks = []
+        self._stealTaskIds = set()
+        for index, chainName in enumerate(self.chainNames):
+            task = taskMgr.add(self.__stealTask, '%s-steal' % (chainName),
+                               extraArgs=[index], appendTask=True,
+                               taskChain=chainName, sort=1 << 30,
+                               delay=stealInterval)
+            self._stealTasks.append(task)
+            self._stealTaskIds.add(task.id)
+
+    def destroy(self):
+        """ Stops moving tasks between workers.  Tasks already in the pool
+        keep running on the worker they are on. """
+        for task in self._stealTasks:
+            task.remove()
+        self._stealTasks = []
+        self._stealTaskIds = set()
+
+    def getNumWorkers(self):
+        return len(self.chainNames)
+
+    def getWorkerLoads(self):
+        """
+        Returns the estimated cost of one pass over the tasks of every
+        worker, in seconds, based on the average run time of its tasks.
+        """
+        return [self.__getLoad(chain) for chain in self.chains]
+
+    def getUtilization(self):
+        """
+        Returns, for every worker, the fraction of the wall time since the
+        previous call that it spent running tasks.  The run times are
+        counted by the steal tasks, every stealInterval, so the last runs
+        of a task that ended in between are missed.
+        """
+        now = time.perf_counter()
+        elapsed = now - self._lastUtilizationTime
+        utilization = []
+        for index, busyTime in enumerate(list(self._busyTime)):
+            delta = busyTime - self._lastBusyTime[index]
+            utilization.append(delta / elapsed if elapsed > 0 else 0.0)
+            self._lastBusyTime[index] = busyTime
+        self._lastUtilizationTime = now
+        return utilization
+
+    def setAffinity(self, task, worker):
+        """
+        Pins the task to the worker with the given index, moving it there
+        if needed.  Pass None as worker to allow the task to move again.
+        """
+        if worker is None:
+            self._affinity.pop(task.id, None)
+            return
+
+        self._affinity[task.id] = [worker, task, False]
+        self.__moveTask(task, worker)
+
+    def getAffinity(self, task):
+        entry = self._affinity.get(task.id)
+        return entry[0] if entry is not None else None
+
+    def assign(self, task):
+        """ Puts a new task on the worker that has the least to do, unless
+        it has an affinity. Called from TaskManager.add(). """
+        entry = self._affinity.get(task.id)
+        if entry is not None:
+            worker = entry[0]
+        else:
+            # Break ties between workers with no measured load yet by
+            # their number of tasks.
+            loads = [(self.__getLoad(chain), chain.getNumTasks())
+                     for chain in self.chains]
+            worker = loads.index(min(loads))
+
+        self.__moveTask(task, worker)
+
+    def __moveTask(self, task, worker):
+        # What the task has run so far was counted on its old worker, if
+        # at all.
+        self._countedDt[worker][task.id] = task.getTotalDt()
+        task.setTaskChain(self.chainNames[worker])
+
+    def __countBusyTime(self, index, tasks):
+        # Adds what the worker's tasks have run since the last count to
+        # its busy time, and forgets the tasks that left it.
+        countedDt = self._countedDt[index]
+        stealTaskIds = self._stealTaskIds
+        busyTime = 0.0
+        seen = set()
+        for task in tasks:
+            id = task.id
+            if id in stealTaskIds:
+                continue
+            seen.add(id)
+            totalDt = task.getTotalDt()
+            busyTime += totalDt - countedDt.get(id, totalDt)
+            countedDt[id] = totalDt
+        for id in list(countedDt):
+            if id not in seen:
+                del countedDt[id]
+        self._busyTime[index] += busyTime
+
+    def __dropEndedAffinities(self, index):
+        # Forgets the pins of this worker's tasks that have ended.
+        affinity = self._affinity
+        for id, entry in list(affinity.items()):
+            worker, task, seenAlive = entry
+            if worker != index:
+                continue
+            if task.isAlive():
+                entry[2] = True
+            elif seenAlive or task.getTotalDt() > 0:
+                # It was running, so it has not just not been added yet.
+                affinity.pop(id, None)
+
+    def __getLoad(self, chain):
+        load = 0.0
+        for task in chain.getActiveTasks():
+            if task.id not in self._stealTaskIds:
+                load += task.getAverageDt()
+        return load
+
+    def __stealTask(self, index, task):
+        chain = self.chains[index]
+        stealTaskIds = self._stealTaskIds
+        tasks = chain.getActiveTasks()
+        self.__countBusyTime(index, tasks)
+        if self._affinity:
+            self.__dropEndedAffinities(index)
+
+        if all(other.id in stealTaskIds for other in tasks):
+            # This worker has nothing to do.  Find the busiest worker that
+            # has at least two tasks that may be moved; moving a worker's
+            # only task would just move the imbalance.
+            victimTasks = None
+            victimLoad = 0.0
+            for other in self.chains:
+                if other is chain:
+                    continue
+                movable = [candidate for candidate in other.getActiveTasks()
+                           if candidate.id not in stealTaskIds
+                           and candidate.id not in self._affinity]
+                if len(movable) >= 2:
+                    load = self.__getLoad(other)
+                    if victimTasks is None or load > victimLoad:
+                        victimTasks = movable
+                        victimLoad = load
+
+            if victimTasks:
+                # Take the task that best evens out the two workers.
+                best = min(victimTasks,
+                           key=lambda candidate: abs(candidate.getAverageDt() - victimLoad / 2))
+                self.notify.debug('%s stealing %s from %s' % (
+                    self.chainNames[index], best.name, best.getTaskChain()))
+                self.__moveTask(best, index)
+
+        task.setDelay(self.stealInterval)
+        return task.again
@@ -0,0 +1,280 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+class AssetCache:
+
+    def __init__(self, root: str = 'downloads', max_size: int = 512 * 1024 * 1024,
+                 max_age: float = 24 * 60 * 60):
+        self.root = root
+        # Total bytes kept on disk before least recently used entries are evicted
+        self.max_size = max_size
+        # Seconds a cached entries JSON is trusted before it is revalidated
+        self.max_age = max_age
+        self.index_path = os.path.join(self.root, 'index.json')
+        self.lock = threading.RLock()
+        self.check_path_exist(self.root)
+        self.index = self.read_index()
+
+    def check_path_exist(self, pathname):
+        if not os.path.exists(pathname):
+            os.makedirs(pathname)
+
+    """
+    Read the index file, starting over with an empty index if it is missing
+    or unreadable
+    """
+    def read_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+
+        index.setdefault('entries', {})
+        index.setdefault('db', None)
+        return index
+
+    """
+    Write the index file atomically, so a crash never leaves a torn index
+    """
+    def save(self):
+        with self.lock:
+            tmp_path = self.index_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.index, f)
+            os.replace(tmp_path, self.index_path)
+
+    """
+    Remove every cached file and forget the cached entries JSON
+    """
+    def clear(self):
+        with self.lock:
+            for record in self.index['entries'].values():
+                shutil.rmtree(os.path.join(self.root, record['dir']), ignore_errors=True)
+            self.index = {'entries': {}, 'db': None}
+            self.save()
+
+    """
+    Compute the sha256 digest of a file on disk
+    """
+    def hash_file(self, path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    """
+    Return the cached entries JSON for the given api key, or None if there is
+    none or it is older than max_age and must be revalidated
+    """
+    def get_entries(self, api_key):
+        db = self.index['db']
+        if db is None or db['apiKey'] != hashlib.sha256(api_key.encode()).hexdigest():
+            return None
+        if time.time() - db['fetched'] > self.max_age:
+            return None
+        return db['entries']
+
+    """
+    Remember a freshly fetched entries JSON. Storage ids in it are what
+    cached files are revalidated against.
+    """
+    def set_entries(self, api_key, entries):
+        with self.lock:
+            self.index['db'] = {
+                'apiKey': hashlib.sha256(api_key.encode()).hexdigest(),
+                'fetched': time.time(),
+                'entries': entries,
+            }
+            self.save()
+
+    """
+    Folder holding every file of an entry. It is keyed by the hologram's
+    storage id, so a re-uploaded model never collides with the old one.
+    """
+    def entry_dir(self, hologram):
+        return os.path.join(self.root, hologram['storageID'])
+
+    """
+    Path a file of the given hologram is stored at
+    """
+    def file_path(self, hologram, filename):
+        return os.path.join(self.entry_dir(hologram), filename)
+
+    """
+    Check whether a file is cached with the given storage id, in the folder
+    of the hologram as it is now. The size is always checked, the content
+    hash only when verify is set.
+    """
+    def is_file_current(self, entry, hologram, storage_id, filename, verify=False):
+        record = self.index['entries'].get(entry)
+        if record is None:
+            return False
+        if record['dir'] != hologram['storageID']:
+            # The main file was re-uploaded, so every file is fetched again
+            # into the new folder, even those whose storage id is unchanged
+            return False
+
+        file_record = record['files'].get(filename)
+        if file_record is None or file_record['storageID'] != storage_id:
+            return False
+
+        path = os.path.join(self.root, record['dir'], filename)
+        try:
+            if os.path.getsize(path) != file_record['size']:
+                return False
+        except OSError:
+            return False
+
+        return not verify or self.hash_file(path) == file_record['sha256']
+
+    """
+    Record a file that has just been written to file_path(hologram, filename).
+    Pass sha256 if the digest is already known to skip reading the file back.
+    """
+    def add_file(self, entry, hologram, storage_id, filename, sha256=None):
+        path = self.file_path(hologram, filename)
+        file_record = {
+            'storageID': storage_id,
+            'sha256': sha256 if sha256 is not None else self.hash_file(path),
+            'size': os.path.getsize(path),
+        }
+
+        with self.lock:
+            record = self.index['entries'].get(entry)
+            if record is None or record['dir'] != hologram['storageID']:
+                if record is not None:
+                    # The hologram was re-uploaded, so drop the stale folder
+                    shutil.rmtree(os.path.join(self.root, record['dir']), ignore_errors=True)
+                record = {'dir': hologram['storageID'], 'files': {}}
+                self.index['entries'][entry] = record
+
+            record['files'][filename] = file_record
+            record['lastUsed'] = time.time()
+            self.save()
+
+    """
+    Returns the path to a cached file of an entry, or None if it is not cached
+    """
+    def get_path(self, entry, filename):
+        with self.lock:
+            record = self.index['entries'].get(entry)
+            if record is None or filename not in record['files']:
+                return None
+
+            return os.path.join(self.root, record['dir'], filename)
+
+    """
+    Mark entries as just used, for the least recently used order of evict().
+    The index is written by the next save(), which evict() always does.
+    """
+    def touch(self, entries):
+        with self.lock:
+            now = time.time()
+            for entry in entries:
+                record = self.index['entries'].get(entry)
+                if record is not None:
+                    record['lastUsed'] = now
+
+    """
+    Returns the path of the .bam conversion of a cached model, or None if the
+    entry is not cached. The name includes a hash over the content of every
+    file of the entry, so editing a texture or material gives a new .bam.
+    """
+    def get_bam_path(self, entry, filename):
+        with self.lock:
+            record = self.index['entries'].get(entry)
+            if record is None or filename not in record['files']:
+                return None
+
+            digest = hashlib.sha256()
+            for name in sorted(record['files']):
+                digest.update(record['files'][name]['sha256'].encode())
+
+            bam_filename = '%s.%s.bam' % (filename, digest.hexdigest()[:16])
+            return os.path.join(self.root, record['dir'], bam_filename)
+
+    """
+    Check whether the .bam conversion at get_bam_path() was recorded with
+    add_bam() and is still complete on disk
+    """
+    def is_bam_current(self, entry, filename):
+        bam_path = self.get_bam_path(entry, filename)
+        with self.lock:
+            record = self.index['entries'].get(entry)
+            if bam_path is None or record is None:
+                return False
+
+            bam_record = record.get('bams', {}).get(filename)
+            if bam_record is None or bam_record['name'] != os.path.basename(bam_path):
+                return False
+
+        try:
+            return os.path.getsize(bam_path) == bam_record['size']
+        except OSError:
+            return False
+
+    """
+    Record the .bam conversion of a cached model that has just been written
+    to get_bam_path(). Any other conversion of the same file, left over from
+    an earlier version of the entry or an interrupted save, is deleted.
+    """
+    def add_bam(self, entry, filename, bam_path):
+        with self.lock:
+            record = self.index['entries'].get(entry)
+            if record is None or os.path.dirname(bam_path) != os.path.join(self.root, record['dir']):
+                # The entry was evicted or re-uploaded in the meantime
+                return
+
+            for path in glob.glob(os.path.join(glob.escape(self.root), glob.escape(record['dir']),
+                                               glob.escape(filename) + '.*.bam')):
+                if path != bam_path:
+                    os.remove(path)
+
+            record.setdefault('bams', {})[filename] = {
+                'name': os.path.basename(bam_path),
+                'size': os.path.getsize(bam_path),
+            }
+            self.save()
+
+    """
+    Size in bytes of every file of an entry, .bam conversions included
+    """
+    def entry_size(self, record):
+        return sum(file_record['size']
+                   for records in (record['files'], record.get('bams', {}))
+                   for file_record in records.values())
+
+    """
+    Total size in bytes of every cached file
+    """
+    def total_size(self):
+        return sum(self.entry_size(record) for record in self.index['entries'].values())
+
+    """
+    Evict least recently used entries until the cache fits in max_size.
+    Entries listed in keep are never evicted.
+    """
+    def evict(self, keep=()):
+        with self.lock:
+            size = self.total_size()
+            by_age = sorted(self.index['entries'].items(),
+                            key=lambda item: item[1].get('lastUsed', 0))
+
+            for entry, record in by_age:
+                if size <= self.max_size:
+                    break
+                if entry in keep:
+                    continue
+
+                size -= self.entry_size(record)
+                shutil.rmtree(os.path.join(self.root, record['dir']), ignore_errors=True)
+                del self.index['entries'][entry]
+
+            self.save()
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+
+"""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+#  Startup benchmark for the pizza maker. It serves the       #
+#  models folder through a local stand-in for the echo3D      #
+#  query endpoint, then times every stage of bringing up the  #
+#  game in an offscreen window: downloading, loading and      #
+#  converting models, building the scene, creating toppings   #
+#  and rendering the first frame. Results are written as      #
+#  JSON so runs can be compared across changes. Models whose  #
+#  .obj is missing are replaced by a generated stand-in mesh  #
+#  using their materials, and listed in the results.          #
+"""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from panda3d.core import loadPrcFileData, getModelPath, VirtualFileSystem, Filename
+from panda3d.core import AsyncFuture, ModelPool, TexturePool, PandaSystem
+from echo3d_api import Echo3DAPI
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+DEMO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Models set up by placeEnvironmentModel before the toppings
+ENVIRONMENT_MODELS = ('Skybox.glb', 'plate.obj', 'emptyPizza.obj')
+
+# Render offscreen and without sound, before the game opens its window
+loadPrcFileData('benchmark', 'window-type offscreen\naudio-library-name null')
+
+"""
+Local stand-in for the echo3D query endpoint. Without a file parameter it
+returns the entries JSON, with one it returns the file with that storage id.
+"""
+class Echo3DStandIn(object):
+    def __init__(self, modelsDir, models):
+        self.files = {}
+        self.entries = {'db': {}}
+
+        for modelName, entry in models.items():
+            folder = os.path.join(modelsDir, os.path.splitext(modelName)[0])
+            if not os.path.exists(os.path.join(folder, modelName)):
+                raise IOError("Missing %s in %s" % (modelName, folder))
+
+            hologram = {'filename': modelName, 'storageID': self.addFile(entry, folder, modelName)}
+            if modelName.endswith('.obj'):
+                materialName = os.path.splitext(modelName)[0] + '.mtl'
+                textureNames = sorted(f for f in os.listdir(folder) if f not in (modelName, materialName))
+                hologram['materialFilename'] = materialName
+                hologram['materialStorageID'] = self.addFile(entry, folder, materialName)
+                hologram['textureFilenames'] = textureNames
+                hologram['textureStorageIDs'] = [self.addFile(entry, folder, f) for f in textureNames]
+
+            self.entries['db'][entry] = {'hologram': hologram}
+
+        standIn = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                if 'file' in query:
+                    with open(standIn.files[query['file'][0]], 'rb') as f:
+                        body = f.read()
+                else:
+                    body = json.dumps(standIn.entries).encode()
+
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d/query?' % self.server.server_port
+
+    def addFile(self, entry, folder, filename):
+        storageID = entry + '-' + filename
+        self.files[storageID] = os.path.join(folder, filename)
+        return storageID
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+"""
+Write a UV sphere to an .obj file, in one band per material of the given
+.mtl file, to stand in for a model that is not in the models folder
+"""
+def writeStandInObj(path, materialName, rings=16, segments=24):
+    materials = []
+    with open(os.path.join(os.path.dirname(path), materialName)) as f:
+        for line in f:
+            if line.startswith('newmtl '):
+                materials.append(line.split(None, 1)[1].strip())
+
+    lines = ['# Stand-in mesh generated by benchmark.py', 'mtllib ' + materialName]
+    for i in range(rings + 1):
+        theta = math.pi * i / rings
+        for j in range(segments):
+            phi = 2 * math.pi * j / segments
+            normal = (math.sin(theta) * math.cos(phi), math.sin(theta) * math.sin(phi), math.cos(theta))
+            lines.append('v %.5f %.5f %.5f' % tuple(0.5 * n for n in normal))
+            lines.append('vn %.5f %.5f %.5f' % normal)
+
+    material = None
+    for i in range(rings):
+        if materials and materials[i * len(materials) // rings] != material:
+            material = materials[i * len(materials) // rings]
+            lines.append('usemtl ' + material)
+        for j in range(segments):
+            a = i * segments + j + 1
+            b = i * segments + (j + 1) % segments + 1
+            c = b + segments
+            d = a + segments
+            # Skip the triangles that collapse at the poles
+            if i > 0:
+                lines.append('f %d//%d %d//%d %d//%d' % (a, a, b, b, c, c))
+            if i < rings - 1:
+                lines.append('f %d//%d %d//%d %d//%d' % (a, a, c, c, d, d))
+
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+"""
+Copy the folder of every model into the scratch folder, generating a stand-in
+for every .obj that is missing. Returns the new models folder and the names
+of the models that were generated.
+"""
+def prepareModels(modelsDir, scratchDir, models):
+    preparedDir = os.path.join(scratchDir, 'models')
+    standIns = []
+    for modelName in models:
+        folder = os.path.splitext(modelName)[0]
+        target = os.path.join(preparedDir, folder)
+        if os.path.isdir(os.path.join(modelsDir, folder)):
+            shutil.copytree(os.path.join(modelsDir, folder), target)
+        else:
+            os.makedirs(target)
+
+        materialName = folder + '.mtl'
+        if modelName.endswith('.obj') and not os.path.exists(os.path.join(target, modelName)) \
+           and os.path.exists(os.path.join(target, materialName)):
+            writeStandInObj(os.path.join(target, modelName), materialName)
+            standIns.append(modelName)
+
+    return preparedDir, standIns
+
+"""
+Time a single call, returning its result and the elapsed seconds
+"""
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+"""
+Step the task manager until the given coroutine has finished
+"""
+def runTask(demo, coroutine):
+    task = demo.taskMgr.add(coroutine)
+    while not task.done():
+        demo.taskMgr.step()
+    return task.result()
+
+"""
+Load every downloaded model at once, as the game does, and record the
+total time. The stages of all loads share the loader thread in turn, so
+each model only finishes near the end and has no time of its own
+"""
+def benchmarkLoads(demo, models):
+    async def loadAll():
+        return await AsyncFuture.gather(*[demo.loadConvertedModel(modelName)
+                                          for modelName in models])
+
+    loaded, total = timed(runTask, demo, loadAll())
+    return dict(zip(models, loaded)), total
+
+"""
+Import the game from the scratch folder, so its asset cache is created
+there and the real downloads cache is left alone. The scratch folder
+becomes the working directory of both Python and Panda3D, which keeps its
+own, and takes the place of the game's folder at the front of the model
+path. Returns the PizzaDemo class, the models it uses and its asset cache.
+"""
+def importDemo(scratchDir):
+    os.chdir(scratchDir)
+    scratchPath = Filename.fromOsSpecific(scratchDir)
+    VirtualFileSystem.getGlobalPtr().chdir(scratchPath)
+    getModelPath().prependDirectory(scratchPath)
+    from main import PizzaDemo, MODELS
+    from utils import ASSET_CACHE
+    return PizzaDemo, MODELS, ASSET_CACHE
+
+"""
+Run every stage of the startup once, from an empty asset cache
+"""
+def benchmarkRun(demo, standIn, models, cache):
+    result = {}
+    cache.clear()
+    ModelPool.releaseAllModels()
+    TexturePool.releaseAllTextures()
+
+    # Cold start downloads everything, warm start should not touch the network
+    api = Echo3DAPI('benchmark', 'benchmark', cache=cache, main_url=standIn.url)
+    _, result['download_cold'] = timed(api.retrieve_many, models.values())
+    api.close()
+    api = Echo3DAPI('benchmark', 'benchmark', cache=cache, main_url=standIn.url)
+    _, result['download_warm'] = timed(api.retrieve_many, models.values())
+    api.close()
+
+    # Cold loads parse the downloaded files and convert them to .bam,
+    # warm loads read the .bam files back
+    _, result['load_cold'] = benchmarkLoads(demo, models)
+    ModelPool.releaseAllModels()
+    TexturePool.releaseAllTextures()
+    loaded, result['load_warm'] = benchmarkLoads(demo, models)
+
+    # Board and collision squares, then the environment, then the toppings
+    _, result['board'] = timed(demo.initializePizzaMakingEnvironment)
+    result['squares'] = demo.squaresTime
+    environment = [m for m in models if m in ENVIRONMENT_MODELS]
+    toppings = [m for m in models if m not in ENVIRONMENT_MODELS]
+    _, result['environment'] = timed(lambda: [demo.placeEnvironmentModel(m, loaded[m]) for m in environment])
+    _, result['toppings'] = timed(lambda: [demo.placeEnvironmentModel(m, loaded[m]) for m in toppings])
+    _, result['first_frame'] = timed(demo.graphicsEngine.renderFrame)
+
+    demo.resetScene()
+    return result
+
+"""
+Median of every timing over all runs
+"""
+def summarize(runs):
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the startup of the pizza maker')
+    parser.add_argument('--models', type=str, default=os.path.join(DEMO_DIR, '..', 'models'),
+                        help='Folder with one subfolder of model files per model. '
+                             'A missing .obj is generated from its .mtl')
+    parser.add_argument('--runs', type=int, default=3,
+                        help='Number of times to run every stage')
+    parser.add_argument('--board-size', type=int, default=8,
+                        help='Number of squares along each side of the pizza')
+    parser.add_argument('--output', type=str, default=None,
+                        help='File to write the JSON results to, instead of stdout')
+    args = parser.parse_args()
+    modelsDir = os.path.abspath(args.models)
+    output = os.path.abspath(args.output) if args.output else None
+
+    # Run in a scratch folder, so the real downloads cache is left alone
+    scratchDir = tempfile.mkdtemp(prefix='pizza-benchmark-')
+    shutil.copy(os.path.join(DEMO_DIR, 'square.egg.pz'), scratchDir)
+    PizzaDemo, MODELS, cache = importDemo(scratchDir)
+
+    class BenchmarkDemo(PizzaDemo):
+        # The benchmark drives every stage itself
+        async def retrieveModelsFromEcho3D(self):
+            pass
+
+        def loadSquaresForCollisions(self):
+            _, self.squaresTime = timed(PizzaDemo.loadSquaresForCollisions, self)
+
+        def resetScene(self):
+            self.taskMgr.remove('mouseTask')
+            self.environment.removeNode()
+            self.squareRoot.removeNode()
+            for renderer in self.toppingRenderers:
+                if renderer is not None:
+                    renderer.root.removeNode()
+
+    modelsDir, standInModels = prepareModels(modelsDir, scratchDir, MODELS)
+    standIn = Echo3DStandIn(modelsDir, MODELS)
+    standIn.start()
+    try:
+        demo = BenchmarkDemo('benchmark', 'benchmark', boardSize=args.board_size)
+        runs = [benchmarkRun(demo, standIn, MODELS, cache) for i in range(args.runs)]
+    finally:
+        standIn.stop()
+        os.chdir(DEMO_DIR)
+        shutil.rmtree(scratchDir, ignore_errors=True)
+
+    results = {
+        'python': platform.python_version(),
+        'panda3d': PandaSystem.getVersionString(),
+        'boardSize': args.board_size,
+        'standInModels': standInModels,
+        'median': summarize(runs),
+        'runs': runs,
+    }
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    return 0
+
+
+if __name__ == '__main__':
+    main()
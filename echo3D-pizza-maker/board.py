@@ -0,0 +1,172 @@
+from panda3d.core import LPoint3
+import numpy as np
+
+"""
+The pizza board: an N x N grid of squares shaped into a circle, followed by
+one square per plate of extra toppings. Toppings sit in slots: one slot per
+pizza square, then plateCapacity slots per plate, which are used as a stack.
+All board and topping state lives in NumPy arrays indexed by square or slot,
+so boards with thousands of toppings need no per-topping Python objects.
+"""
+class Board(object):
+    # Distance between the centers of two neighbouring plates
+    PLATE_SPACING = 5
+
+    def __init__(self, size=8, numPlates=4, plateCapacity=20, rng=None):
+        self.size = size
+        self.numPlates = numPlates
+        self.plateCapacity = plateCapacity
+
+        # Squares 0..size*size-1 are on the pizza, the rest are plates
+        self.numPizzaSquares = size * size
+        self.numSquares = self.numPizzaSquares + numPlates
+        self.numSlots = self.numPizzaSquares + numPlates * plateCapacity
+
+        # Center of every square
+        self.squarePositions = self.squarePos(np.arange(self.numSquares))
+
+        # Only squares whose center falls within the pizza's circle can be
+        # used. Plate squares can always be used.
+        offsets = self.squarePositions[:self.numPizzaSquares, :2]
+        self.mask = np.ones(self.numSquares, dtype=bool)
+        self.mask[:self.numPizzaSquares] = np.hypot(offsets[:, 0], offsets[:, 1]) <= size / 2
+
+        # Per-slot topping state. A type of -1 means the slot is empty.
+        self.toppingType = np.full(self.numSlots, -1, dtype=np.int16)
+        self.heading = np.zeros(self.numSlots, dtype=np.float32)
+        # Index of the topping within its type's renderer
+        self.instance = np.full(self.numSlots, -1, dtype=np.int32)
+        # Where a topping in each slot rests: the center of its pizza square,
+        # or scattered randomly around the center of its plate
+        if rng is None:
+            rng = np.random.default_rng()
+        plateSquares = self.numPizzaSquares + np.arange(self.numSlots - self.numPizzaSquares) // plateCapacity
+        jitter = rng.uniform(-1, 1, len(plateSquares)).astype(np.float32)
+        self.slotPositions = self.squarePositions[np.concatenate([np.arange(self.numPizzaSquares), plateSquares])]
+        self.slotPositions[self.numPizzaSquares:, 0] += jitter
+        self.slotPositions[self.numPizzaSquares:, 1] += jitter
+
+        # Number of toppings stacked on each plate
+        self.plateCount = np.zeros(numPlates, dtype=np.int32)
+
+    """
+    Vectorized position of the given square indices (an int or an array)
+    """
+    def squarePos(self, squares):
+        squares = np.asarray(squares)
+        n = self.size
+        pizza = squares < self.numPizzaSquares
+        plate = squares - self.numPizzaSquares
+
+        x = np.where(pizza, squares % n - (n - 1) / 2,
+                     (plate - (self.numPlates - 1) / 2) * self.PLATE_SPACING - 0.5)
+        y = np.where(pizza, squares // n - (n - 1) / 2, n / 2 + 4)
+        return np.stack([x, y, np.zeros_like(x)], axis=-1).astype(np.float32)
+
+    """
+    Position of a single square as a point
+    """
+    def squarePoint(self, square):
+        return LPoint3(*self.squarePositions[square])
+
+    """
+    Position a topping in the given slot rests at
+    """
+    def slotPoint(self, slot):
+        return LPoint3(*self.slotPositions[slot])
+
+    """
+    Gives the index of the usable unit square that a point on the z=0 plane
+    falls in, or None if it is outside every square
+    """
+    def squareAt(self, point):
+        n = self.size
+        col = int(np.floor(point.getX() + n / 2))
+        row = int(np.floor(point.getY() + n / 2))
+        if 0 <= col < n and 0 <= row < n:
+            square = row * n + col
+            return square if self.mask[square] else None
+
+        if abs(point.getY() - (n / 2 + 4)) <= 0.5:
+            plate = int(np.rint((point.getX() + 0.5) / self.PLATE_SPACING + (self.numPlates - 1) / 2))
+            if 0 <= plate < self.numPlates:
+                square = self.numPizzaSquares + plate
+                if abs(point.getX() - self.squarePositions[square, 0]) <= 0.5:
+                    return square
+        return None
+
+    """
+    Index of the first slot of a plate
+    """
+    def plateSlot(self, plate):
+        return self.numPizzaSquares + plate * self.plateCapacity
+
+    """
+    Put toppings of one type on the given slots
+    """
+    def addToppings(self, slots, toppingType, headings, instances):
+        self.toppingType[slots] = toppingType
+        self.heading[slots] = headings
+        self.instance[slots] = instances
+
+    """
+    The next count free slots of a plate. Fill them with addToppings and
+    then call stackOnPlate.
+    """
+    def freePlateSlots(self, plate, count):
+        first = self.plateSlot(plate) + self.plateCount[plate]
+        return np.arange(first, first + count)
+
+    """
+    Count toppings just added to the free slots of a plate as stacked on it
+    """
+    def stackOnPlate(self, plate, count):
+        self.plateCount[plate] += count
+
+    """
+    Take the slot of the topping on a square to drag it. For a plate this
+    pops the top of its stack. Returns None if there is no topping.
+    """
+    def takeSlot(self, square):
+        if square < self.numPizzaSquares:
+            return square if self.toppingType[square] >= 0 else None
+
+        plate = square - self.numPizzaSquares
+        if self.plateCount[plate] == 0:
+            return None
+        self.plateCount[plate] -= 1
+        return self.plateSlot(plate) + self.plateCount[plate]
+
+    """
+    Give back a slot taken with takeSlot without moving its topping
+    """
+    def returnSlot(self, slot):
+        if slot >= self.numPizzaSquares:
+            self.plateCount[(slot - self.numPizzaSquares) // self.plateCapacity] += 1
+
+    """
+    Slot that a topping dropped on a square goes to, or None if it cannot go
+    there because the plate is full
+    """
+    def dropSlot(self, square):
+        if square < self.numPizzaSquares:
+            return square
+
+        plate = square - self.numPizzaSquares
+        if self.plateCount[plate] >= self.plateCapacity:
+            return None
+        return self.plateSlot(plate) + self.plateCount[plate]
+
+    """
+    Swap the toppings of a slot taken with takeSlot and a slot given by
+    dropSlot. A topping that lands on top of a plate's stack is counted.
+    """
+    def swapSlots(self, fr, to):
+        for array in (self.toppingType, self.heading, self.instance):
+            array[[fr, to]] = array[[to, fr]]
+
+        for slot in {fr, to}:
+            if slot >= self.numPizzaSquares and self.toppingType[slot] >= 0:
+                plate = (slot - self.numPizzaSquares) // self.plateCapacity
+                if slot == self.plateSlot(plate) + self.plateCount[plate]:
+                    self.plateCount[plate] += 1
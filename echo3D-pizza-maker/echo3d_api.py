@@ -1,23 +1,55 @@
 import requests
+from requests.adapters import HTTPAdapter
 import urllib
+import hashlib
 import json
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from copy import deepcopy
+from asset_cache import AssetCache
+from panda3d.core import AsyncFuture
 
 class Echo3DAPI:
 
-    def __init__(self, api_key: str, security_key: str):
-        self.main_url = 'https://api.echo3D.com/query?'
+    def __init__(self, api_key: str, security_key: str, max_workers: int = 8,
+                 cache: AssetCache = None, main_url: str = 'https://api.echo3D.com/query?'):
+        self.main_url = main_url
         self.api_key = api_key
         self.security_key = security_key
-        self.check_path_exist('downloads')
+        self.max_workers = max_workers
+        self.cache = cache if cache is not None else AssetCache()
         self.base_params = {'key': self.api_key, 'secKey': self.security_key}
-        self.entries = self.get_json_entries(self.base_params)
+        self.session = self.create_session()
+        self.pool = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        # A recent enough entries JSON from the cache saves the query entirely.
+        # Otherwise it is fetched the first time a hologram is needed.
+        self.entries_lock = threading.Lock()
+        self.entries = self.cache.get_entries(self.api_key)
 
     def check_path_exist(self, pathname):
         if not os.path.exists(pathname):
             os.makedirs(pathname)
 
+    """
+    Create a keep-alive HTTP session shared by every download, with enough
+    pooled connections for each worker thread
+    """
+    def create_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    """
+    Shut down the worker threads and close the pooled connections
+    """
+    def close(self):
+        self.pool.shutdown()
+        self.session.close()
+
     def create_url(self, params):
         return self.main_url + urllib.parse.urlencode(params)
 
@@ -29,69 +61,210 @@ class Echo3DAPI:
         json_response = urllib.request.urlopen(url)
         data = json.loads(json_response.read())
         return data
+
+    """
+    Fetch the entries JSON again and store it in the cache. Cached files are
+    revalidated against the storage ids it contains.
+    """
+    def refresh_entries(self):
+        self.entries = self.get_json_entries(self.base_params)
+        self.cache.set_entries(self.api_key, self.entries)
+
+    """
+    Get the hologram of an entry, refreshing the cached entries JSON once if
+    it does not know about the entry yet
+    """
+    def get_hologram(self, entry):
+        with self.entries_lock:
+            if self.entries is None or entry not in self.entries["db"]:
+                self.refresh_entries()
+        return self.entries["db"][entry]["hologram"]
     
     """
     Download a file via Echo3D url 
     """
     def download_file(self, params):
         url = self.create_url(params)
-        r = requests.get(url, allow_redirects=True)
+        r = self.session.get(url, allow_redirects=True)
         return r
-    
+
+    """
+    Stream a file via Echo3D url straight to disk, chunk by chunk, so memory
+    use stays flat regardless of the file size. Data goes to a .part file that
+    is renamed into place once complete. With resume, a .part file left over
+    from an interrupted download is continued with an HTTP Range request.
+    Returns the sha256 digest of the file.
+    """
+    def download_to_file(self, params, path, resume=True, chunk_size=64 * 1024):
+        url = self.create_url(params)
+        part_path = path + '.part'
+        offset = os.path.getsize(part_path) if resume and os.path.exists(part_path) else 0
+        headers = {'Range': 'bytes=%d-' % offset} if offset else {}
+
+        with self.session.get(url, allow_redirects=True, stream=True, headers=headers) as r:
+            if offset and r.status_code == 416:
+                # The server cannot serve that range, so start over
+                os.remove(part_path)
+                return self.download_to_file(params, path, resume=False, chunk_size=chunk_size)
+            r.raise_for_status()
+
+            digest = hashlib.sha256()
+            if offset and r.status_code == 206:
+                # Continue the partial file, hashing what is already there
+                mode = 'ab'
+                with open(part_path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(chunk_size), b''):
+                        digest.update(chunk)
+            else:
+                mode = 'wb'
+
+            with open(part_path, mode) as f:
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    digest.update(chunk)
+                    f.write(chunk)
+
+        os.replace(part_path, path)
+        return digest.hexdigest()
+
+    """
+    Download a single file of an entry into the cache
+    """
+    def retrieve_file(self, entry, storage_id, filename):
+        hologram = self.get_hologram(entry)
+        params = deepcopy(self.base_params)
+        params['file'] = storage_id
+        sha256 = self.download_to_file(params, self.cache.file_path(hologram, filename))
+        self.cache.add_file(entry, hologram, storage_id, filename, sha256=sha256)
+
+    """
+    List the (storage id, filename) pairs of every file that makes up an entry:
+    the main 3d file, followed by textures and material for .obj models
+    """
+    def get_entry_files(self, entry):
+        hologram = self.get_hologram(entry)
+        files = [(hologram['storageID'], hologram['filename'])]
+
+        if hologram['filename'][-3:] == 'obj':
+            if 'textureStorageIDs' in hologram:
+                files.extend(zip(hologram['textureStorageIDs'], hologram['textureFilenames']))
+            files.append((hologram['materialStorageID'], hologram['materialFilename']))
+
+        return files
+
+    """
+    List the files of an entry that are missing from the cache or whose
+    storage id changed since they were cached
+    """
+    def get_stale_files(self, entry):
+        hologram = self.get_hologram(entry)
+        return [(storage_id, filename) for storage_id, filename in self.get_entry_files(entry)
+                if not self.cache.is_file_current(entry, hologram, storage_id, filename)]
+
     def retrieve(self, entry):
-        hologram = self.entries["db"][entry]["hologram"]
-        self.check_path_exist('downloads/' + entry)
+        hologram = self.get_hologram(entry)
+        self.check_path_exist(self.cache.entry_dir(hologram))
         file_format = hologram['filename'][-3:]
 
-        if file_format == 'obj':
-            self.retrieve_obj(entry)
-        elif file_format == 'glb':
-            self.retrieve_glb(entry)
+        if file_format in ('obj', 'glb'):
+            self.retrieve_entry_files(entry)
 
+        self.cache.touch([entry])
+        self.cache.evict(keep=[entry])
         return file_format
 
     """
-    Download a 3D model with .obj file format based on entry id
+    Download several entries at once. Every file of every entry is fetched in
+    parallel on a bounded thread pool sharing the keep-alive session.
+    progress, if given, is called as progress(entry, filename) on the calling
+    thread each time a file has been written, or right away for files that
+    are already cached. Returns a mapping of entry id to file format.
     """
-    def retrieve_obj(self, entry):
-        hologram = self.entries["db"][entry]["hologram"]
+    def retrieve_many(self, entries, progress=None):
+        entries = list(entries)
+        file_formats = {}
+        futures = {}
+        for entry in entries:
+            hologram = self.get_hologram(entry)
+            self.check_path_exist(self.cache.entry_dir(hologram))
+            file_formats[entry] = hologram['filename'][-3:]
 
-        # Download the main 3d file
-        params = deepcopy(self.base_params)
-        params['file'] = hologram['storageID']
-        result = self.download_file(params)
-        open('downloads/' + entry + '/' + hologram['filename'], 'wb').write(result.content)
-
-        # Download all texture files
-        if hasattr(hologram, 'textureStorageIDs'):
-            for i in range(len(hologram['textureStorageIDs'])):
-                params = deepcopy(self.base_params)
-                params['file'] = hologram['textureStorageIDs'][i]
-                result = self.download_file(params)
-                open('downloads/' + entry + '/' + hologram['textureFilenames'][i], 'wb').write(result.content)
-
-        # Download material file
-        params = deepcopy(self.base_params)
-        params['file'] = hologram['materialStorageID']
-        result = self.download_file(params)
-        open('downloads/' + entry + '/' + hologram['materialFilename'], 'wb').write(result.content)
+            stale_files = self.get_stale_files(entry)
+            for storage_id, filename in self.get_entry_files(entry):
+                if (storage_id, filename) in stale_files:
+                    future = self.pool.submit(self.retrieve_file, entry, storage_id, filename)
+                    futures[future] = (entry, filename)
+                elif progress is not None:
+                    progress(entry, filename)
+
+        for future in as_completed(futures):
+            # Re-raises any error from the worker thread
+            future.result()
+            if progress is not None:
+                progress(*futures[future])
+
+        self.cache.touch(entries)
+        self.cache.evict(keep=entries)
+        return file_formats
 
     """
-    Download a 3D model with .glb file format based on entry id
+    Run a blocking call on the worker threads and return a Panda3D AsyncFuture
+    that a task can await without stalling the frame. It resolves to the
+    finished concurrent future: call result() on it to get the return value
+    or re-raise the error from the worker thread.
     """
-    def retrieve_glb(self, entry):
-        hologram = self.entries["db"][entry]["hologram"]
+    def run_async(self, func, *args):
+        panda_future = AsyncFuture()
+        self.pool.submit(func, *args).add_done_callback(panda_future.set_result)
+        return panda_future
 
-        # Download the main 3d file
-        params = deepcopy(self.base_params)
-        params['file'] = hologram['storageID']
-        result = self.download_file(params)
-        open('downloads/' + entry + '/' + hologram['filename'], 'wb').write(result.content)
+    """
+    Awaitable version of retrieve for use in a Panda3D task. All network I/O
+    runs on the worker threads and the task resumes once every file of the
+    entry has landed. progress, if given, is called as progress(entry,
+    filename) on the main thread as each file lands, or right away for files
+    that are already cached. Eviction, which also saves the time the entry
+    was used, is left to the caller, since other entries may still be in
+    flight. Returns the file format.
+    """
+    async def retrieve_async(self, entry, progress=None):
+        # Even looking up the hologram may need to query echo3D
+        hologram = (await self.run_async(self.get_hologram, entry)).result()
+        self.check_path_exist(self.cache.entry_dir(hologram))
+
+        futures = []
+        for storage_id, filename in self.get_entry_files(entry):
+            if self.cache.is_file_current(entry, hologram, storage_id, filename):
+                if progress is not None:
+                    progress(entry, filename)
+                continue
+
+            future = self.run_async(self.retrieve_file, entry, storage_id, filename)
+            if progress is not None:
+                future.add_done_callback(lambda f, filename=filename: progress(entry, filename))
+            futures.append(future)
+
+        if futures:
+            for future in await AsyncFuture.gather(*futures):
+                future.result()
+
+        self.cache.touch([entry])
+        return hologram['filename'][-3:]
+
+    """
+    Download the files of a 3D model that are not cached yet, based on entry id
+    """
+    def retrieve_entry_files(self, entry):
+        for storage_id, filename in self.get_stale_files(entry):
+            self.retrieve_file(entry, storage_id, filename)
 
     """
     Retrieve all model info. Return a mapping list of all 3d models based on api and security key
     """
     def retrieve_model_info(self):
+        with self.entries_lock:
+            if self.entries is None:
+                self.refresh_entries()
+
         model_list = {}
         i = 1
         for entry in self.entries["db"]:
@@ -4,15 +4,18 @@ from direct.showbase.ShowBase import ShowBase
 from panda3d.core import CollisionTraverser, CollisionNode
 from panda3d.core import CollisionHandlerQueue, CollisionRay
 from panda3d.core import AmbientLight, DirectionalLight, LightAttrib
-from panda3d.core import TextNode
+from panda3d.core import TextNode, AsyncFuture
 from panda3d.core import LPoint3, LVector3, BitMask32
 from direct.gui.OnscreenText import OnscreenText
 from direct.showbase.DirectObject import DirectObject
 from direct.task.Task import Task
 from echo3d_api import *
 from utils import *
+from topping_renderer import ToppingRenderer
+from board import Board
 import argparse
-import random
+import os
+import numpy as np
 
 ###################### ECHO3D PIZZA DEMO ######################
 """""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
@@ -30,14 +33,19 @@ class PizzaDemo(ShowBase):
     """
     Game initialization
     """
-    def __init__(self, api_key, security_key):
+    def __init__(self, api_key, security_key, boardSize=8):
         # Creates a window and sets up everything we need for rendering into it.
         ShowBase.__init__(self)
 
+        # Size of the pizza in squares along each side
+        self.boardSize = boardSize
+        # Everything was laid out for a pizza of 8 by 8 squares
+        self.boardScale = boardSize / 8
+
         self.accept('escape', ExitGame) # Setup graceful quitting
         self.loadUI() # Setup loading UI
         self.disableMouse()  # Disable mouse camera control
-        camera.setPosHpr(0, -20, 18, 0, -40, 0)  # Set the camera
+        camera.setPosHpr(0, -20 * self.boardScale, 18 * self.boardScale, 0, -40, 0)  # Set the camera
         self.setupLights()  # Setup default lighting
         self.setUpCollisionDetection() # Enable collision to move pizza toppings
 
@@ -89,41 +97,78 @@ class PizzaDemo(ShowBase):
 
     """
     Retrieve 3D models from echo3D, show loading progress throughout,
-    and initialize game environment on completion. 
+    and bring up each model in the game environment as soon as it arrives.
     """
     async def retrieveModelsFromEcho3D(self):
-        api = Echo3DAPI(api_key=self.apiKey, security_key=self.securityKey)
+        self.updateLoadingText("models")
+        api = Echo3DAPI(api_key=self.apiKey, security_key=self.securityKey, cache=ASSET_CACHE)
+
+        # The board does not depend on echo3D, so it can be set up right away
+        self.initializePizzaMakingEnvironment()
 
-        # Iterate through constants and 
-        # retrieve asset from echo3D
-        for model in MODELS:
-            await self.updateLoadingText(model)
-            api.retrieve(MODELS[model])
+        # Retrieve every asset listed in the constants from echo3D at once.
+        # Each one is loaded and placed the moment its own download lands,
+        # while the window keeps rendering.
+        await AsyncFuture.gather(*[self.loadModelFromEcho3D(api, model) for model in MODELS])
+        api.cache.evict(keep=MODELS.values())
+        api.close()
 
         self.loadingText.destroy()
-        self.initializePizzaMakingEnvironment()
-            
+
         return 0
 
+    """
+    Retrieve a single model from echo3D, load it in the background
+    and place it in the environment
+    """
+    async def loadModelFromEcho3D(self, api, modelName):
+        await api.retrieve_async(MODELS[modelName], progress=self.showRetrievedFile)
+        model = await self.loadConvertedModel(modelName)
+        self.placeEnvironmentModel(modelName, model)
+
+    """
+    Load a model from its flattened .bam conversion. The first time a
+    downloaded asset is seen, it is parsed, flattened and saved as .bam
+    in the background, so later launches skip parsing the source file.
+    The .bam is saved under a temporary name and only renamed into place
+    once complete, and converted again if it cannot be loaded.
+    """
+    async def loadConvertedModel(self, modelName):
+        bamPath = getBamFilePath(modelName)
+        if isBamFileCurrent(modelName):
+            model = await loader.loadModel(bamPath, blocking=False, okMissing=True)
+            if model is not None and not model.isEmpty():
+                return model
+
+        model = await loader.loadModel(getModelFilePath(modelName), blocking=False)
+        await loader.asyncFlattenStrong(model, inPlace=True)
+        # Keep the .bam extension, which tells Panda3D how to write it
+        tmpPath = bamPath[:-len('.bam')] + '.tmp.bam'
+        if await loader.saveModel(tmpPath, model, blocking=False):
+            os.replace(tmpPath, bamPath)
+            addBamFile(modelName, bamPath)
+        return model
+
     """
     Position echo3D models into the correct locations for the ideal pizza making experience
     """      
     def initializePizzaMakingEnvironment(self):
 
-        # Keeps track of locations a topping can be placed
-        self.squares = [None for i in range(68)]
-        # Keeps track of where each topping has been placed
-        self.toppings = [None for i in range(64)]
-
-        # For each of the 4 plates (a,b,c,d) with extra pizza toppings, 
-        # we create a variable to help keep track of how many 
-        # toppings have been used from each plate. 
-        self.PLATE_A_IDX = 64
-        self.PLATE_B_IDX = 84
-        self.PLATE_C_IDX = 104
-        self.PLATE_D_IDX = 124
-        
-        self.loadEnvironmentModels()
+        self.rng = np.random.default_rng()
+        # Keeps track of the squares a topping can be placed on and of where
+        # each topping has been placed, including the extra toppings stacked
+        # on each of the plates
+        self.board = Board(self.boardSize, numPlates=len(TOPPING_TYPES), rng=self.rng)
+        # Draws all toppings of each type
+        self.toppingRenderers = [None for t in TOPPING_TYPES]
+        # Keeps track of which type of topping goes onto each pizza square
+        # once its model has arrived from echo3D: a random type on
+        # 4 out of 7 of the usable squares, and none (-1) on the others
+        self.toppingPlan = self.rng.integers(0, 7, self.board.numPizzaSquares)
+        self.toppingPlan[(self.toppingPlan >= len(TOPPING_TYPES)) |
+                         ~self.board.mask[:self.board.numPizzaSquares]] = -1
+
+        self.environment = render.attachNewNode("environment")
         self.loadSquaresForCollisions()
 
         # Start the task that handles grabbing and releasing toppings
@@ -132,54 +177,80 @@ class PizzaDemo(ShowBase):
         self.accept("mouse1-up", self.releaseTopping)  # releasing places it
     
     """
-    Set up the environment including skybox, empty pizza, and plates for extra toppings
+    Set up a model of the environment (skybox, empty pizza, plates for
+    extra toppings or a topping) once it has been loaded
     """
-    def loadEnvironmentModels(self):
-        # Now we create the pizza board and its toppings
-        self.environment = render.attachNewNode("environment")
-        self.skybox = loader.loadModel(getModelFilePath("Skybox.glb")) 
-        self.skybox.reparentTo(self.environment)
-        self.skybox.setHpr(20)
-
-        self.plate = loader.loadModel(getModelFilePath("plate.obj"))
-        self.plate.reparentTo(self.environment)
-        self.plate.setPos(LPoint3(0,0,-1.4))
-        self.plate.setScale(14)
-        self.plate.setHpr(0,90,0)
-
-        self.pizza = loader.loadModel(getModelFilePath("emptyPizza.obj"))
-        self.pizza.reparentTo(self.environment)
-        self.pizza.setPos(LPoint3(-4.5,2.3,-0.44))
-        self.pizza.setScale(0.45)
+    def placeEnvironmentModel(self, modelName, model):
+        if modelName == "Skybox.glb":
+            self.skybox = model
+            self.skybox.reparentTo(self.environment)
+            self.skybox.setHpr(20)
+
+        elif modelName == "plate.obj":
+            self.plate = model
+            self.plate.reparentTo(self.environment)
+            self.plate.setPos(LPoint3(0,0,-1.4) * self.boardScale)
+            self.plate.setScale(14 * self.boardScale)
+            self.plate.setHpr(0,90,0)
+
+            for plate in range(self.board.numPlates):
+                self.createToppingPlate(model, self.board.squarePoint(self.board.numPizzaSquares + plate))
+
+        elif modelName == "emptyPizza.obj":
+            self.pizza = model
+            self.pizza.reparentTo(self.environment)
+            self.pizza.setPos(LPoint3(-4.5,2.3,-0.44) * self.boardScale)
+            self.pizza.setScale(0.45 * self.boardScale)
 
-        self.mushroomPlate = None
-        self.pepperoniPlate = None
-        self.broccoliPlate = None
-        self.pepperPlate = None
-
-        self.createToppingPlate(self.mushroomPlate, SquarePos(64), Mushroom)
-        self.createToppingPlate(self.pepperoniPlate, SquarePos(65), Pepperoni)
-        self.createToppingPlate(self.broccoliPlate, SquarePos(66), Broccoli)
-        self.createToppingPlate(self.pepperPlate, SquarePos(67), Pepper)
+        else:
+            toppingType = next(t for t, ToppingClass in enumerate(TOPPING_TYPES)
+                               if ToppingClass.model == modelName)
+            self.addToppings(toppingType, model)
 
     """
-    Create a plate with extra pizza toppings
+    Create a plate for extra pizza toppings
     """
-    def createToppingPlate(self, plate, pos, ToppingClass,):
-        plate = loader.loadModel(getModelFilePath("plate.obj"))
-        plate.reparentTo(self.environment)
+    def createToppingPlate(self, model, pos):
+        plate = model.copyTo(self.environment)
         plate.setPos(pos+LPoint3(0,0,-0.21))
         plate.setScale(5)
         plate.setHpr(0,90,0)
 
-        newToppings = [None for i in range(20)]
-        
-        for i in range(10):
-            rnd = random.uniform(-1, 1)
-            newToppings[i] = ToppingClass(i)
-            newToppings[i].obj.setPos(LPoint3(pos.x+rnd, pos.y+rnd, pos.z))
+    """
+    Place every topping of the given type, both on the pizza squares
+    planned for it and on its plate of extra toppings. They are all
+    drawn from the one loaded model by a shared renderer.
+    """
+    def addToppings(self, toppingType, model):
+        ToppingClass = TOPPING_TYPES[toppingType]
+        renderer = ToppingRenderer(ToppingClass.__name__, model,
+                                   ToppingClass.scale, ToppingClass.rot, render)
+        self.toppingRenderers[toppingType] = renderer
+
+        # Squares the user already dropped a topping on while this model
+        # was loading keep that topping
+        board = self.board
+        pizzaSlots = np.flatnonzero((self.toppingPlan == toppingType) &
+                                    (board.toppingType[:board.numPizzaSquares] < 0))
+        # The plate for this type gets half of its capacity in extra
+        # toppings, or what room is left on it
+        plateCount = min(board.plateCapacity // 2,
+                         board.plateCapacity - board.plateCount[toppingType])
+        slots = np.concatenate([pizzaSlots,
+                                board.freePlateSlots(toppingType, plateCount)])
+        headings = self.rng.uniform(0, 360, len(slots))
+        instances = renderer.addMany(board.slotPositions[slots], headings)
+        board.addToppings(slots, toppingType, headings, instances)
+        board.stackOnPlate(toppingType, plateCount)
+
+        renderer.collect()
 
-        self.toppings.extend(newToppings)
+    """
+    Move the topping in the given slot
+    """
+    def moveTopping(self, slot, pos):
+        renderer = self.toppingRenderers[self.board.toppingType[slot]]
+        renderer.setPos(self.board.instance[slot], pos)
 
     """
     Position collideable squares onto the empty pizza 
@@ -194,58 +265,38 @@ class PizzaDemo(ShowBase):
         # This wil represent the index of the square where currently dragged topping
         # was grabbed from
         self.dragging = False
+        # Squares laid out on the board's grid are picked by intersecting the
+        # mouse ray with the board plane. Set this to False if squares are laid out
+        # irregularly, to pick them with the collision traverser instead.
+        self.gridPicking = True
             
-        # Iterate through a range to position squares
-        # Between 0 and 64 handles squares on the empty pizza
-        # Between 64 and 68 handles squares for each of the four topping plates
-        for i in range(68):
-            # Position squares into the shape of 
-            # a circle by skipping certain locations
-            arr = [0,1,6,7,8,15]
-            shouldSkipLocation = False
-            for j in arr:
-                if (j == i or 63-j == i):
-                    shouldSkipLocation = True
-            
-            if (shouldSkipLocation):
-                continue
-
-            # Load, parent, and position the model (a single square polygon)
-            self.squares[i] = loader.loadModel("./square")
-            self.squares[i].reparentTo(self.squareRoot)
-            self.squares[i].setPos(SquarePos(i))
+        # Position a square on every usable location of the board: the
+        # squares within the circle of the empty pizza, followed by
+        # the squares for each of the topping plates
+        square = loader.loadModel("./square")
+        for i in np.flatnonzero(self.board.mask):
+            # Parent and position a copy of the model (a single square polygon)
+            squareNP = square.copyTo(self.squareRoot)
+            squareNP.setPos(self.board.squarePoint(i))
             # Set the model itself to be collideable with the ray. 
-            self.squares[i].find("**/polygon").node().setIntoCollideMask(
+            squareNP.find("**/polygon").node().setIntoCollideMask(
                 BitMask32.bit(1))
             # Set a tag on the square's node so we can look up what square this is
             # later during the collision pass
-            self.squares[i].find("**/polygon").node().setTag('square', str(i))
+            squareNP.find("**/polygon").node().setTag('square', str(i))
 
-            # Add a random topping to the given pizza square
-            if i < 64: 
-                rnd = random.randint(0,6)
-                if (rnd == 0):
-                    self.toppings[i] = Broccoli(i)
-                elif (rnd == 1):
-                    self.toppings[i] = Pepperoni(i)
-                elif (rnd == 2):
-                    self.toppings[i] = Mushroom(i)
-                elif (rnd == 3):
-                    self.toppings[i] = Pepper(i)
+        if self.gridPicking:
+            # Squares are never collided with, so draw them as one piece
+            self.squareRoot.flattenStrong()
 
     """
     Swap the position of two toppings
     """
-    def swapToppings(self, fr, to, hiSq):
-        temp = self.toppings[fr]
-        self.toppings[fr] = self.toppings[to]
-        self.toppings[to] = temp
-        if self.toppings[fr]:
-            self.toppings[fr].square = fr
-            self.toppings[fr].obj.setPos(SquarePos(fr))
-        if self.toppings[to]:
-            self.toppings[to].square = hiSq
-            self.toppings[to].obj.setPos(SquarePos(hiSq))
+    def swapToppings(self, fr, to):
+        self.board.swapSlots(fr, to)
+        for slot in (fr, to):
+            if self.board.toppingType[slot] >= 0:
+                self.moveTopping(slot, self.board.slotPoint(slot))
 
     """
     Handle dragging toppings and collisions with squares
@@ -260,33 +311,46 @@ class PizzaDemo(ShowBase):
             # Set the position of the ray based on the mouse position
             self.pickerRay.setFromLens(self.camNode, mpos.getX(), mpos.getY())
 
+            # Gets the point described by pickerRay.getOrigin(), which is relative to
+            # camera, relative instead to render
+            nearPoint = render.getRelativePoint(camera, self.pickerRay.getOrigin())
+            # Same thing with the direction of the ray
+            nearVec = render.getRelativeVector(camera, self.pickerRay.getDirection())
+
             # If we are dragging something, set the position of the object
             # to be at the appropriate point over the plane of the board
             if self.dragging is not False:
-                # Gets the point described by pickerRay.getOrigin(), which is relative to
-                # camera, relative instead to render
-                nearPoint = render.getRelativePoint(camera, self.pickerRay.getOrigin())
-                # Same thing with the direction of the ray
-                nearVec = render.getRelativeVector(camera, self.pickerRay.getDirection())
-                self.toppings[self.dragging].obj.setPos(PointAtZ(.5, nearPoint, nearVec))
-
-            # Do the actual collision pass 
-            self.picker.traverse(self.squareRoot)
-            if self.pq.getNumEntries() > 0:
-                # if we have hit something, sort the hits so that the closest is first
-                self.pq.sortEntries()
-                i = int(self.pq.getEntry(0).getIntoNode().getTag('square'))
-                self.hiSq = i
+                self.moveTopping(self.dragging, PointAtZ(.5, nearPoint, nearVec))
+
+            if self.gridPicking:
+                # The squares lie on the z=0 plane, so the hit square
+                # follows directly from where the ray crosses it
+                if nearVec.getZ() < 0:
+                    i = self.board.squareAt(PointAtZ(0, nearPoint, nearVec))
+                    if i is not None:
+                        self.hiSq = i
+            else:
+                # Do the actual collision pass 
+                self.picker.traverse(self.squareRoot)
+                if self.pq.getNumEntries() > 0:
+                    # if we have hit something, sort the hits so that the closest is first
+                    self.pq.sortEntries()
+                    i = int(self.pq.getEntry(0).getIntoNode().getTag('square'))
+                    self.hiSq = i
 
         return Task.cont
     
     """
     Update the UI as models load
     """
-    async def updateLoadingText(self, model):
-        # Update loading text and pause the task to trigger rerender
+    def updateLoadingText(self, model):
         self.loadingText.setText("Loading...\nRetrieving "+model+" from echo3D.\n")
-        await Task.pause(0.1) 
+
+    """
+    Report a retrieved file on the loading UI
+    """
+    def showRetrievedFile(self, entry, filename):
+        self.loadingText.setText("Loading...\nRetrieved "+filename+" from echo3D.\n")
 
     """ 
     Handle picking up a topping
@@ -296,28 +360,13 @@ class PizzaDemo(ShowBase):
         if (self.hiSq is False):
             return
         
-        # Given the index of a square,
-        # get the corresponding topping index
-        toppingIdx = -1
-        if (self.hiSq >= 64):
-            if (self.hiSq == 64):
-                toppingIdx = self.PLATE_A_IDX
-                self.PLATE_A_IDX = self.PLATE_A_IDX + 1
-            if (self.hiSq == 65):
-                toppingIdx = self.PLATE_B_IDX
-                self.PLATE_B_IDX = self.PLATE_B_IDX + 1
-            if (self.hiSq == 66):
-                toppingIdx = self.PLATE_C_IDX
-                self.PLATE_C_IDX = self.PLATE_C_IDX + 1
-            if (self.hiSq == 67):
-                toppingIdx = self.PLATE_D_IDX
-                self.PLATE_D_IDX = self.PLATE_D_IDX + 1
-        else:
-            toppingIdx = self.hiSq
+        # Given the index of a square, get the slot of its topping.
+        # For a plate, this takes the topping on top of its stack.
+        toppingIdx = self.board.takeSlot(self.hiSq)
 
         # Set the topping to be dragging and 
-        # record its current square
-        if self.toppings[toppingIdx]:
+        # record its current slot
+        if toppingIdx is not None:
             self.dragging = toppingIdx
             self.hiSq = False
 
@@ -329,32 +378,19 @@ class PizzaDemo(ShowBase):
         # position. Otherwise, swap it with the topping in the new square
         # Make sure we really are dragging something
         if self.dragging is not False:
+            # Given the index of a square, get the slot to drop the topping
+            # in. For a plate, this is on top of its stack, if it has room.
+            toppingIdx = None
+            if self.hiSq is not False:
+                toppingIdx = self.board.dropSlot(self.hiSq)
+
             # We have let go of the topping, but we are not on a square
-            if self.hiSq is False:
-                self.toppings[self.dragging].obj.setPos(
-                    SquarePos(self.dragging))
+            if toppingIdx is None:
+                self.board.returnSlot(self.dragging)
+                self.moveTopping(self.dragging, self.board.slotPoint(self.dragging))
             else:
-                # Given the index of a square,
-                # get the corresponding topping index
-                toppingIdx = -1
-                if (self.hiSq >= 64):
-                    if (self.hiSq == 64):
-                        self.PLATE_A_IDX = self.PLATE_A_IDX - 1
-                        toppingIdx = self.PLATE_A_IDX
-                    if (self.hiSq == 65):
-                        self.PLATE_B_IDX = self.PLATE_B_IDX - 1
-                        toppingIdx = self.PLATE_B_IDX
-                    if (self.hiSq == 66):
-                        self.PLATE_C_IDX = self.PLATE_C_IDX - 1
-                        toppingIdx = self.PLATE_C_IDX
-                    if (self.hiSq == 67):
-                        self.PLATE_D_IDX = self.PLATE_D_IDX - 1
-                        toppingIdx = self.PLATE_D_IDX
-                else:
-                    toppingIdx = self.hiSq
-
                 # Otherwise, swap the toppings
-                self.swapToppings(self.dragging, toppingIdx, self.hiSq)
+                self.swapToppings(self.dragging, toppingIdx)
 
         # We are no longer dragging anything
         self.dragging = False
@@ -376,15 +412,13 @@ class PizzaDemo(ShowBase):
 # Classes #
 """"""""""""
 """
-Class for a topping. This just handles loading the model and setting initial position
+Class for a type of topping. This just describes the model and how to scale and
+rotate it; the toppings themselves are drawn by a ToppingRenderer per type
 """
 class Topping(object):
-    def __init__(self, square):
-        self.obj = loader.loadModel(self.model)
-        self.obj.reparentTo(render)
-        self.obj.setPos(SquarePos(square))
-        self.obj.setScale(self.scale)
-        self.obj.setHpr(random.randrange(360), self.rot[1], self.rot[2])
+    model = None
+    scale = 1
+    rot = [0, 0, 0]
 
 
 """
@@ -392,25 +426,31 @@ Classes for each type of topping.
 These can of course be updated depending on your needs. 
 """
 class Broccoli(Topping):
-    model = getModelFilePath("broccoli.obj")
+    model = "broccoli.obj"
     scale = 1.5
     rot = [0, 0, 0]
 
 class Mushroom(Topping):
-    model = getModelFilePath("mushroom.obj")
+    model = "mushroom.obj"
     scale = 4
     rot = [0, 0, 0]
 
 class Pepper(Topping):
-    model = getModelFilePath("paprikaSlice.obj")
+    model = "paprikaSlice.obj"
     scale = 4
     rot = [0, 90, 0]
 
 class Pepperoni(Topping):
-    model = getModelFilePath("pepperoni.obj")
+    model = "pepperoni.obj"
     scale = 4
     rot = [0, 90, 0]
 
+"""
+Every type of topping. Each one has a plate of extra toppings,
+in the same order.
+"""
+TOPPING_TYPES = [Mushroom, Pepperoni, Broccoli, Pepper]
+
 
 """"""""""""""""""""""""
 # Parse user arguments #
@@ -421,11 +461,13 @@ def main():
                         help='Your Echo3D api key')
     parser.add_argument('security_key', type=str,
                         help='Your Echo3D security key')
+    parser.add_argument('--board-size', type=int, default=8,
+                        help='Number of squares along each side of the pizza')
     
     args = parser.parse_args()
 
     # Do the main initialization and start 3D rendering
-    demo = PizzaDemo(args.api_key, args.security_key)
+    demo = PizzaDemo(args.api_key, args.security_key, boardSize=args.board_size)
     demo.run()
 
     return 0
@@ -0,0 +1,52 @@
+from panda3d.core import RigidBodyCombiner, ModelNode, NodePath
+import numpy as np
+
+"""
+Draws every topping of one type from a single loaded model. All toppings
+hang below a RigidBodyCombiner, which merges them into as few geoms as
+the model has render states, so the number of draw calls stays the same
+no matter how many toppings there are. The toppings can still be moved
+individually afterwards. Toppings are identified by instance index; their
+state is kept by the caller (see Board).
+"""
+class ToppingRenderer(object):
+    def __init__(self, name, model, scale, rot, parent):
+        self.model = model
+        self.scale = scale
+        self.rot = rot
+        self.root = parent.attachNewNode(RigidBodyCombiner(name))
+        self.numInstances = 0
+
+    """
+    Add toppings at the given positions (an N x 3 array) and headings,
+    returning their instance indices. Call collect() once all toppings
+    have been added.
+    """
+    def addMany(self, positions, headings):
+        for pos, heading in zip(positions, headings):
+            node = NodePath(ModelNode("topping"))
+            # Keep the transform around, so the combiner treats it as moving
+            node.node().setPreserveTransform(ModelNode.PTLocal)
+            node.reparentTo(self.root)
+            x, y, z = map(float, pos)
+            node.setPosHprScale(x, y, z, float(heading), self.rot[1], self.rot[2],
+                                self.scale, self.scale, self.scale)
+            # Every topping shares the same geometry
+            self.model.instanceTo(node)
+
+        first = self.numInstances
+        self.numInstances += len(positions)
+        return np.arange(first, self.numInstances)
+
+    """
+    Merge all toppings into the shared geoms. This is expensive, so only
+    call it after adding toppings, not after moving them.
+    """
+    def collect(self):
+        self.root.node().collect()
+
+    """
+    Move a topping, without having to collect() again
+    """
+    def setPos(self, instance, pos):
+        self.root.getChild(int(instance)).setPos(pos)
@@ -1,7 +1,9 @@
 from model_constants import MODELS
-from panda3d.core import LPoint3
+from asset_cache import AssetCache
 import sys
-import shutil
+
+# Persistent cache of models retrieved from echo3D, shared across launches
+ASSET_CACHE = AssetCache('downloads')
 
 """""""""""""""""""""
 # Helper Functions #
@@ -17,26 +19,34 @@ def PointAtZ(z, point, vec):
     return point + vec * ((z - point.getZ()) / vec.getZ())
 
 """
-Handy function for getting the proper position for a given square
-"""
-def SquarePos(i):
-    # last 4 squares correspond to each topping plate, 
-    # and not the empty pizza
-    if (i >= 64):
-        return LPoint3(-8+((i%64)*5),8,0)
-    return LPoint3((i % 8) - 3.5, int(i // 8) - 3.5, 0)
-    
-"""
-This will exit the game and delete 
-models retrieved from echo3D
+This will exit the game. Models retrieved from echo3D
+stay in the asset cache for the next launch.
 """
 def ExitGame():
-    shutil.rmtree('./downloads')
+    ASSET_CACHE.save()
     sys.exit()
 
 """
 Returns the path to an asset retrieved from echo3D
 """
 def getModelFilePath(modelName):
-    return "downloads/"+MODELS[modelName]+"/"+modelName
+    return ASSET_CACHE.get_path(MODELS[modelName], modelName)
+
+"""
+Returns the path to the flattened .bam conversion of an asset retrieved from echo3D
+"""
+def getBamFilePath(modelName):
+    return ASSET_CACHE.get_bam_path(MODELS[modelName], modelName)
+
+"""
+Returns whether the .bam conversion of an asset was completely saved for its current version
+"""
+def isBamFileCurrent(modelName):
+    return ASSET_CACHE.is_bam_current(MODELS[modelName], modelName)
+
+"""
+Records the .bam conversion of an asset in the asset cache, once it has been saved
+"""
+def addBamFile(modelName, bamPath):
+    ASSET_CACHE.add_bam(MODELS[modelName], modelName, bamPath)
         
@@ -3740,6 +3740,8 @@ TargetAdd('p3event_composite2.obj', opts=OPTS, input='p3event_composite2.cxx')
 
 OPTS=['DIR:panda/src/event']
 PyTargetAdd('p3event_asyncFuture_ext.obj', opts=OPTS, input='asyncFuture_ext.cxx')
+PyTargetAdd('p3event_event_ext.obj', opts=OPTS, input='event_ext.cxx')
+PyTargetAdd('p3event_eventQueue_ext.obj', opts=OPTS, input='eventQueue_ext.cxx')
 PyTargetAdd('p3event_pythonTask.obj', opts=OPTS, input='pythonTask.cxx')
 IGATEFILES=GetDirectoryContents('panda/src/event', ["*.h", "*_composite*.cxx"])
 TargetAdd('libp3event.in', opts=OPTS, input=IGATEFILES)
@@ -4255,6 +4257,8 @@ PyTargetAdd('core.pyd', input='p3pipeline_pythonThread.obj')
 PyTargetAdd('core.pyd', input='p3putil_ext_composite.obj')
 PyTargetAdd('core.pyd', input='p3pnmimage_pfmFile_ext.obj')
 PyTargetAdd('core.pyd', input='p3event_asyncFuture_ext.obj')
+PyTargetAdd('core.pyd', input='p3event_event_ext.obj')
+PyTargetAdd('core.pyd', input='p3event_eventQueue_ext.obj')
 PyTargetAdd('core.pyd', input='p3event_pythonTask.obj')
 PyTargetAdd('core.pyd', input='p3pstatclient_pStatClient_ext.obj')
 PyTargetAdd('core.pyd', input='p3gobj_ext_composite.obj')
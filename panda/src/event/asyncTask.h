@@ -95,6 +95,7 @@ PUBLISHED:
 
   INLINE double get_dt() const;
   INLINE double get_max_dt() const;
+  INLINE double get_total_dt() const;
   INLINE double get_average_dt() const;
 
   virtual void output(std::ostream &out) const;
@@ -118,6 +119,7 @@ PUBLISHED:
 
   MAKE_PROPERTY(dt, get_dt);
   MAKE_PROPERTY(max_dt, get_max_dt);
+  MAKE_PROPERTY(total_dt, get_total_dt);
   MAKE_PROPERTY(average_dt, get_average_dt);
 
 protected:
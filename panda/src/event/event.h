@@ -48,6 +48,7 @@ PUBLISHED:
   int get_num_parameters() const;
   EventParameter get_parameter(int n) const;
   MAKE_SEQ(get_parameters, get_num_parameters, get_parameter);
+  PY_EXTENSION(PyObject *get_parameter_values() const);
 
   bool has_receiver() const;
   EventReceiver *get_receiver() const;
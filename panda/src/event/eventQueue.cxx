@@ -103,6 +103,23 @@ dequeue_event() {
   return result;
 }
 
+/**
+ * Removes every event on the queue at once, appending them to the given
+ * deque in the order they were queued.  This takes the lock only once, no
+ * matter how many events are pending.
+ */
+void EventQueue::
+dequeue_events(Events &result) {
+  LightMutexHolder holder(_lock);
+
+  if (result.empty()) {
+    result.swap(_queue);
+  } else {
+    result.insert(result.end(), _queue.begin(), _queue.end());
+    _queue.clear();
+  }
+}
+
 /**
  *
  */
@@ -37,14 +37,18 @@ PUBLISHED:
   bool is_queue_empty() const;
   bool is_queue_full() const;
   CPT_Event dequeue_event();
+  PY_EXTENSION(PyObject *dequeue_events());
 
   INLINE static EventQueue *get_global_event_queue();
 
+public:
+  typedef pdeque<CPT_Event> Events;
+  void dequeue_events(Events &result);
+
 private:
   static void make_global_event_queue();
   static EventQueue *_global_event_queue;
 
-  typedef pdeque<CPT_Event> Events;
   Events _queue;
 
   LightMutex _lock;
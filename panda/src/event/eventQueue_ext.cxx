@@ -0,0 +1,53 @@
+/**
+ * PANDA 3D SOFTWARE
+ * Copyright (c) Carnegie Mellon University.  All rights reserved.
+ *
+ * All use of this software is subject to the terms of the revised BSD
+ * license.  You should have received a copy of this license along
+ * with this source code in a file named "LICENSE."
+ *
+ * @file eventQueue_ext.cxx
+ * @author agent
+ * @date 2026-10-18
+ */
+
+#include "eventQueue_ext.h"
+
+#ifdef HAVE_PYTHON
+
+#ifndef CPPPARSER
+extern struct Dtool_PyTypedObject Dtool_Event;
+#endif  // CPPPARSER
+
+/**
+ * Removes all of the events currently on the queue and returns them as a
+ * list, in the order they were queued.  Returns an empty list if the queue
+ * is empty.  This is equivalent to calling dequeue_event() until
+ * is_queue_empty() returns true, but takes the queue's lock only once.
+ */
+PyObject *Extension<EventQueue>::
+dequeue_events() {
+  EventQueue::Events events;
+  _this->dequeue_events(events);
+
+  PyObject *list = PyList_New((Py_ssize_t)events.size());
+  if (list == nullptr) {
+    return nullptr;
+  }
+
+  Py_ssize_t i = 0;
+  for (const CPT_Event &event : events) {
+    event->ref();
+    PyObject *wrap = DTool_CreatePyInstanceTyped
+      ((void *)event.p(), Dtool_Event, true, true, event->get_type_index());
+    if (wrap == nullptr) {
+      Py_DECREF(list);
+      return nullptr;
+    }
+    // This steals a reference.
+    PyList_SET_ITEM(list, i++, wrap);
+  }
+  return list;
+}
+
+#endif  // HAVE_PYTHON
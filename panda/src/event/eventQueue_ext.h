@@ -0,0 +1,37 @@
+/**
+ * PANDA 3D SOFTWARE
+ * Copyright (c) Carnegie Mellon University.  All rights reserved.
+ *
+ * All use of this software is subject to the terms of the revised BSD
+ * license.  You should have received a copy of this license along
+ * with this source code in a file named "LICENSE."
+ *
+ * @file eventQueue_ext.h
+ * @author agent
+ * @date 2026-10-18
+ */
+
+#ifndef EVENTQUEUE_EXT_H
+#define EVENTQUEUE_EXT_H
+
+#include "pandabase.h"
+
+#ifdef HAVE_PYTHON
+
+#include "extension.h"
+#include "eventQueue.h"
+#include "py_panda.h"
+
+/**
+ * This class defines the extension methods for EventQueue, which are called
+ * instead of any C++ methods with the same prototype.
+ */
+template<>
+class Extension<EventQueue> : public ExtensionBase<EventQueue> {
+public:
+  PyObject *dequeue_events();
+};
+
+#endif  // HAVE_PYTHON
+
+#endif  // EVENTQUEUE_EXT_H
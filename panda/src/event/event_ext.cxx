@@ -0,0 +1,141 @@
+/**
+ * PANDA 3D SOFTWARE
+ * Copyright (c) Carnegie Mellon University.  All rights reserved.
+ *
+ * All use of this software is subject to the terms of the revised BSD
+ * license.  You should have received a copy of this license along
+ * with this source code in a file named "LICENSE."
+ *
+ * @file event_ext.cxx
+ * @author agent
+ * @date 2026-10-18
+ */
+
+#include "event_ext.h"
+#include "paramValue.h"
+#include "pmap.h"
+
+#ifdef HAVE_PYTHON
+
+#ifndef CPPPARSER
+extern struct Dtool_PyTypedObject Dtool_TypedReferenceCount;
+extern struct Dtool_PyTypedObject Dtool_TypedWritableReferenceCount;
+#endif  // CPPPARSER
+
+typedef PyObject *(*ParameterDecoder)(TypedWritableReferenceCount *ptr);
+
+static PyObject *
+decode_int(TypedWritableReferenceCount *ptr) {
+  return Dtool_WrapValue(((const EventStoreInt *)ptr)->get_value());
+}
+
+static PyObject *
+decode_double(TypedWritableReferenceCount *ptr) {
+  return Dtool_WrapValue(((const EventStoreDouble *)ptr)->get_value());
+}
+
+static PyObject *
+decode_string(TypedWritableReferenceCount *ptr) {
+  return Dtool_WrapValue(((const EventStoreString *)ptr)->get_value());
+}
+
+static PyObject *
+decode_wstring(TypedWritableReferenceCount *ptr) {
+  return Dtool_WrapValue(((const EventStoreWstring *)ptr)->get_value());
+}
+
+static PyObject *
+decode_typed_ref_count(TypedWritableReferenceCount *ptr) {
+  TypedReferenceCount *value = ((const EventStoreTypedRefCount *)ptr)->get_value();
+  if (value == nullptr) {
+    Py_INCREF(Py_None);
+    return Py_None;
+  }
+  value->ref();
+  return DTool_CreatePyInstanceTyped((void *)value, Dtool_TypedReferenceCount,
+                                     true, false, value->get_type_index());
+}
+
+static PyObject *
+decode_pointer(TypedWritableReferenceCount *ptr) {
+  ptr->ref();
+  return DTool_CreatePyInstanceTyped((void *)ptr, Dtool_TypedWritableReferenceCount,
+                                     true, false, ptr->get_type_index());
+}
+
+/**
+ * Returns the function that decodes parameters of the given type.  The
+ * answer is cached per type, so that the chain of type checks is only run
+ * the first time a parameter type is seen.  This is only called with the
+ * GIL held, which protects the cache.
+ */
+static ParameterDecoder
+get_decoder(TypeHandle type) {
+  static pmap<TypeHandle, ParameterDecoder> decoders;
+
+  pmap<TypeHandle, ParameterDecoder>::const_iterator it = decoders.find(type);
+  if (it != decoders.end()) {
+    return it->second;
+  }
+
+  ParameterDecoder decoder;
+  if (type.is_derived_from(EventStoreInt::get_class_type())) {
+    decoder = &decode_int;
+  } else if (type.is_derived_from(EventStoreDouble::get_class_type())) {
+    decoder = &decode_double;
+  } else if (type.is_derived_from(EventStoreString::get_class_type())) {
+    decoder = &decode_string;
+  } else if (type.is_derived_from(EventStoreWstring::get_class_type())) {
+    decoder = &decode_wstring;
+  } else if (type.is_derived_from(EventStoreTypedRefCount::get_class_type())) {
+    decoder = &decode_typed_ref_count;
+  } else {
+    // Must be some user defined type, return the pointer, which will be
+    // downcast to that type.
+    decoder = &decode_pointer;
+  }
+  decoders[type] = decoder;
+  return decoder;
+}
+
+/**
+ * Returns the values of all the parameters of the event as a list, in the
+ * same way as EventManager.parseEventParameter() would extract them one at a
+ * time: ints, doubles and strings are converted to the equivalent Python
+ * objects, an empty parameter becomes None and any other parameter becomes
+ * the object it points to.
+ */
+PyObject *Extension<Event>::
+get_parameter_values() const {
+  int num_parameters = _this->get_num_parameters();
+  PyObject *values = PyList_New(num_parameters);
+  if (values == nullptr) {
+    return nullptr;
+  }
+
+  for (int i = 0; i < num_parameters; ++i) {
+    PyObject *value = get_parameter_value(_this->get_parameter(i));
+    if (value == nullptr) {
+      Py_DECREF(values);
+      return nullptr;
+    }
+    // This steals a reference.
+    PyList_SET_ITEM(values, i, value);
+  }
+  return values;
+}
+
+/**
+ * Returns the value of a single event parameter as a Python object.
+ */
+PyObject *Extension<Event>::
+get_parameter_value(const EventParameter &param) {
+  TypedWritableReferenceCount *ptr = param.get_ptr();
+  if (ptr == nullptr) {
+    Py_INCREF(Py_None);
+    return Py_None;
+  }
+  return get_decoder(ptr->get_type())(ptr);
+}
+
+#endif  // HAVE_PYTHON
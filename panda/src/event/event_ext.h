@@ -0,0 +1,39 @@
+/**
+ * PANDA 3D SOFTWARE
+ * Copyright (c) Carnegie Mellon University.  All rights reserved.
+ *
+ * All use of this software is subject to the terms of the revised BSD
+ * license.  You should have received a copy of this license along
+ * with this source code in a file named "LICENSE."
+ *
+ * @file event_ext.h
+ * @author agent
+ * @date 2026-10-18
+ */
+
+#ifndef EVENT_EXT_H
+#define EVENT_EXT_H
+
+#include "pandabase.h"
+
+#ifdef HAVE_PYTHON
+
+#include "extension.h"
+#include "event.h"
+#include "py_panda.h"
+
+/**
+ * This class defines the extension methods for Event, which are called
+ * instead of any C++ methods with the same prototype.
+ */
+template<>
+class Extension<Event> : public ExtensionBase<Event> {
+public:
+  PyObject *get_parameter_values() const;
+
+  static PyObject *get_parameter_value(const EventParameter &param);
+};
+
+#endif  // HAVE_PYTHON
+
+#endif  // EVENT_EXT_H
@@ -0,0 +1,330 @@
+from panda3d.core import Datagram, DatagramIterator
+from direct.distributed.MsgTypesCMU import (
+    OBJECT_DELETE_CMU,
+    OBJECT_DISABLE_CMU,
+    OBJECT_UPDATE_FIELD_CMU,
+    REQUEST_GENERATES_CMU,
+    SMOOTH_NODE_BATCH_ACK_CMU,
+)
+from direct.distributed.PyDatagram import PyDatagram
+from direct.distributed.ServerRepository import ServerRepository
+from direct.distributed.SmoothNodeBroadcaster import (
+    QuantizedPosHprEncoder,
+    SmoothNodeBatch,
+    SmoothNodeBroadcaster,
+)
+from direct.task.TaskManagerGlobal import taskMgr
+import pytest
+import socket
+import struct
+import time
+
+
+@pytest.fixture
+def server():
+    # Find a free port for the server to listen on.
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    server = ServerRepository(port, '127.0.0.1', dcFileNames=[])
+    server.port = port
+    server.sockets = []
+    yield server
+    for name in ('serverListenerPollTask', 'serverReaderPollTask',
+                 'clientHardDisconnect', 'serverSendQueuedTask',
+                 'serverGenerateRequestTask', 'flushTask'):
+        taskMgr.remove(name)
+    for client in list(server.clientsByConnection.values()):
+        server.qcm.closeConnection(client.connection)
+    server.qcm.closeConnection(server.tcpRendezvous)
+    for sock in server.sockets:
+        sock.close()
+
+
+def connect(server):
+    # Connects a new client to the server, and returns its Client object
+    # and the client end of the connection.
+    sock = socket.create_connection(('127.0.0.1', server.port))
+    sock.settimeout(5)
+    server.sockets.append(sock)
+    numClients = len(server.clientsByConnection)
+    deadline = time.time() + 5
+    while len(server.clientsByConnection) == numClients:
+        assert time.time() < deadline
+        server.listenerPoll(None)
+    return server.clientsByConnection[server.lastConnection], sock
+
+
+def receive(sock, size):
+    # Reads exactly size bytes from the client end of a connection.
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        assert chunk
+        data += chunk
+    return data
+
+
+@pytest.mark.parametrize('batchSends', [True, False])
+@pytest.mark.parametrize('headerSize', [2, 4])
+def test_queued_sends_match_connection_writer(server, headerSize, batchSends):
+    server.setTcpHeaderSize(headerSize)
+    server.batchSends = batchSends
+    queued, queuedSock = connect(server)
+    written, writtenSock = connect(server)
+    server.sendQueuedTask(None)
+    # Both got their doId range.
+    receive(queuedSock, headerSize + 10)
+    receive(writtenSock, headerSize + 10)
+
+    # The long message only fits a 4-byte header.  With a 2-byte header,
+    # the ConnectionWriter refuses it, and the server drops it.
+    messages = [b'\x01', bytes(range(256)) * 2, bytes(70000), b'last']
+    expected = b''
+    for message in messages:
+        server.sendToClient(queued, Datagram(message))
+        if len(message) < 1 << (headerSize * 8):
+            server.cw.send(Datagram(message), written.connection)
+            expected += len(message).to_bytes(headerSize, 'little') + message
+    server.sendQueuedTask(None)
+    assert queued.pendingSends == []
+
+    assert receive(writtenSock, len(expected)) == expected
+    assert receive(queuedSock, len(expected)) == expected
+
+
+def addClient(server):
+    # Connects a client, and sends it its doId range.
+    client, sock = connect(server)
+    server.sendQueuedTask(None)
+    return client
+
+
+def setInterest(server, client, zoneIds):
+    datagram = PyDatagram()
+    for zoneId in zoneIds:
+        datagram.addUint32(zoneId)
+    server.handleClientSetInterest(client, DatagramIterator(datagram))
+
+
+def createObject(server, owner, doId, zoneId):
+    # The bookkeeping of handleClientCreateObject(), without a dc class.
+    object = ServerRepository.Object(doId, zoneId, None)
+    owner.objectsByDoId[doId] = object
+    server.addObjectToZone(owner, object, zoneId)
+    return object
+
+
+def endFrame(server):
+    server.generateRequestTask(None)
+    server.sendQueuedTask(None)
+
+
+def messagesTo(client):
+    # Splits the messages queued for the client this frame.
+    messages = []
+    for data in client.pendingSends:
+        offset = 0
+        while offset < len(data):
+            length, = struct.unpack_from('<H', data, offset)
+            messages.append(data[offset + 2:offset + 2 + length])
+            offset += 2 + length
+    return messages
+
+
+def test_open_and_close_interest_in_one_frame(server):
+    owner = addClient(server)
+    other = addClient(server)
+    createObject(server, owner, owner.doIdBase + 1, 1)
+    endFrame(server)
+
+    setInterest(server, other, [1])
+    setInterest(server, other, [])
+    server.generateRequestTask(None)
+
+    # The owner isn't asked to generate its object for a client that is
+    # no longer interested in it.
+    assert messagesTo(owner) == []
+    assert server.pendingGenerateRequests == {}
+    assert other.currentInterestZoneIds == set()
+    assert server.zonesToClients == {1: {owner}}
+
+
+def test_move_object_across_explicit_interest(server):
+    owner = addClient(server)
+    other = addClient(server)
+    neighbor = addClient(server)
+    setInterest(server, owner, [1])
+    setInterest(server, other, [1])
+    object = createObject(server, owner, owner.doIdBase + 1, 1)
+    createObject(server, neighbor, neighbor.doIdBase + 1, 2)
+    endFrame(server)
+
+    server.setObjectZone(owner, object, 2)
+    server.generateRequestTask(None)
+
+    # The owner keeps its explicit interest in zone 1, and opens interest
+    # in zone 2, for which the neighbor is asked to generate its object.
+    assert owner.currentInterestZoneIds == {1, 2}
+    assert server.ownersByZoneId == {2: {owner, neighbor}}
+    assert messagesTo(neighbor) == [struct.pack('<HI', REQUEST_GENERATES_CMU, 2)]
+    assert messagesTo(other) == [struct.pack('<HI', OBJECT_DISABLE_CMU, object.doId)]
+    assert messagesTo(owner) == []
+    endFrame(server)
+
+    server.setObjectZone(owner, object, 1)
+    server.generateRequestTask(None)
+
+    # Only the interest in zone 2 is closed.
+    assert owner.currentInterestZoneIds == {1}
+    assert server.ownersByZoneId == {1: {owner}, 2: {neighbor}}
+    assert messagesTo(owner) == [struct.pack('<HI', OBJECT_DISABLE_CMU, neighbor.doIdBase + 1)]
+    assert messagesTo(neighbor) == [struct.pack('<HI', OBJECT_DISABLE_CMU, object.doId)]
+    assert messagesTo(other) == []
+
+
+def test_disconnect_with_pending_generate_requests(server):
+    owner = addClient(server)
+    other = addClient(server)
+    third = addClient(server)
+    createObject(server, owner, owner.doIdBase + 1, 1)
+    createObject(server, third, third.doIdBase + 1, 2)
+    endFrame(server)
+
+    setInterest(server, other, [1, 2])
+    setInterest(server, third, [1])
+    server.handleClientDisconnect(other)
+    server.handleClientDisconnect(owner)
+    server.generateRequestTask(None)
+
+    # Neither request is sent: one client that asked is gone, and so is
+    # the owner the other one asked.
+    assert messagesTo(third) == [struct.pack('<HI', OBJECT_DELETE_CMU, owner.doIdBase + 1)]
+    assert server.pendingGenerateRequests == {}
+    assert server.zonesToClients == {1: {third}, 2: {third}}
+    assert server.ownersByZoneId == {2: {third}}
+    assert server.needsSend == {third}
+
+
+def test_generate_requests_per_frame(server):
+    server.maxGenerateRequests = 2
+    owner = addClient(server)
+    other = addClient(server)
+    late = addClient(server)
+    for zoneId in range(1, 6):
+        createObject(server, owner, owner.doIdBase + zoneId, zoneId)
+    endFrame(server)
+
+    setInterest(server, other, range(1, 6))
+    # This request is merged with the one for the other client.
+    setInterest(server, late, [1])
+
+    requests = []
+    for frame in range(4):
+        server.generateRequestTask(None)
+        requests.append(messagesTo(owner))
+        server.sendQueuedTask(None)
+
+    # The oldest requests go first, two per frame.
+    assert requests == [
+        [struct.pack('<HI', REQUEST_GENERATES_CMU, zoneId) for zoneId in zoneIds]
+        for zoneIds in ([1, 2], [3, 4], [5], [])]
+
+
+# The smooth node fields of direct.dc, without its imports.
+smoothNodeDC = """
+dclass DistributedObject {
+};
+
+dclass DistributedSmoothNode: DistributedObject {
+  setComponentL(uint64) broadcast ram;
+  setComponentX(int16 / 10) broadcast ram;
+  setComponentY(int16 / 10) broadcast ram;
+  setComponentZ(int16 / 10) broadcast ram;
+  setComponentH(int16 % 360 / 10) broadcast ram;
+  setComponentP(int16 % 360 / 10) broadcast ram;
+  setComponentR(int16 % 360 / 10) broadcast ram;
+  setComponentT(int16 timestamp) broadcast ram;
+
+  setSmStop: setComponentT;
+  setSmH: setComponentH, setComponentT;
+  setSmZ: setComponentZ, setComponentT;
+  setSmXY: setComponentX, setComponentY, setComponentT;
+  setSmXZ: setComponentX, setComponentZ, setComponentT;
+  setSmPos: setComponentX, setComponentY, setComponentZ, setComponentT;
+  setSmHpr: setComponentH, setComponentP, setComponentR, setComponentT;
+  setSmXYH: setComponentX, setComponentY, setComponentH, setComponentT;
+  setSmXYZH: setComponentX, setComponentY, setComponentZ, setComponentH, setComponentT;
+  setSmPosHpr: setComponentX, setComponentY, setComponentZ, setComponentH, setComponentP, setComponentR, setComponentT;
+  setSmPosHprL: setComponentL, setComponentX, setComponentY, setComponentZ, setComponentH, setComponentP, setComponentR, setComponentT;
+};
+"""
+
+
+class FakeNode:
+    # Just enough of a NodePath for a QuantizedPosHprEncoder.
+    def __init__(self, pos):
+        self.pos = pos
+
+    def getPos(self):
+        return self.pos
+
+    def getHpr(self):
+        return (0, 0, 0)
+
+
+class BatchSender:
+    # Hands what a SmoothNodeBatch sends to the server, as from the client.
+    def __init__(self, server, client):
+        self.server = server
+        self.client = client
+
+    def sendDatagram(self, datagram):
+        dgi = DatagramIterator(datagram)
+        dgi.getUint16()
+        self.server.handleClientSmoothNodeBatch(self.client, dgi)
+
+
+def test_smooth_node_batch(server, tmp_path):
+    dcFileName = tmp_path / 'smooth.dc'
+    dcFileName.write_text(smoothNodeDC)
+    server.readDCFile([str(dcFileName)])
+    dclass = server.dclassesByName['DistributedSmoothNode']
+
+    owner = addClient(server)
+    other = addClient(server)
+    setInterest(server, other, [1])
+    doId = owner.doIdBase + 1
+    object = createObject(server, owner, doId, 1)
+    object.dclass = dclass
+    endFrame(server)
+
+    broadcaster = SmoothNodeBroadcaster()
+    batch = SmoothNodeBatch(BatchSender(server, owner), broadcaster)
+    node = FakeNode((0, 0, 0))
+    encoder = QuantizedPosHprEncoder(node, doId, lambda: 1, batch)
+    encoder.initialize()
+    node.pos = (1, 2, 0)
+    encoder.broadcastPosHpr()
+    broadcaster.sendBatches()
+
+    # The other client gets the update the entry stands for, and the
+    # owner the acknowledgement.
+    fieldId = dclass.getFieldByName('setSmPosHpr').getNumber()
+    message, = messagesTo(other)
+    assert message[:-2] == struct.pack('<HIIH6h', OBJECT_UPDATE_FIELD_CMU, owner.doIdBase,
+                                       doId, fieldId, 10, 20, 0, 0, 0, 0)
+    assert messagesTo(owner) == [struct.pack('<HH', SMOOTH_NODE_BATCH_ACK_CMU, 0)]
+    endFrame(server)
+
+    batch.handleAck(0)
+    node.pos = (1.5, 2, 0)
+    encoder.broadcastPosHpr()
+    broadcaster.sendBatches()
+    fieldId = dclass.getFieldByName('setSmXY').getNumber()
+    message, = messagesTo(other)
+    assert message[:-2] == struct.pack('<HIIH2h', OBJECT_UPDATE_FIELD_CMU, owner.doIdBase,
+                                       doId, fieldId, 15, 20)
+    broadcaster.destroy()
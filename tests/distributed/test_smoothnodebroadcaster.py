@@ -0,0 +1,215 @@
+from direct.distributed.MsgTypesCMU import CLIENT_SMOOTH_NODE_BATCH_CMU
+from direct.distributed.SmoothNodeBroadcaster import (
+    Absolute,
+    QuantizedPosHprEncoder,
+    SmoothNodeBatch,
+    SmoothNodeBatchDecoder,
+    SmoothNodeBroadcaster,
+)
+import pytest
+import struct
+
+
+class FakeNode:
+    # Just enough of a NodePath for a QuantizedPosHprEncoder.
+    def __init__(self, pos=(0, 0, 0), hpr=(0, 0, 0)):
+        self.pos = pos
+        self.hpr = hpr
+        self.location = 1
+
+    def getPos(self):
+        return self.pos
+
+    def getHpr(self):
+        return self.hpr
+
+    def getLocation(self):
+        return self.location
+
+
+class FakeRepository:
+    def __init__(self):
+        self.sent = []
+
+    def sendDatagram(self, datagram):
+        self.sent.append(bytes(datagram.getMessage()))
+
+
+@pytest.fixture
+def broadcaster():
+    broadcaster = SmoothNodeBroadcaster()
+    yield broadcaster
+    broadcaster.destroy()
+
+
+@pytest.fixture
+def batch(broadcaster):
+    return SmoothNodeBatch(FakeRepository(), broadcaster)
+
+
+def addNode(batch, doId, **kw):
+    node = FakeNode(**kw)
+    encoder = QuantizedPosHprEncoder(node, doId, node.getLocation, batch)
+    encoder.initialize()
+    return node, encoder
+
+
+def sendBatch(batch, broadcaster, decoder):
+    # Sends the batch as the broadcaster does at the end of a frame, and
+    # decodes it as the server does.  Returns the updates, without their
+    # timestamps, and the size of the batch.
+    numSent = len(batch.repository.sent)
+    broadcaster.sendBatches()
+    assert len(batch.repository.sent) == numSent + 1
+    data = batch.repository.sent[-1]
+    assert struct.unpack_from('<H', data) == (CLIENT_SMOOTH_NODE_BATCH_CMU, )
+    sequence, updates = decoder.decode(data[2:])
+    assert sequence == (batch.sequence - 1) & 0xffff
+    updates = [(doId, fieldName, struct.unpack('<%sh' % (len(args) // 2 - 1), args[:-2]))
+               if fieldName != 'setSmPosHprL' else
+               (doId, fieldName, struct.unpack('<Q6h', args[:-2]))
+               for doId, fieldName, args in updates]
+    return updates, len(data)
+
+
+def test_batch_round_trip(batch, broadcaster):
+    decoder = SmoothNodeBatchDecoder()
+    walker, walkerEncoder = addNode(batch, 1000001, pos=(1, 2, 3), hpr=(90, 0, 0))
+    stander, standerEncoder = addNode(batch, 1000002, pos=(-4, 5, 0))
+
+    # The first positions are sent whole, in one batch.
+    walkerEncoder.sent = standerEncoder.sent = None
+    walkerEncoder.broadcastPosHpr()
+    standerEncoder.broadcastPosHpr()
+    assert sendBatch(batch, broadcaster, decoder)[0] == [
+        (1000001, 'setSmPosHpr', (10, 20, 30, 900, 0, 0)),
+        (1000002, 'setSmPosHpr', (-40, 50, 0, 0, 0, 0))]
+    batch.handleAck(batch.sequence - 1)
+
+    walker.pos = (1.5, 2.5, 3)
+    walker.hpr = (95, 0, 0)
+    walkerEncoder.broadcastPosHpr()
+    standerEncoder.broadcastPosHpr()
+    updates, size = sendBatch(batch, broadcaster, decoder)
+    assert updates == [
+        (1000001, 'setSmXYH', (15, 25, 950)),
+        (1000002, 'setSmStop', ())]
+    # A header, an entry with three int8 deltas, and a stop.
+    assert size == 8 + 8 + 5
+
+    # Only one stop is sent, and nothing else while standing.
+    walkerEncoder.broadcastPosHpr()
+    standerEncoder.broadcastPosHpr()
+    assert sendBatch(batch, broadcaster, decoder)[0] == [(1000001, 'setSmStop', ())]
+    walkerEncoder.broadcastPosHpr()
+    standerEncoder.broadcastPosHpr()
+    broadcaster.sendBatches()
+    assert len(batch.repository.sent) == 3
+
+
+def test_deltas_against_acknowledged_position(batch, broadcaster):
+    decoder = SmoothNodeBatchDecoder()
+    node, encoder = addNode(batch, 1000001)
+    encoder.sent = None
+    encoder.broadcastPosHpr()
+    sendBatch(batch, broadcaster, decoder)
+    batch.handleAck(0)
+
+    # Neither of these is acknowledged, so both deltas are taken against
+    # the first position.
+    node.pos = (1, 0, 0)
+    encoder.broadcastPosHpr()
+    assert sendBatch(batch, broadcaster, decoder)[0] == [(1000001, 'setSmXY', (10, 0))]
+    node.pos = (2, 0, 0)
+    encoder.broadcastPosHpr()
+    assert sendBatch(batch, broadcaster, decoder)[0] == [(1000001, 'setSmXY', (20, 0))]
+    assert encoder.acked == (0, 0, 0, 0, 0, 0)
+
+    batch.handleAck(2)
+    assert encoder.acked == (20, 0, 0, 0, 0, 0)
+    assert not batch.unacked
+    node.pos = (2, 1, 0)
+    encoder.broadcastPosHpr()
+    assert sendBatch(batch, broadcaster, decoder)[0] == [(1000001, 'setSmXY', (20, 10))]
+    # The server no longer keeps what came before the acknowledged one.
+    assert [sequence for sequence, position in decoder.positions[1000001]] == [2, 3]
+
+    # Back where it was when last acknowledged.
+    node.pos = (2, 0, 0)
+    encoder.broadcastPosHpr()
+    assert sendBatch(batch, broadcaster, decoder)[0] == [(1000001, 'setSmXY', (20, 0))]
+
+
+def test_heading_wraps_around(batch, broadcaster):
+    decoder = SmoothNodeBatchDecoder()
+    node, encoder = addNode(batch, 1000001, hpr=(359.9, 0, 0))
+    encoder.sent = None
+    encoder.broadcastPosHpr()
+    sendBatch(batch, broadcaster, decoder)
+    batch.handleAck(0)
+
+    node.hpr = (360.1, 0, 0)
+    encoder.broadcastPosHpr()
+    updates, size = sendBatch(batch, broadcaster, decoder)
+    assert updates == [(1000001, 'setSmH', (1, ))]
+    assert size == 8 + 6
+
+    # Turning all the way around sends nothing but a stop.
+    node.hpr = (720.1, 0, 0)
+    encoder.broadcastPosHpr()
+    assert sendBatch(batch, broadcaster, decoder)[0] == [(1000001, 'setSmStop', ())]
+
+
+def test_large_move_is_absolute(batch, broadcaster):
+    decoder = SmoothNodeBatchDecoder()
+    node, encoder = addNode(batch, 1000001)
+    encoder.sent = None
+    encoder.broadcastPosHpr()
+    sendBatch(batch, broadcaster, decoder)
+    batch.handleAck(0)
+
+    node.pos = (0, 100, -0.5)
+    encoder.broadcastPosHpr()
+    updates, size = sendBatch(batch, broadcaster, decoder)
+    assert updates == [(1000001, 'setSmPos', (0, 1000, -5))]
+    assert batch.repository.sent[-1][8 + 4] == Absolute | 0x06
+    assert size == 8 + 5 + 4
+
+    node.pos = (0, 4000, 0)
+    with pytest.raises(ValueError):
+        encoder.broadcastPosHpr()
+
+
+def test_location_change_sends_everything(batch, broadcaster):
+    decoder = SmoothNodeBatchDecoder()
+    node, encoder = addNode(batch, 1000001, pos=(1, 0, 0))
+    encoder.sent = None
+    encoder.broadcastPosHpr()
+    sendBatch(batch, broadcaster, decoder)
+    batch.handleAck(0)
+
+    node.location = 2
+    encoder.broadcastPosHpr()
+    assert sendBatch(batch, broadcaster, decoder)[0] == [
+        (1000001, 'setSmPosHprL', (2, 10, 0, 0, 0, 0, 0))]
+
+    node.location = 3
+    node.pos = (1, 1, 0)
+    encoder.broadcastPosHpr()
+    assert sendBatch(batch, broadcaster, decoder)[0] == [
+        (1000001, 'setSmPosHprL', (3, 10, 10, 0, 0, 0, 0))]
+
+
+def test_decoder_ignores_delta_without_baseline(batch, broadcaster):
+    node, encoder = addNode(batch, 1000001)
+    encoder.sent = None
+    encoder.broadcastPosHpr()
+    broadcaster.sendBatches()
+    batch.handleAck(0)
+    node.pos = (1, 0, 0)
+    encoder.broadcastPosHpr()
+    broadcaster.sendBatches()
+
+    # A server that missed the first batch can't decode the second.
+    decoder = SmoothNodeBatchDecoder()
+    assert decoder.decode(batch.repository.sent[1][2:]) == (1, [])
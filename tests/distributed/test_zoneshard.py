@@ -0,0 +1,149 @@
+from direct.distributed.MsgTypesCMU import OBJECT_DISABLE_CMU, REQUEST_GENERATES_CMU
+from direct.distributed.ZoneShard import ShardRouter
+import pytest
+import struct
+
+
+def messagesTo(output, doIdBase):
+    # Splits the framed data sent to the client into its messages.
+    messages = []
+    for recipient, data, unlessZoneId in output:
+        if recipient != doIdBase:
+            continue
+        offset = 0
+        while offset < len(data):
+            length, = struct.unpack_from('<H', data, offset)
+            messages.append(data[offset + 2:offset + 2 + length])
+            offset += 2 + length
+    return messages
+
+
+def disabledDoIds(output, doIdBase):
+    # Returns the doIds of the disables sent to the client.
+    doIds = []
+    for data in messagesTo(output, doIdBase):
+        msgType, = struct.unpack_from('<H', data)
+        if msgType == OBJECT_DISABLE_CMU:
+            doIds.extend(struct.unpack_from('<%sI' % ((len(data) - 2) // 4), data, 2))
+    return doIds
+
+
+@pytest.fixture(params=['inline', 'thread', 'process'])
+def router(request):
+    router = ShardRouter(2, request.param)
+    yield router
+    router.destroy()
+
+
+def test_move_object_across_shards(router):
+    # Zones 1 and 2 are on different shards.
+    assert router.getShardIndex(1) != router.getShardIndex(2)
+
+    owner = router.addClient(1000000)
+    other = router.addClient(2000000)
+    router.setInterest(other, [1])
+    router.createObject(owner, 1000005, 1, 1, b'generate')
+    router.flush()
+    router.collect(wait=True)
+
+    router.setObjectZone(owner, 1000005, 2)
+    router.flush()
+    output = router.collect(wait=True)
+
+    # The owner is not told to disable its own object, but the client
+    # that can no longer see it is.
+    assert disabledDoIds(output, owner.doIdBase) == []
+    assert disabledDoIds(output, other.doIdBase) == [1000005]
+    assert owner.currentInterestZoneIds == {2}
+
+
+def test_drop_interest_in_empty_zone(router):
+    client = router.addClient(1000000)
+    router.setInterest(client, [1, 2])
+    router.flush()
+    router.collect(wait=True)
+
+    router.setInterest(client, [])
+    router.flush()
+    assert router.collect(wait=True) == []
+
+
+def test_collect_without_waiting_under_load(router):
+    # Every client in one zone sends an update each frame, and the output
+    # is only collected as it becomes available, as shardPollTask does.
+    # This is far more output than a pipe holds.
+    clients = [router.addClient((i + 1) * 1000000) for i in range(1000)]
+    for client in clients:
+        router.setInterest(client, [1])
+        router.createObject(client, client.doIdBase + 1, 1, 1, b'generate')
+    router.flush()
+    router.collect(wait=True)
+
+    numBytes = 0
+    for frame in range(10):
+        for client in clients:
+            router.broadcast(client.doIdBase + 1, (client.doIdBase, ), bytes(32))
+        router.flush()
+        for doIdBase, data, unlessZoneId in router.collect(wait=False):
+            numBytes += len(data)
+    for doIdBase, data, unlessZoneId in router.collect(wait=True):
+        numBytes += len(data)
+    # Each update reaches every other client, with a 2-byte header.
+    assert numBytes == 10 * len(clients) * (len(clients) - 1) * 34
+
+
+def test_messages_keep_their_order(router):
+    owner = router.addClient(1000000)
+    other = router.addClient(2000000)
+    router.setInterest(other, [1])
+    router.createObject(owner, 1000005, 1, 1, b'generate')
+    router.broadcast(1000005, (), b'update')
+    router.setObjectZone(owner, 1000005, 2)
+    router.broadcast(1000005, (), b'moved')
+    router.flush()
+    output = router.collect(wait=True)
+
+    # The owner opening interest in zone 1 asks the other client for its
+    # objects there.  The disable is sent separately, since it depends
+    # on the client's interest in the new zone, but after what was sent
+    # before it.
+    assert messagesTo(output, other.doIdBase) == [
+        struct.pack('<HI', REQUEST_GENERATES_CMU, 1), b'generate', b'update', struct.pack('<HI', OBJECT_DISABLE_CMU, 1000005)]
+    assert [unless for doIdBase, data, unless in output
+            if doIdBase == other.doIdBase] == [None, 2]
+
+
+def test_targeted_update_follows_generate(router):
+    owner = router.addClient(1000000)
+    other = router.addClient(2000000)
+    router.setInterest(other, [1])
+    router.flush()
+    router.collect(wait=True)
+
+    # The update is sent in the same frame as the generate, and must not
+    # overtake it.
+    router.createObject(owner, 1000005, 1, 1, b'generate')
+    router.sendToClient(1000005, other.doIdBase, b'targeted')
+    router.sendToClient(1000005, owner.doIdBase, b'p2p')
+    router.flush()
+    output = router.collect(wait=True)
+
+    assert messagesTo(output, other.doIdBase) == [
+        struct.pack('<HI', REQUEST_GENERATES_CMU, 1), b'generate', b'targeted']
+    assert messagesTo(output, owner.doIdBase) == [b'p2p']
+
+
+def test_message_too_long_for_header(router):
+    client = router.addClient(1000000)
+    router.setInterest(client, [1])
+    router.flush()
+    router.collect(wait=True)
+
+    router.sendToZoneExcept(1, (), bytes(70000))
+    router.setTcpHeaderSize(4)
+    router.sendToZoneExcept(1, (), bytes(70000))
+    router.flush()
+    output = router.collect(wait=True)
+    assert (None, 70000, None) in output
+    assert [len(data) for doIdBase, data, unless in output
+            if doIdBase == client.doIdBase] == [70004]
@@ -0,0 +1,55 @@
+from direct.showbase.JobManager import JobManager
+from direct.showbase import GarbageReport
+import gc
+import pytest
+
+
+@pytest.fixture
+def jobMgr(monkeypatch):
+    jobMgr = JobManager(isolatedBackend='none')
+    monkeypatch.setattr(GarbageReport, 'jobMgr', jobMgr)
+    # so that only the reports collect the garbage
+    gc.disable()
+    yield jobMgr
+    gc.enable()
+    GarbageReport.GarbageReport.releaseAnalyzedGarbage()
+    jobMgr.destroy()
+
+
+class Marker:
+    pass
+
+
+def makeCycle(name):
+    # Makes a garbage cycle of two Markers with the given name.
+    a = Marker()
+    b = Marker()
+    a.name = b.name = name
+    a.other = b
+    b.other = a
+
+
+def liveMarkerNames():
+    # The gc clears weak references to garbage, even when it is saved, so
+    # look for the Markers among all objects.
+    return sorted(obj.name for obj in gc.get_objects() if type(obj) is Marker)
+
+
+def garbageMarkerNames(report):
+    return sorted(obj.name for obj in report.getGarbage() if type(obj) is Marker)
+
+
+def test_incremental_reports_free_analyzed_garbage(jobMgr):
+    makeCycle('first')
+    report = GarbageReport.GarbageReport('first', log=False, incremental=True)
+    assert garbageMarkerNames(report) == ['first', 'first']
+    report.destroy()
+    # kept alive, so that the next report doesn't find it again
+    assert liveMarkerNames() == ['first', 'first']
+
+    makeCycle('second')
+    report = GarbageReport.GarbageReport('second', log=False, incremental=True)
+    assert garbageMarkerNames(report) == ['second', 'second']
+    report.destroy()
+    # the garbage of the first report was freed by the second
+    assert liveMarkerNames() == ['second', 'second']
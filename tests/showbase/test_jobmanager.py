@@ -0,0 +1,121 @@
+from direct.showbase.DirectObject import DirectObject
+from direct.showbase.Job import Job, IsolatedJob
+from direct.showbase.JobManager import JobManager
+from direct.showbase import ContainerLeakDetector
+from direct.showbase import GarbageReport
+from array import array
+import pytest
+import types
+
+
+# grows between heap snapshots, see test_heap_snapshot_finds_growing_list()
+growingList = []
+
+
+def countTo(num):
+    # Isolated work, so it is at the top level of the module.
+    for i in range(num):
+        yield Job.Continue
+        yield i
+    yield Job.Done
+
+
+@pytest.fixture(params=['none', 'thread', 'process'])
+def jobMgr(request):
+    jobMgr = JobManager(timeslice=.01, isolatedBackend=request.param, numIsolatedWorkers=2)
+    yield jobMgr
+    jobMgr.destroy()
+
+
+def runUntilFinished(jobMgr, job):
+    # Steps the JobManager's tasks by hand, for a job that waits on others.
+    task = types.SimpleNamespace(cont=1)
+    while not job.isFinished():
+        jobMgr._process(task)
+        jobMgr._processIsolated(task)
+
+
+def test_isolated_job_result_event(jobMgr):
+    job = IsolatedJob('count', countTo, (3, ))
+    listener = DirectObject()
+    results = []
+    finished = []
+    listener.accept(job.getResultEvent(), results.append)
+    listener.accept(job.getFinishedEvent(), lambda: finished.append(results[:]))
+    jobMgr.add(job)
+    jobMgr.finish(job)
+    listener.ignoreAll()
+
+    assert finished == [[0, 1, 2]]
+    assert job.isFinished()
+
+
+@pytest.mark.parametrize('threaded', [False, True])
+def test_garbage_report_finds_cycles(jobMgr, threaded, monkeypatch):
+    monkeypatch.setattr(GarbageReport, 'jobMgr', jobMgr)
+    handled = []
+    handleComponentCycles = GarbageReport.GarbageReport._handleComponentCycles
+    def spy(self, componentCycles):
+        handled.append(componentCycles)
+        handleComponentCycles(self, componentCycles)
+    monkeypatch.setattr(GarbageReport.GarbageReport, '_handleComponentCycles', spy)
+
+    GarbageReport._createGarbage(2)
+    report = GarbageReport.GarbageReport('test', log=False, threaded=threaded)
+    try:
+        if threaded:
+            runUntilFinished(jobMgr, report)
+        # the cycles came back through the result event of the isolated job
+        assert len(handled) == 1
+        desc2num = report.getDesc2numDict()
+        for cls in (GarbageReport.FakeObject, GarbageReport.FakeDelObject):
+            assert sum(num for desc, num in desc2num.items()
+                       if desc.startswith(cls.__name__ + '.')) >= 2
+        for component in report.getComponents():
+            assert component == sorted(component)
+    finally:
+        report.destroy()
+
+
+class FakeLeakDetector:
+    # Just enough of a ContainerLeakDetector for its HeapSnapshot jobs.
+    notify = ContainerLeakDetector.ContainerLeakDetector.notify
+
+    def __init__(self):
+        self._snapshotPeriods = 2
+        self._snapshotMinLength = 5
+        self._snapshotIndex = 0
+        self._snapshotIds = array('Q')
+        self._snapshotLengths = array('q')
+        self._snapshotTypeCounts = {}
+        self._snapshotGrowth = {}
+        self._snapshotTypeGrowth = {}
+        for table in (self._snapshotTypeCounts, self._snapshotGrowth,
+                      self._snapshotTypeGrowth):
+            ContainerLeakDetector.ContainerLeakDetector.addPrivateObj(table)
+
+    def getLeakEvent(self):
+        return 'test-leak'
+
+
+def test_heap_snapshot_finds_growing_list(jobMgr, monkeypatch):
+    monkeypatch.setattr(ContainerLeakDetector, 'jobMgr', jobMgr)
+    leakDetector = FakeLeakDetector()
+    listener = DirectObject()
+    leaks = []
+    listener.accept(leakDetector.getLeakEvent(),
+                    lambda container, name: leaks.append((container, name)))
+    try:
+        for i in range(3):
+            growingList.extend(range(10))
+            snapshot = ContainerLeakDetector.HeapSnapshot('test-%s' % i, leakDetector)
+            jobMgr.add(snapshot)
+            runUntilFinished(jobMgr, snapshot)
+            snapshot.destroy()
+    finally:
+        listener.ignoreAll()
+        del growingList[:]
+
+    # it grew in the second and third snapshot
+    assert [name for container, name in leaks if container is growingList] == [
+        '%s.growingList' % __name__]
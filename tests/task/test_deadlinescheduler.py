@@ -0,0 +1,112 @@
+from direct.task import Task
+from direct.task.DeadlineScheduler import DeadlineScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.frame = 0
+        self.time = 0.0
+
+    def getFrameCount(self):
+        return self.frame
+
+    def getRealTime(self):
+        return self.time
+
+    def getFrameTime(self):
+        return self.time
+
+
+class FakeTaskManager:
+    # Just enough of a TaskManager to step the scheduler by hand.
+    def __init__(self):
+        self.globalClock = FakeClock()
+        self.function = None
+
+    def add(self, function, name, sort=None, taskChain=None):
+        self.function = function
+        return self
+
+    def remove(self):
+        pass
+
+    cont = Task.cont
+
+    def step(self):
+        self.function(self)
+        self.globalClock.frame += 1
+
+
+def test_deadline_task_returns_task_done():
+    taskMgr = FakeTaskManager()
+    scheduler = DeadlineScheduler(taskMgr)
+    runs = []
+
+    def work(task):
+        runs.append(task)
+        return task.done
+
+    task = scheduler.add(work, 'work')
+    taskMgr.step()
+    taskMgr.step()
+
+    assert runs == [task]
+    assert scheduler.getTasks() == []
+    scheduler.destroy()
+
+
+def test_deadline_task_returns_task_cont():
+    taskMgr = FakeTaskManager()
+    scheduler = DeadlineScheduler(taskMgr)
+    runs = []
+
+    def work(task):
+        runs.append(task)
+        return task.cont
+
+    task = scheduler.add(work, 'work')
+    taskMgr.step()
+    taskMgr.step()
+
+    assert runs == [task, task]
+    assert scheduler.getTasks() == [task]
+    scheduler.destroy()
+
+
+def test_deadline_task_raises():
+    taskMgr = FakeTaskManager()
+    # With a frame target of 0, every frame is over its target, so due
+    # tasks with a priority of 0 are deferred.
+    scheduler = DeadlineScheduler(taskMgr, frameTarget=0)
+    runs = []
+    failures = [ValueError()]
+
+    def work(task):
+        runs.append(task.name)
+        return task.cont
+
+    def fail(task):
+        runs.append(task.name)
+        if failures:
+            raise failures.pop()
+        return task.cont
+
+    deferred = scheduler.add(work, 'deferred', priority=0)
+    taskMgr.globalClock.frame += 1
+    scheduler.add(work, 'ran', priority=2)
+    scheduler.add(fail, 'fail', priority=1)
+    try:
+        taskMgr.step()
+    except ValueError:
+        pass
+    else:
+        assert False, 'expected a ValueError'
+    assert runs == ['ran', 'fail']
+
+    # None of the tasks taken off the heap before the error were lost.
+    del runs[:]
+    deferred.priority = 1
+    taskMgr.globalClock.frame += 1
+    taskMgr.step()
+    assert sorted(runs) == ['deferred', 'fail', 'ran']
+    scheduler.destroy()